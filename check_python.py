@@ -22,6 +22,7 @@ def check_python_installation():
     # Check required packages
     required_packages = [
         'PIL',  # Pillow
+        'numpy',
         'bs4',  # BeautifulSoup4
         'imgkit',
         'mammoth',
@@ -37,6 +38,9 @@ def check_python_installation():
             if package == 'PIL':
                 import PIL
                 print(f"✓ Pillow (PIL): {PIL.__version__}")
+            elif package == 'numpy':
+                import numpy
+                print(f"✓ numpy: {numpy.__version__}")
             elif package == 'bs4':
                 import bs4
                 print(f"✓ BeautifulSoup4: {bs4.__version__}")
@@ -2,6 +2,7 @@
 echo Installing Python dependencies for DOCX to Image processor...
 
 pip install Pillow
+pip install numpy
 pip install beautifulsoup4
 pip install imgkit
 pip install mammoth
@@ -4,6 +4,7 @@ echo "Installing Python dependencies for DOCX to Image processor..."
 
 # Install Python packages
 pip install Pillow>=8.0.0
+pip install numpy>=1.20
 pip install beautifulsoup4>=4.9.0
 pip install imgkit>=1.2.0
 pip install mammoth>=1.4.0
@@ -0,0 +1,137 @@
+"""
+Compare output encoders on rendered question images.
+
+Each pipeline renders a synthetic document once, losslessly (PNG, 'fast'
+preset), through pipeline_runner.py. Every image is then encoded in memory
+with each format and preset of common/encoders.py. The report gives, per
+pipeline and combination, the encode time and the bytes per question, so a
+preset can be picked for throughput or for bandwidth.
+
+Usage:
+    python scripts/bench/encoder_bench.py --questions 40 --output encoders.json
+    python scripts/bench/encoder_bench.py --images conversions/paper --repeat 5
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.abspath(os.path.join(BENCH_DIR, '..')))
+from PIL import Image
+
+from common import encoders, canvas
+from synth_docx import KIND_FOR_VARIANT, generate_docx
+from pipeline_runner import VARIANTS
+from run_bench import summarize
+from golden import IMAGE_EXTENSIONS
+
+
+def load_images(root):
+    """Decoded images under root, in a stable order"""
+    images = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with Image.open(os.path.join(dirpath, name)) as img:
+                    img.load()
+                    images.append(img.copy())
+    return images
+
+
+def render_variant(variant, questions, workdir, seed=1):
+    """Render a synthetic document losslessly with one pipeline; returns its images"""
+    docx_path = os.path.join(workdir, f'{variant}.docx')
+    generate_docx(docx_path, kind=KIND_FOR_VARIANT[variant], questions=questions, seed=seed)
+    env = dict(os.environ)
+    env[encoders.FORMAT_ENV] = 'png'
+    env[encoders.PRESET_ENV] = 'fast'
+    for key in ('DOC2VIZ_PROGRESS_FD', 'DOC2VIZ_PROFILE_DIR'):
+        env.pop(key, None)
+    run_dir = os.path.join(workdir, variant)
+    subprocess.run([sys.executable, os.path.join(BENCH_DIR, 'pipeline_runner.py'), variant, docx_path, run_dir,
+                    '--result', os.path.join(workdir, f'{variant}.result.json'), '--no-archive'],
+                   env=env, stdout=subprocess.DEVNULL, check=True)
+    return load_images(os.path.join(run_dir, 'images'))
+
+
+def bench_images(images, repeat=3):
+    """{format: {preset: stats}} for a list of images"""
+    results = {}
+    for fmt, presets in encoders.PRESETS.items():
+        results[fmt] = {}
+        for preset in presets:
+            encoder = encoders.Encoder(fmt, preset)
+            times = []
+            sizes = []
+            for img in images:
+                best = None
+                for _ in range(repeat):
+                    buf = io.BytesIO()
+                    start = time.perf_counter()
+                    encoder.encode(img, buf)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                times.append(best)
+                sizes.append(buf.tell())
+            results[fmt][preset] = {
+                'encode_ms': summarize(times),
+                'bytes': summarize(sizes),
+                'total_ms': round(sum(times), 3),
+                'total_bytes': sum(sizes),
+            }
+    return results
+
+
+def print_table(label, n, results):
+    print(f"\n{label}: {n} images, canvas mode {canvas.setting()}")
+    print(f"{'format':<15}{'preset':<10}{'ms/image':>10}{'p90 ms':>10}{'KiB/image':>11}")
+    for fmt, presets in results.items():
+        for preset, stats in presets.items():
+            if stats['encode_ms'] is None:
+                continue
+            print(f"{fmt:<15}{preset:<10}{stats['encode_ms']['mean']:>10.2f}{stats['encode_ms']['p90']:>10.2f}"
+                  f"{stats['bytes']['mean'] / 1024:>11.1f}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Encode time versus bytes per question for each output encoder')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--questions', type=int, default=40, help='Questions per synthetic document')
+    parser.add_argument('--images', default=None, help='Benchmark the images in this directory instead of rendering')
+    parser.add_argument('--repeat', type=int, default=3, help='Encodes per image; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='Write the JSON report here')
+    args = parser.parse_args()
+
+    report = {'repeat': args.repeat, 'canvas': canvas.setting(), 'results': {}}
+    if args.images:
+        images = load_images(args.images)
+        report['results']['images'] = {'count': len(images), 'encoders': bench_images(images, args.repeat)}
+        print_table(args.images, len(images), report['results']['images']['encoders'])
+    else:
+        workdir = tempfile.mkdtemp(prefix='doc2viz-encoder-bench-')
+        try:
+            for variant in args.variants:
+                images = render_variant(variant, args.questions, workdir, args.seed)
+                results = bench_images(images, args.repeat)
+                report['results'][variant] = {'count': len(images), 'encoders': results}
+                print_table(variant, len(images), results)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\nReport written to {os.path.abspath(args.output)}")
+
+
+if __name__ == '__main__':
+    main()
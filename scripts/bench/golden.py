@@ -0,0 +1,208 @@
+"""
+Golden-output regression check for the pipelines.
+
+Runs every document of golden_corpus.json through its pipeline and compares
+the results against stored baselines in golden/<name>/:
+    - cleaned.md, cleaned.json and visuals.json must match exactly
+      (after replacing the per-run working directory with $WORKDIR)
+    - rendered images must have the same size and a perceptual hash
+      (difference hash) within --max-distance bits of the baseline
+
+Corpus entries either generate a synthetic document ("generate": synth_docx
+arguments) or point at a DOCX file ("docx": path relative to this file).
+Documents run in parallel, one subprocess each.
+
+Usage:
+    python scripts/bench/golden.py record            # (re)write baselines
+    python scripts/bench/golden.py check             # exit 1 on any difference
+    python scripts/bench/golden.py check --only mcq-basic solutions-basic
+"""
+import os
+import sys
+import json
+import shutil
+import difflib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from synth_docx import KIND_FOR_VARIANT, generate_docx
+from run_bench import run_once
+
+CORPUS_FILE = os.path.join(BENCH_DIR, 'golden_corpus.json')
+BASELINE_DIR = os.path.join(BENCH_DIR, 'golden')
+
+TEXT_ARTIFACTS = ('cleaned_md', 'cleaned_json', 'visuals_json')
+BASELINE_NAMES = {'cleaned_md': 'cleaned.md', 'cleaned_json': 'cleaned.json', 'visuals_json': 'visuals.json'}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+HASH_SIZE = 16
+WORKDIR_TOKEN = '$WORKDIR'
+
+
+def dhash(path, hash_size=HASH_SIZE):
+    """Difference hash: one bit per horizontally adjacent pixel pair of a small grayscale thumbnail"""
+    with Image.open(path) as img:
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = small.tobytes()
+        size = img.size
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return size, format(bits, f'0{hash_size * hash_size // 4}x')
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def normalize_text(text, workdir):
+    """Strip the per-run working directory so baselines do not depend on where they were recorded"""
+    for prefix in {workdir, os.path.realpath(workdir)}:
+        text = text.replace(prefix, WORKDIR_TOKEN)
+        # JSON escapes backslashes in Windows paths
+        text = text.replace(json.dumps(prefix)[1:-1], WORKDIR_TOKEN)
+    return text
+
+
+def collect(result, workdir):
+    """Normalized text artifacts and image hashes of one pipeline run"""
+    texts = {}
+    for key in TEXT_ARTIFACTS:
+        path = result['artifacts'][key]
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                texts[key] = normalize_text(f.read(), workdir)
+        else:
+            texts[key] = None
+    images = {}
+    images_dir = result['artifacts']['images_dir']
+    for dirpath, _, filenames in os.walk(images_dir):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, filename)
+                size, digest = dhash(path)
+                images[os.path.relpath(path, images_dir).replace(os.sep, '/')] = {'size': list(size), 'dhash': digest}
+    return texts, dict(sorted(images.items()))
+
+
+def load_corpus(only=None):
+    with open(CORPUS_FILE, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    if only:
+        unknown = set(only) - {entry['name'] for entry in corpus}
+        if unknown:
+            raise SystemExit(f"Unknown corpus entries: {', '.join(sorted(unknown))}")
+        corpus = [entry for entry in corpus if entry['name'] in only]
+    return corpus
+
+
+def run_entry(entry, root):
+    workdir = os.path.join(root, entry['name'])
+    os.makedirs(workdir, exist_ok=True)
+    if 'docx' in entry:
+        docx_path = os.path.join(BENCH_DIR, entry['docx'])
+    else:
+        docx_path = os.path.join(workdir, f"{entry['name']}.docx")
+        generate_docx(docx_path, kind=KIND_FOR_VARIANT[entry['variant']], **entry['generate'])
+    result = run_once(entry['variant'], docx_path, workdir)
+    if 'error' in result:
+        return None, result['error']
+    return collect(result, os.path.join(workdir, 'run')), None
+
+
+def record(entry, texts, images):
+    target = os.path.join(BASELINE_DIR, entry['name'])
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    for key, text in texts.items():
+        if text is not None:
+            with open(os.path.join(target, BASELINE_NAMES[key]), 'w', encoding='utf-8') as f:
+                f.write(text)
+    with open(os.path.join(target, 'images.json'), 'w', encoding='utf-8') as f:
+        json.dump(images, f, indent=2)
+
+
+def check(entry, texts, images, max_distance):
+    """List of human-readable differences against the stored baseline"""
+    target = os.path.join(BASELINE_DIR, entry['name'])
+    if not os.path.isdir(target):
+        return [f"no baseline in {target} (run 'golden.py record' first)"]
+    problems = []
+    for key, text in texts.items():
+        path = os.path.join(target, BASELINE_NAMES[key])
+        expected = None
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                expected = f.read()
+        if expected == text:
+            continue
+        if expected is None or text is None:
+            problems.append(f"{BASELINE_NAMES[key]}: {'missing in baseline' if expected is None else 'not produced'}")
+            continue
+        diff = list(difflib.unified_diff(expected.splitlines(), text.splitlines(), 'baseline', 'current', lineterm='', n=1))
+        problems.append(f"{BASELINE_NAMES[key]} differs:\n    " + '\n    '.join(diff[:40]))
+    with open(os.path.join(target, 'images.json'), 'r', encoding='utf-8') as f:
+        expected_images = json.load(f)
+    for name in sorted(set(expected_images) | set(images)):
+        old, new = expected_images.get(name), images.get(name)
+        if old is None or new is None:
+            problems.append(f"image {name}: {'unexpected' if old is None else 'missing'}")
+        elif old['size'] != new['size']:
+            problems.append(f"image {name}: size {old['size']} -> {new['size']}")
+        else:
+            distance = hamming(old['dhash'], new['dhash'])
+            if distance > max_distance:
+                problems.append(f"image {name}: perceptual hash distance {distance} > {max_distance}")
+    return problems
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Record or check golden pipeline outputs')
+    parser.add_argument('mode', choices=('record', 'check'))
+    parser.add_argument('--only', nargs='+', default=None, help='Corpus entry names to run')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 2, help='Documents to run in parallel')
+    parser.add_argument('--max-distance', type=int, default=8,
+                        help=f'Allowed differing bits out of {HASH_SIZE * HASH_SIZE} in image hashes')
+    parser.add_argument('--keep', default=None, help='Keep working directories in this directory')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.only)
+    root = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp(prefix='doc2viz-golden-')
+    os.makedirs(root, exist_ok=True)
+    failures = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            outcomes = list(pool.map(lambda entry: run_entry(entry, root), corpus))
+        for entry, (collected, error) in zip(corpus, outcomes):
+            if error:
+                failures += 1
+                print(f"FAIL {entry['name']}: pipeline error: {error}")
+                continue
+            texts, images = collected
+            if args.mode == 'record':
+                record(entry, texts, images)
+                print(f"recorded {entry['name']} ({len(images)} images)")
+                continue
+            problems = check(entry, texts, images, args.max_distance)
+            if problems:
+                failures += 1
+                print(f"FAIL {entry['name']}")
+                for problem in problems:
+                    print(f"  - {problem}")
+            else:
+                print(f"ok   {entry['name']}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    print(f"\n{len(corpus) - failures}/{len(corpus)} documents {'recorded' if args.mode == 'record' else 'match'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
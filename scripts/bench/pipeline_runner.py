@@ -0,0 +1,194 @@
+"""
+Run one DOCX through a pipeline package stage by stage, in-process.
+
+The packages import their siblings by bare module name (md_cleaner,
+md_to_json, ...), so only one package can be loaded per interpreter. The
+benchmark and golden tools therefore start this script once per document:
+
+    python scripts/bench/pipeline_runner.py mcq_section paper.docx workdir --result result.json
+
+The stages mirror the __main__ block of each wordToMD.py, except that
+images are rendered in-process into <workdir>/images instead of through
+json_to_question_images.py, so nothing is written under conversions/.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import importlib
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, SCRIPTS_DIR)
+from common import artifacts, progress, profiling, docx_media, encoders, preview
+
+VARIANTS = ('mcq_section', 'mock_questions', 'question_passage', 'solutions_mock')
+
+# Folder used for questions without a section heading, per renderer main()
+DEFAULT_SECTION_DIR = {
+    'mcq_section': '',
+    'mock_questions': 'default',
+    'question_passage': '',
+    'solutions_mock': '',
+}
+
+FONT_PATH = os.path.join(SCRIPTS_DIR, 'dejavu-fonts-ttf-2.37', 'ttf', 'DejaVuSans.ttf')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_kb(children=False):
+    """High-water mark of resident memory in KiB, or None where unsupported"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+
+def load_variant(variant):
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown pipeline: {variant}")
+    sys.path.insert(0, os.path.join(SCRIPTS_DIR, variant))
+    return {name: importlib.import_module(name) for name in
+            ('wordToMD', 'md_cleaner', 'md_to_json', 'json_to_question_images')}
+
+
+def parse_text(variant, md_to_json, cleaned_content, visuals):
+    """parse_cleaned_markdown_text called the way each wordToMD.py __main__ calls it"""
+    if variant == 'mcq_section':
+        return md_to_json.parse_cleaned_markdown_text(cleaned_content, visuals, visuals, 'cleaned.md')
+    if variant == 'solutions_mock':
+        return md_to_json.parse_cleaned_markdown_text(cleaned_content, visuals, 'cleaned.md')
+    return md_to_json.parse_cleaned_markdown_text(cleaned_content, visuals, filename='cleaned.md')
+
+
+def iter_render_items(variant, data, outdir):
+    """Yield (item, out_path) in the order the renderer's main() walks the JSON"""
+    if variant == 'solutions_mock':
+        has_sections = any(isinstance(v, list) and section != 'filename' for section, v in data.items())
+        for section, solutions in data.items():
+            if section == 'filename':
+                continue
+            target_dir = os.path.join(outdir, section) if has_sections else outdir
+            for sol in solutions:
+                yield sol, os.path.join(target_dir, f"solution_{sol.get('solution_number', 'unknown')}.png")
+        return
+    for section, section_data in data['Content'].items():
+        section_label = section.strip() or DEFAULT_SECTION_DIR[variant]
+        section_dir = os.path.join(outdir, section_label) if section_label else outdir
+        for q in section_data['Data']['questions']:
+            yield q, os.path.join(section_dir, f"question_{q.get('Question Number', 'unknown')}.png")
+
+
+def run_document(variant, docx_path, workdir, archive=True):
+    """
+    Convert docx_path with the given pipeline inside workdir and return a
+    result dict with per-stage timings, helper timers, per-item render
+    latencies, peak RSS and the paths of the intermediate artifacts.
+    """
+    modules = load_variant(variant)
+    wordToMD = modules['wordToMD']
+    renderer = modules['json_to_question_images']
+    docx_path = os.path.abspath(docx_path)
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    # The packages resolve some paths against the cwd, like the server does per job
+    os.chdir(workdir)
+    output_dir = os.path.join(workdir, 'output_test')
+    images_dir = os.path.join(workdir, 'images')
+    rss = {}
+    start = time.perf_counter()
+
+    visuals = wordToMD.extract_docx_visuals(docx_path, output_dir, save=False)
+    md_content = wordToMD.docx_to_markdown_text(docx_path, mathml=True)
+    rss['convert'] = peak_rss_kb()
+
+    cleaned_md_path = os.path.join(output_dir, 'cleaned.md')
+    with progress.stage('clean'):
+        md_content_no_tables = modules['md_cleaner'].remove_markdown_tables(md_content)
+        cleaned_content = modules['md_cleaner'].clean_markdown_content(
+            md_content_no_tables,
+            save_json=False,
+            cleaned_md_path=cleaned_md_path
+        )
+    rss['clean'] = peak_rss_kb()
+
+    with progress.stage('parse'):
+        data = parse_text(variant, modules['md_to_json'], cleaned_content, visuals)
+    rss['parse'] = peak_rss_kb()
+
+    # Written after the timed stages, for the golden comparison
+    visuals_json_path = os.path.join(output_dir, 'html_extraction', 'visuals.json')
+    json_path = cleaned_md_path.replace('.md', '.json')
+    artifacts.write_text(cleaned_md_path, cleaned_content)
+    artifacts.write_json(json_path, data)
+    artifacts.write_json(visuals_json_path, visuals)
+
+    item_ms = []
+    docx_media.set_current(docx_media.DocxMediaProvider(docx_path))
+    with progress.stage('render'):
+        if variant != 'solutions_mock':
+            renderer.prefetch_tables(item for item, _ in iter_render_items(variant, data, images_dir))
+        for item, out_path in iter_render_items(variant, data, images_dir):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            item_start = time.perf_counter()
+            if variant == 'solutions_mock':
+                renderer.make_solution_image(item, out_path, FONT_PATH)
+            else:
+                renderer.make_question_image(item, out_path, font_path=FONT_PATH)
+            item_ms.append(round((time.perf_counter() - item_start) * 1000, 3))
+        encoders.current(renderer.OUTPUT_FORMAT).finish()
+    rss['render'] = peak_rss_kb()
+
+    if archive:
+        with progress.stage('archive'):
+            shutil.make_archive(os.path.join(workdir, 'images'), 'zip', images_dir)
+        rss['archive'] = peak_rss_kb()
+
+    wall_ms = round((time.perf_counter() - start) * 1000, 3)
+    timers = profiling.snapshot()
+    stages = {name[len('stage.'):]: entry['total_ms'] for name, entry in timers.items() if name.startswith('stage.')}
+    return {
+        'variant': variant,
+        'document': os.path.basename(docx_path),
+        'items': len(item_ms),
+        'wall_ms': wall_ms,
+        'stages': stages,
+        'timers': {name: entry for name, entry in timers.items() if not name.startswith('stage.')},
+        'render_item_ms': item_ms,
+        'peak_rss_kb': rss,
+        'peak_rss_children_kb': peak_rss_kb(children=True),
+        'artifacts': {
+            'cleaned_md': cleaned_md_path,
+            'cleaned_json': json_path,
+            'visuals_json': visuals_json_path,
+            'images_dir': images_dir,
+        },
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run one DOCX through a pipeline stage by stage')
+    parser.add_argument('variant', choices=VARIANTS)
+    parser.add_argument('docx', help='Path to input DOCX file')
+    parser.add_argument('workdir', help='Directory for intermediate files and rendered images')
+    parser.add_argument('--result', required=True, help='Where to write the JSON result')
+    parser.add_argument('--no-archive', action='store_true', help='Skip the zip stage')
+    parser.add_argument('--preview', nargs='?', type=int, const=preview.DEFAULT_WIDTH, default=None, metavar='WIDTH',
+                        help='Render contact sheets as with json_to_question_images.py --preview')
+    args = parser.parse_args()
+    if args.preview:
+        preview.enable(args.preview)
+    result_path = os.path.abspath(args.result)
+    try:
+        result = run_document(args.variant, args.docx, args.workdir, archive=not args.no_archive)
+    except Exception as e:
+        result = {'variant': args.variant, 'document': os.path.basename(args.docx), 'error': f"{type(e).__name__}: {e}"}
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if 'error' in result else 0)
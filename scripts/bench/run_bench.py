@@ -0,0 +1,233 @@
+"""
+Benchmark the four pipelines on synthetic exam documents.
+
+For every pipeline and document size a synthetic DOCX is generated
+(see synth_docx.py) and converted --repeat times, each run in a fresh
+subprocess (pipeline_runner.py) and working directory. The report holds
+throughput (questions/sec), per-stage latency percentiles, per-question
+render latency, the slowest helper timers and peak RSS, and is written
+as sorted, indented JSON so two runs can be diffed directly.
+
+Usage:
+    python scripts/bench/run_bench.py --questions 20 100 --repeat 3 --output bench.json
+    python scripts/bench/run_bench.py --variants solutions_mock --compare bench.json
+"""
+import os
+import sys
+import json
+import shutil
+import platform
+import subprocess
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from synth_docx import KIND_FOR_VARIANT, generate_docx
+from pipeline_runner import VARIANTS
+
+STAGES = ('html_extraction', 'pandoc', 'clean', 'parse', 'render', 'archive')
+PERCENTILES = (50, 90, 95, 99)
+TOP_TIMERS = 15
+
+
+def percentile(sorted_values, p):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return round(sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo), 3)
+
+
+def summarize(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    summary = {f'p{p}': percentile(values, p) for p in PERCENTILES}
+    summary.update(
+        min=round(values[0], 3),
+        max=round(values[-1], 3),
+        mean=round(sum(values) / len(values), 3),
+        n=len(values),
+    )
+    return summary
+
+
+def tool_version(cmd):
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        return (out.stdout or out.stderr).strip().splitlines()[0]
+    except Exception:
+        return None
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_once(variant, docx_path, workdir, verbose=False):
+    result_path = os.path.join(workdir, 'result.json')
+    cmd = [sys.executable, os.path.join(BENCH_DIR, 'pipeline_runner.py'),
+           variant, docx_path, os.path.join(workdir, 'run'), '--result', result_path]
+    env = dict(os.environ)
+    # Progress events and nested profiling would only add noise to the measurements
+    for key in ('DOC2VIZ_PROGRESS_FD', 'DOC2VIZ_PROFILE_DIR', 'DOC2VIZ_PROFILE_PSTATS'):
+        env.pop(key, None)
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, stdout=None if verbose else subprocess.DEVNULL,
+                          stderr=None if verbose else subprocess.PIPE, text=True)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not os.path.exists(result_path):
+        return {'error': (proc.stderr or '').strip()[-2000:] or f'exit code {proc.returncode}'}
+    with open(result_path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    result['process_ms'] = round(elapsed_ms, 3)
+    return result
+
+
+def aggregate(variant, corpus, runs):
+    ok = [r for r in runs if 'error' not in r]
+    entry = {
+        'variant': variant,
+        'corpus': corpus,
+        'runs': len(runs),
+        'failed': len(runs) - len(ok),
+    }
+    if len(ok) < len(runs):
+        entry['errors'] = sorted({r['error'] for r in runs if 'error' in r})
+    if not ok:
+        return entry
+    questions = corpus['questions']
+    entry['items_rendered'] = ok[0]['items']
+    entry['wall_ms'] = summarize(r['wall_ms'] for r in ok)
+    entry['process_ms'] = summarize(r['process_ms'] for r in ok)
+    entry['questions_per_sec'] = summarize(questions * 1000.0 / r['wall_ms'] for r in ok if r['wall_ms'])
+    entry['stages_ms'] = {
+        stage: summarize(r['stages'].get(stage) for r in ok)
+        for stage in STAGES if any(stage in r['stages'] for r in ok)
+    }
+    entry['render_item_ms'] = summarize(ms for r in ok for ms in r['render_item_ms'])
+    # Mean total time of the slowest helpers across runs
+    totals = {}
+    for r in ok:
+        for name, timer in r['timers'].items():
+            totals.setdefault(name, []).append(timer['total_ms'])
+    slowest = sorted(totals.items(), key=lambda kv: -sum(kv[1]) / len(kv[1]))[:TOP_TIMERS]
+    entry['timers_total_ms'] = {name: round(sum(v) / len(v), 3) for name, v in slowest}
+    peaks = [max(v for v in r['peak_rss_kb'].values() if v is not None) for r in ok if any(r['peak_rss_kb'].values())]
+    entry['peak_rss_mb'] = round(max(peaks) / 1024, 1) if peaks else None
+    child_peaks = [r['peak_rss_children_kb'] for r in ok if r.get('peak_rss_children_kb')]
+    entry['peak_rss_children_mb'] = round(max(child_peaks) / 1024, 1) if child_peaks else None
+    return entry
+
+
+def compare(baseline, current):
+    """Print the change in median stage latency and throughput against an earlier report"""
+    old = {(e['variant'], e['corpus']['questions']): e for e in baseline.get('results', [])}
+    print(f"\nComparison with {baseline.get('meta', {}).get('revision') or 'baseline'} (median, ms):")
+    for entry in current['results']:
+        key = (entry['variant'], entry['corpus']['questions'])
+        before = old.get(key)
+        if not before or 'stages_ms' not in before or 'stages_ms' not in entry:
+            continue
+        print(f"  {entry['variant']} x {key[1]} questions")
+        for stage, now in entry['stages_ms'].items():
+            then = before['stages_ms'].get(stage)
+            if not now or not then:
+                continue
+            delta = (now['p50'] - then['p50']) / then['p50'] * 100 if then['p50'] else 0.0
+            print(f"    {stage:<16}{then['p50']:>10.1f}{now['p50']:>10.1f}{delta:>+9.1f}%")
+        qps_then, qps_now = before['questions_per_sec']['p50'], entry['questions_per_sec']['p50']
+        print(f"    {'questions/sec':<16}{qps_then:>10.2f}{qps_now:>10.2f}")
+
+
+def print_table(report):
+    print(f"\n{'pipeline':<18}{'questions':>10}{'q/sec':>9}{'wall p50':>10}{'render/q p50':>14}{'peak MB':>9}")
+    for entry in report['results']:
+        if 'wall_ms' not in entry:
+            print(f"{entry['variant']:<18}{entry['corpus']['questions']:>10}   FAILED: {entry.get('errors', ['?'])[0][:60]}")
+            continue
+        render = entry['render_item_ms']['p50'] if entry['render_item_ms'] else 0.0
+        print(f"{entry['variant']:<18}{entry['corpus']['questions']:>10}{entry['questions_per_sec']['p50']:>9.2f}"
+              f"{entry['wall_ms']['p50']:>10.0f}{render:>14.1f}{entry['peak_rss_mb'] or 0:>9.1f}")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the DOCX pipelines on synthetic documents')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--questions', nargs='+', type=int, default=[20, 100], help='Document sizes to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per pipeline and size')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs before measuring')
+    parser.add_argument('--sections', type=int, default=1)
+    parser.add_argument('--directions', type=int, default=4)
+    parser.add_argument('--passages', type=int, default=4)
+    parser.add_argument('--tables', type=int, default=4)
+    parser.add_argument('--images', type=int, default=4)
+    parser.add_argument('--latex-density', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON report')
+    parser.add_argument('--compare', default=None, help='Earlier report to compare median timings against')
+    parser.add_argument('--keep', default=None, help='Keep generated documents and outputs in this directory')
+    parser.add_argument('--verbose', action='store_true', help='Show pipeline output')
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp(prefix='doc2viz-bench-')
+    os.makedirs(root, exist_ok=True)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pandoc': tool_version(['pandoc', '--version']),
+            'wkhtmltoimage': tool_version(['wkhtmltoimage', '--version']),
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+        },
+        'results': [],
+    }
+    try:
+        for variant in args.variants:
+            for questions in args.questions:
+                docx_path = os.path.join(root, f'{variant}-{questions}.docx')
+                corpus = generate_docx(
+                    docx_path, kind=KIND_FOR_VARIANT[variant], questions=questions, sections=args.sections,
+                    directions=args.directions, passages=args.passages, tables=args.tables, images=args.images,
+                    latex_density=args.latex_density, seed=args.seed,
+                )
+                print(f"[bench] {variant}: {questions} questions x {args.repeat} runs", flush=True)
+                runs = []
+                for i in range(args.warmup + args.repeat):
+                    workdir = os.path.join(root, f'{variant}-{questions}-run{i}')
+                    shutil.rmtree(workdir, ignore_errors=True)
+                    os.makedirs(workdir)
+                    result = run_once(variant, docx_path, workdir, verbose=args.verbose)
+                    if i >= args.warmup:
+                        runs.append(result)
+                    if not args.keep:
+                        shutil.rmtree(workdir, ignore_errors=True)
+                report['results'].append(aggregate(variant, corpus, runs))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print_table(report)
+    print(f"\nReport written to {os.path.abspath(args.output)}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+"""
+Synthetic exam DOCX generator for the benchmark and regression tools.
+
+The documents mimic the layout the pipelines expect from real papers: a
+header block, "TEST -- I" section headings, bold question numbers, bold
+italic "Directions for questions a to b:" blocks, (A)-(D) options, OMML
+equations, Word tables and inline PNG figures. Solution papers use the
+"Solutions" heading, numbered explanations and "Choice (n)" lines.
+
+The OOXML is written by hand so no extra dependency is needed, and the
+output is fully determined by the seed.
+
+Usage:
+    python scripts/bench/synth_docx.py out.docx --kind questions --questions 50 --tables 3 --images 2
+"""
+import io
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw
+
+KINDS = ('questions', 'passage', 'solutions')
+
+# Pipeline package -> kind of document it consumes
+KIND_FOR_VARIANT = {
+    'mcq_section': 'questions',
+    'mock_questions': 'questions',
+    'question_passage': 'passage',
+    'solutions_mock': 'solutions',
+}
+
+NS = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:m="http://schemas.openxmlformats.org/officeDocument/2006/math" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"'
+)
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+IMAGE_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+EMU_PER_PX = 9525
+
+WORDS = (
+    'train', 'speed', 'ratio', 'profit', 'average', 'interest', 'village', 'river', 'number',
+    'series', 'statement', 'argument', 'conclusion', 'company', 'market', 'sales', 'region',
+    'pipe', 'tank', 'distance', 'hours', 'minutes', 'boat', 'stream', 'sum', 'product',
+    'digit', 'square', 'triangle', 'circle', 'area', 'volume', 'price', 'discount', 'cost',
+    'the', 'of', 'a', 'is', 'and', 'in', 'to', 'that', 'what', 'which', 'find', 'value',
+    'given', 'total', 'each', 'following', 'if', 'then', 'how', 'many', 'more', 'than',
+)
+
+ROMAN = ('I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X')
+
+
+def _sentence(rng, lo=8, hi=18):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(lo, hi))]
+    words[0] = words[0].capitalize()
+    return ' '.join(words) + '.'
+
+
+def _run(text, bold=False, italic=False):
+    props = ''
+    if bold or italic:
+        props = '<w:rPr>' + ('<w:b/>' if bold else '') + ('<w:i/>' if italic else '') + '</w:rPr>'
+    return f'<w:r>{props}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+
+def _math_run(text):
+    return f'<m:r><m:t>{escape(text)}</m:t></m:r>'
+
+
+def _equation(rng):
+    """A small inline OMML equation: fraction, power or square root"""
+    a, b = rng.randint(2, 99), rng.randint(2, 99)
+    shape = rng.randrange(3)
+    if shape == 0:
+        body = f'<m:f><m:num>{_math_run(str(a))}</m:num><m:den>{_math_run(str(b))}</m:den></m:f>'
+    elif shape == 1:
+        body = f'<m:sSup><m:e>{_math_run("x")}</m:e><m:sup>{_math_run(str(a % 5 + 2))}</m:sup></m:sSup>' + _math_run(f'+{b}')
+    else:
+        body = f'<m:rad><m:radPr><m:degHide m:val="1"/></m:radPr><m:deg/><m:e>{_math_run(str(a * b))}</m:e></m:rad>'
+    return f'<m:oMath>{body}</m:oMath>'
+
+
+def _paragraph(*parts):
+    return '<w:p>' + ''.join(parts) + '</w:p>'
+
+
+def _text_with_math(rng, latex_density):
+    """Sentence runs with inline equations mixed in at roughly latex_density per sentence"""
+    parts = [_run(_sentence(rng) + ' ')]
+    if rng.random() < latex_density:
+        parts.append(_equation(rng))
+        parts.append(_run(' ' + _sentence(rng, 3, 8)))
+    return parts
+
+
+def _table(rng):
+    rows, cols = rng.randint(3, 6), rng.randint(3, 5)
+    width = 9000 // cols
+    border = ''.join(
+        f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="000000"/>'
+        for side in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV')
+    )
+    xml = [f'<w:tbl><w:tblPr><w:tblW w:w="{width * cols}" w:type="dxa"/><w:tblBorders>{border}</w:tblBorders></w:tblPr>']
+    xml.append('<w:tblGrid>' + f'<w:gridCol w:w="{width}"/>' * cols + '</w:tblGrid>')
+    for r in range(rows):
+        xml.append('<w:tr>')
+        for c in range(cols):
+            if r == 0:
+                cell = _run('Year' if c == 0 else rng.choice(WORDS).capitalize(), bold=True)
+            elif c == 0:
+                cell = _run(str(2010 + r))
+            else:
+                cell = _run(str(rng.randint(10, 999)))
+            xml.append(f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>{_paragraph(cell)}</w:tc>')
+        xml.append('</w:tr>')
+    xml.append('</w:tbl>')
+    return ''.join(xml)
+
+
+def _figure_png(rng, width, height):
+    """A bar chart with axes, similar in content to the figures in real papers"""
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.line((30, 10, 30, height - 25), fill='black', width=2)
+    draw.line((30, height - 25, width - 10, height - 25), fill='black', width=2)
+    bars = rng.randint(4, 8)
+    slot = (width - 50) // bars
+    for i in range(bars):
+        top = rng.randint(20, height - 40)
+        shade = rng.choice(((70, 110, 200), (200, 90, 60), (80, 160, 90), (90, 90, 90)))
+        x0 = 40 + i * slot
+        draw.rectangle((x0, top, x0 + slot - 10, height - 26), fill=shade, outline='black')
+        draw.text((x0, height - 20), str(2015 + i), fill='black')
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class _DocumentBuilder(object):
+    def __init__(self, rng):
+        self.rng = rng
+        self.body = []
+        self.media = []  # (rel_id, name, png bytes)
+
+    def add(self, xml):
+        self.body.append(xml)
+
+    def image(self):
+        index = len(self.media) + 1
+        width, height = self.rng.choice(((480, 320), (640, 360), (360, 360)))
+        rel_id = f'rIdImg{index}'
+        name = f'image{index}.png'
+        self.media.append((rel_id, name, _figure_png(self.rng, width, height)))
+        cx, cy = width * EMU_PER_PX, height * EMU_PER_PX
+        drawing = (
+            f'<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+            f'<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{index}" name="Picture {index}"/>'
+            f'<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+            f'<pic:pic><pic:nvPicPr><pic:cNvPr id="{index}" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+            f'<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+            f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+            f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic>'
+            f'</a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+        )
+        self.add(_paragraph(drawing))
+
+    def save(self, path):
+        document = (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:document {NS}><w:body>' + ''.join(self.body) +
+            '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/></w:sectPr></w:body></w:document>'
+        )
+        rels = ''.join(
+            f'<Relationship Id="{rel_id}" Type="{IMAGE_REL_TYPE}" Target="media/{name}"/>'
+            for rel_id, name, _ in self.media
+        )
+        document_rels = (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + rels + '</Relationships>'
+        )
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            # Fixed timestamps keep the archive byte-identical for a given seed
+            def write(name, data):
+                zf.writestr(zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0)), data)
+            write('[Content_Types].xml', CONTENT_TYPES)
+            write('_rels/.rels', PACKAGE_RELS)
+            write('word/document.xml', document)
+            write('word/_rels/document.xml.rels', document_rels)
+            for _, name, data in self.media:
+                write(f'word/media/{name}', data)
+
+
+def _spread(count, total):
+    """count indices in [0, total) spaced as evenly as possible"""
+    if total <= 0 or count <= 0:
+        return set()
+    count = min(count, total)
+    return {int((i + 0.5) * total / count) for i in range(count)}
+
+
+def _options(doc, rng, latex_density):
+    for letter in 'ABCD':
+        if rng.random() < latex_density / 2:
+            doc.add(_paragraph(_run(f'({letter}) '), _equation(rng)))
+        else:
+            doc.add(_paragraph(_run(f'({letter}) {" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))}')))
+
+
+def _header(doc, rng):
+    doc.add(_paragraph(_run('SYNTHETIC EXAM PAPER', bold=True)))
+    doc.add(_paragraph(_run(f'Time: {rng.choice((60, 90, 120))} minutes    Max. Marks: 100')))
+
+
+def _build_questions(doc, rng, questions, sections, directions, tables, images, latex_density):
+    table_at = _spread(tables, questions)
+    image_at = _spread(images, questions)
+    # Direction blocks cover runs of consecutive questions, starting at evenly spaced numbers
+    direction_len = max(2, questions // max(1, directions) // 2) if directions else 0
+    direction_at = _spread(directions, max(1, questions - direction_len))
+    per_section = -(-questions // max(1, sections))
+    qnum = 0
+    for s in range(max(1, sections)):
+        if sections > 1 or s == 0:
+            doc.add(_paragraph(_run(f'TEST -- {ROMAN[s % len(ROMAN)]}', bold=True)))
+        for _ in range(per_section):
+            if qnum >= questions:
+                break
+            if qnum in direction_at:
+                end = min(questions, qnum + direction_len)
+                doc.add(_paragraph(
+                    _run(f'Directions for questions {qnum + 1} to {end}:', bold=True, italic=True),
+                    _run(' ' + _sentence(rng, 12, 30)),
+                ))
+            doc.add(_paragraph(_run(f'{qnum + 1}.', bold=True), _run(' '), *_text_with_math(rng, latex_density)))
+            if qnum in table_at:
+                doc.add(_table(rng))
+            if qnum in image_at:
+                doc.image()
+            _options(doc, rng, latex_density)
+            qnum += 1
+
+
+def _build_passages(doc, rng, questions, passages, tables, images, latex_density):
+    passages = max(1, min(passages, questions))
+    per_passage = -(-questions // passages)
+    table_at = _spread(tables, passages)
+    image_at = _spread(images, passages)
+    doc.add(_paragraph(_run('TEST -- I', bold=True)))
+    qnum = 0
+    for p in range(passages):
+        if qnum >= questions:
+            break
+        end = min(questions, qnum + per_passage)
+        doc.add(_paragraph(
+            _run(f'Directions for questions {qnum + 1} to {end}:', bold=True, italic=True),
+            _run(' Read the passage below and answer the questions that follow.'),
+        ))
+        doc.add(_paragraph(_run(f'PASSAGE -- {ROMAN[p % len(ROMAN)]}', bold=True)))
+        for _ in range(rng.randint(3, 6)):
+            doc.add(_paragraph(_run(' '.join(_sentence(rng) for _ in range(rng.randint(3, 6))))))
+        if p in table_at:
+            doc.add(_table(rng))
+        if p in image_at:
+            doc.image()
+        while qnum < end:
+            doc.add(_paragraph(_run(f'{qnum + 1}.', bold=True), _run(' '), *_text_with_math(rng, latex_density)))
+            _options(doc, rng, latex_density)
+            qnum += 1
+
+
+def _build_solutions(doc, rng, questions, directions, tables, images, latex_density):
+    table_at = _spread(tables, questions)
+    image_at = _spread(images, questions)
+    group_at = _spread(directions, questions)
+    doc.add(_paragraph(_run('Solutions', bold=True)))
+    for n in range(questions):
+        if n in group_at:
+            end = min(questions, n + rng.randint(2, 5))
+            doc.add(_paragraph(_run(f'Solutions for questions {n + 1} to {end}:', bold=True)))
+        doc.add(_paragraph(_run(f'{n + 1}.', bold=True), _run(' '), *_text_with_math(rng, latex_density)))
+        for _ in range(rng.randint(0, 2)):
+            doc.add(_paragraph(*_text_with_math(rng, latex_density)))
+        if n in table_at:
+            doc.add(_table(rng))
+        if n in image_at:
+            doc.image()
+        doc.add(_paragraph(_run('Choice '), _run(f'({rng.randint(1, 4)})', bold=True)))
+
+
+def generate_docx(path, kind='questions', questions=20, sections=1, directions=2, passages=2,
+                  tables=1, images=1, latex_density=0.3, seed=0):
+    """
+    Write a synthetic exam document to path and return a summary of what it contains.
+    Args:
+        kind: 'questions' (mcq/mock papers), 'passage' or 'solutions'
+        questions: number of questions (or solutions)
+        sections: number of TEST -- n sections (questions kind only)
+        directions: number of direction blocks (solution group headings for solutions)
+        passages: number of reading passages (passage kind only)
+        tables, images: number of Word tables and PNG figures
+        latex_density: probability that a question carries an OMML equation
+        seed: random seed; the same arguments always produce the same file
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown document kind: {kind}")
+    rng = random.Random(seed)
+    doc = _DocumentBuilder(rng)
+    _header(doc, rng)
+    if kind == 'questions':
+        _build_questions(doc, rng, questions, sections, directions, tables, images, latex_density)
+    elif kind == 'passage':
+        _build_passages(doc, rng, questions, passages, tables, images, latex_density)
+    else:
+        _build_solutions(doc, rng, questions, directions, tables, images, latex_density)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    doc.save(path)
+    return {
+        'kind': kind,
+        'questions': questions,
+        'sections': sections if kind == 'questions' else 1,
+        'directions': directions,
+        'passages': passages if kind == 'passage' else 0,
+        'tables': tables,
+        'images': len(doc.media),
+        'latex_density': latex_density,
+        'seed': seed,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Generate a synthetic exam DOCX')
+    parser.add_argument('output', help='Path of the DOCX file to write')
+    parser.add_argument('--kind', choices=KINDS, default='questions')
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--sections', type=int, default=1)
+    parser.add_argument('--directions', type=int, default=2)
+    parser.add_argument('--passages', type=int, default=2)
+    parser.add_argument('--tables', type=int, default=1)
+    parser.add_argument('--images', type=int, default=1)
+    parser.add_argument('--latex-density', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    summary = generate_docx(
+        args.output, kind=args.kind, questions=args.questions, sections=args.sections,
+        directions=args.directions, passages=args.passages, tables=args.tables, images=args.images,
+        latex_density=args.latex_density, seed=args.seed,
+    )
+    print(json.dumps(summary))
@@ -0,0 +1 @@
+"""Helpers shared by the mcq_section, mock_questions, question_passage and solutions_mock pipelines."""
@@ -0,0 +1,30 @@
+"""
+Debug copies of the intermediate pipeline artifacts.
+
+The wordToMD.py pipelines hand the Markdown, the visuals and the question
+JSON from stage to stage in memory and render in-process. content.md,
+cleaned.md, cleaned.json and html_extraction/visuals.json are only written
+to output_test/ when --keep-artifacts is passed or DOC2VIZ_KEEP_ARTIFACTS=1
+is set.
+"""
+import os
+import json
+
+KEEP_ENV = 'DOC2VIZ_KEEP_ARTIFACTS'
+
+
+def keep_requested(flag=False):
+    """True if intermediate files should be written, by flag or environment"""
+    return bool(flag) or os.environ.get(KEEP_ENV, '') not in ('', '0')
+
+
+def write_text(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,70 @@
+"""
+Per-job cache of rasterized text blocks.
+
+Direction sets and passages repeat the same main_common_data for every
+question in their range. The renderers lay out and draw such a block once,
+keep the bitmap here and paste it into each question canvas, so the cost
+per question only depends on the question body.
+
+The renderer runs once per job, so the module-level cache returned by
+default_cache() lives exactly as long as the job. Entries are evicted
+least-recently-used once their pixel data exceeds the byte budget
+(DOC2VIZ_BLOCK_CACHE_MB, default 256).
+"""
+import os
+from collections import OrderedDict
+
+BLOCK_CACHE_MB_ENV = 'DOC2VIZ_BLOCK_CACHE_MB'
+
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class BlockCache(object):
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(BLOCK_CACHE_MB_ENV, '256')) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get_or_render(self, key, render):
+        """
+        Return the cached value for key, calling render() on a miss.
+        render() returns (image, extra); the image must not be modified by callers.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = render()
+        size = _image_bytes(entry[0])
+        if size <= self.max_bytes:
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (old_image, _) = self._entries.popitem(last=False)
+                self._bytes -= _image_bytes(old_image)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default = None
+
+
+def default_cache():
+    global _default
+    if _default is None:
+        _default = BlockCache()
+    return _default
@@ -0,0 +1,75 @@
+"""
+Colour mode of question and solution canvases.
+
+Most questions are black text on white, yet every canvas used to be
+allocated as RGB at 1200-2600px width. DOC2VIZ_CANVAS_MODE picks the mode:
+
+- auto (default): grayscale ('L', a third of the memory, and smaller and
+  faster to encode) unless a pasted table or figure has colour, then RGB.
+- palette: like auto; PNG outputs that stay grayscale are additionally
+  reduced to 16 gray levels, written as a 4-bit palette PNG. That keeps the
+  text anti-aliasing. JPEG outputs have no palettes and stay 'L'.
+- rgb: always RGB, as before.
+
+For SVG output, --preview runs, and PDF output when reportlab is
+installed, new() returns a vector canvas (common/svg.py) and draw() the
+matching drawing object.
+"""
+import os
+
+from PIL import Image, ImageDraw
+
+from common import imageops, svg
+
+CANVAS_MODE_ENV = 'DOC2VIZ_CANVAS_MODE'
+MODES = ('auto', 'palette', 'rgb')
+PALETTE_LEVELS = 16
+
+
+def setting():
+    value = os.environ.get(CANVAS_MODE_ENV, 'auto').strip().lower()
+    return value if value in MODES else 'auto'
+
+
+def mode_for(images=()):
+    """'L' if the canvas can be grayscale with these images pasted on it, else 'RGB'"""
+    if setting() == 'rgb':
+        return 'RGB'
+    if any(not imageops.is_grayscale(img) for img in images):
+        return 'RGB'
+    return 'L'
+
+
+def vector():
+    """True when questions are recorded as vectors: SVG, previews, PDF with text kept as text"""
+    from common import encoders, pdf
+    fmt = encoders.requested_format()
+    return fmt in ('svg', 'preview') or (fmt == 'pdf' and pdf.available())
+
+
+def new(size, images=(), color='white'):
+    """Blank canvas in the mode mode_for(images) picks, or an svg.SvgCanvas for SVG output"""
+    if vector():
+        return svg.SvgCanvas(size, color=color)
+    return Image.new(mode_for(images), size, color=color)
+
+
+def draw(img):
+    """ImageDraw for a canvas made by new()"""
+    if isinstance(img, svg.SvgCanvas):
+        return svg.SvgDraw(img)
+    return ImageDraw.Draw(img)
+
+
+_PALETTE_LUT = [round(v * (PALETTE_LEVELS - 1) / 255) for v in range(256)]
+_PALETTE = [round(i * 255 / (PALETTE_LEVELS - 1)) for i in range(PALETTE_LEVELS) for _ in range(3)]
+
+
+def for_png(img):
+    """The image to write as PNG: a 16-gray palette image in palette mode, else img"""
+    if setting() != 'palette' or img.mode != 'L':
+        return img
+    levels = img.point(_PALETTE_LUT)
+    paletted = Image.frombytes('P', levels.size, levels.tobytes())
+    paletted.putpalette(_PALETTE)
+    return paletted
@@ -0,0 +1,139 @@
+"""
+Embedded media read straight from the DOCX zip.
+
+Pandoc used to run with --extract-media twice per document (Markdown and
+HTML), writing every picture to disk so the renderers could open it again.
+Without that flag Pandoc refers to pictures by their media-bag name
+(media/image1.png), which is the file name of the word/media/ member in
+the DOCX. DocxMediaProvider indexes word/media/* once and decodes images
+from memory when a renderer asks for them.
+
+The renderer's main() installs the provider for the document it renders
+(set_current); open_image() falls back to files on disk for JSON written
+by older runs.
+"""
+import io
+import os
+import re
+import hashlib
+import zipfile
+import posixpath
+
+from PIL import Image
+
+MEDIA_PREFIX = 'word/media/'
+
+_SRC_RE = re.compile(r'src=["\']([^"\']+)["\']')
+
+
+def media_ref(entry):
+    """Path a JSON Image entry refers to: the src of an <img> tag, or the entry itself"""
+    if not isinstance(entry, str):
+        return None
+    m = _SRC_RE.search(entry)
+    path = m.group(1) if m else entry
+    return path.strip().replace('\\', '/')
+
+
+class DocxMediaProvider(object):
+    def __init__(self, docx_path):
+        self.docx_path = os.path.abspath(docx_path)
+        self._zip = zipfile.ZipFile(self.docx_path)
+        # media file name -> zip member
+        self.members = {}
+        for name in self._zip.namelist():
+            if name.startswith(MEDIA_PREFIX) and not name.endswith('/'):
+                self.members[posixpath.basename(name)] = name
+        self._by_digest = None
+        self._data = {}
+        self._digests = {}
+
+    def member_for(self, ref):
+        """Zip member for a Pandoc media reference, or None if it is not embedded media"""
+        ref = media_ref(ref)
+        if not ref:
+            return None
+        name = posixpath.basename(ref)
+        member = self.members.get(name)
+        if member is None:
+            # Some Pandoc versions name media after a SHA-1 of its contents
+            stem = posixpath.splitext(name)[0]
+            if re.fullmatch(r'[0-9a-f]{40}', stem):
+                member = self._digest_index().get(stem)
+        return member
+
+    def _digest_index(self):
+        if self._by_digest is None:
+            self._by_digest = {hashlib.sha1(self._read_member(member)).hexdigest(): member
+                               for member in self.members.values()}
+        return self._by_digest
+
+    def _read_member(self, member):
+        data = self._data.get(member)
+        if data is None:
+            data = self._data[member] = self._zip.read(member)
+        return data
+
+    def read(self, ref):
+        member = self.member_for(ref)
+        return self._read_member(member) if member else None
+
+    def digest(self, ref):
+        """sha256 of the embedded file, or None"""
+        member = self.member_for(ref)
+        if member is None:
+            return None
+        digest = self._digests.get(member)
+        if digest is None:
+            digest = self._digests[member] = hashlib.sha256(self._read_member(member)).hexdigest()
+        return digest
+
+    def open_image(self, ref, load=True):
+        """
+        PIL image for a media reference, or None if it is not embedded media.
+        With load=False only the header is read, so the caller can still set
+        a draft mode before decoding.
+        """
+        data = self.read(ref)
+        if data is None:
+            return None
+        img = Image.open(io.BytesIO(data))
+        if load:
+            img.load()
+        return img
+
+    def close(self):
+        self._zip.close()
+        self._data.clear()
+
+
+_current = None
+
+
+def set_current(provider):
+    global _current
+    _current = provider
+
+
+def current():
+    return _current
+
+
+def open_image(entry, *fallback_paths, load=True):
+    """
+    Image for a JSON Image entry: decoded from the current DOCX when it is
+    embedded media, else opened from the first of fallback_paths that exists.
+    Returns None if neither works. With load=False the image is not decoded
+    yet; close it when done, it may hold a file handle.
+    """
+    if _current is not None:
+        img = _current.open_image(entry, load=load)
+        if img is not None:
+            return img
+    for path in fallback_paths:
+        if path and os.path.exists(path):
+            img = Image.open(path)
+            if load:
+                img.load()
+            return img
+    return None
@@ -0,0 +1,447 @@
+"""
+Structural reader for DOCX files, without Pandoc.
+
+The html_image_extractor modules only need to know which question each
+table and picture belongs to. Converting the whole document to HTML with
+Pandoc and parsing it with BeautifulSoup is expensive, so this module
+streams word/document.xml from the DOCX zip with an incremental XML parser
+and yields the top-level blocks Pandoc would have produced:
+
+    Block.kind    'p', 'h' (heading), 'li' (numbered/bulleted paragraph) or 'table'
+    Block.strong  text of the first bold span, like p.find('strong').get_text()
+    Block.em      text of the first italic span, like p.find('em').get_text()
+    Block.text    plain text of the paragraph
+    Block.images  pictures as DocxImage(ref, width_in, height_in), where ref is
+                  Pandoc's media reference (media/image1.png)
+    Block.html    for tables, the table serialized the way the renderers expect
+
+Tables come out as Pandoc 3 writes them: column and table widths relative to
+Pandoc's 6.5in text width, and bare <tr> rows. A table holding an equation
+raises NeedsPandoc, since only Pandoc renders OMML the way the pipeline
+expects; the extractors then read the whole document from Pandoc HTML.
+DOC2VIZ_VISUALS_READER=html switches the extractors back to Pandoc HTML.
+"""
+import os
+import re
+import html
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+WP = '{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}'
+V = '{urn:schemas-microsoft-com:vml}'
+M = '{http://schemas.openxmlformats.org/officeDocument/2006/math}'
+MC = '{http://schemas.openxmlformats.org/markup-compatibility/2006}'
+
+EMU_PER_INCH = 914400
+# Pandoc's docx reader measures grid columns against a 6.5in text width, less
+# 10 twips per column gap
+PANDOC_TEXT_WIDTH = 9360
+PANDOC_COLUMN_GAP = 10
+
+DocxImage = namedtuple('DocxImage', 'ref width_in height_in')
+
+
+class NeedsPandoc(Exception):
+    """The document has content this reader cannot reproduce as Pandoc would"""
+
+
+class Block(object):
+    __slots__ = ('kind', 'strong', 'em', 'text', 'images', 'html')
+
+    def __init__(self, kind, strong=None, em=None, text='', images=None, html=None):
+        self.kind = kind
+        self.strong = strong
+        self.em = em
+        self.text = text
+        self.images = images or []
+        self.html = html
+
+    def __repr__(self):
+        return f"Block({self.kind!r}, strong={self.strong!r}, em={self.em!r}, images={len(self.images)})"
+
+
+def _inches(value):
+    return ('%.5f' % value).rstrip('0').rstrip('.') + 'in'
+
+
+def img_src(image):
+    return image.ref
+
+
+def img_html(image):
+    """The <img> tag Pandoc writes for a picture, as BeautifulSoup serializes it"""
+    style = ''
+    if image.width_in and image.height_in:
+        style = f' style="width:{_inches(image.width_in)};height:{_inches(image.height_in)}"'
+    return f'<img src="{html.escape(image.ref)}"{style}/>'
+
+
+def question_number(block):
+    """Question number of a paragraph whose first bold span reads like '12.', else None"""
+    if block.kind != 'p' or not block.strong:
+        return None
+    m = re.match(r"(\d+).", block.strong.strip())
+    return int(m.group(1)) if m else None
+
+
+def normalize_space(text):
+    return re.sub(r'\s+', ' ', text.strip())
+
+
+def _flag(rpr, tag):
+    """True/False for a toggle property such as <w:b/> or <w:i w:val="0"/>, None if absent"""
+    if rpr is None:
+        return None
+    el = rpr.find(W + tag)
+    if el is None:
+        return None
+    return el.get(W + 'val', 'true').lower() not in ('0', 'false', 'off')
+
+
+class _Styles(object):
+    def __init__(self, data):
+        self.char = {}      # styleId -> (bold, italic), inheritance resolved lazily
+        self.para_kind = {}  # styleId -> 'h' / 'li'
+        self._raw = {}
+        if data is None:
+            return
+        root = ET.fromstring(data)
+        for style in root.iter(W + 'style'):
+            sid = style.get(W + 'styleId')
+            kind = style.get(W + 'type')
+            name_el = style.find(W + 'name')
+            name = (name_el.get(W + 'val', '') if name_el is not None else '').lower()
+            based = style.find(W + 'basedOn')
+            if kind == 'character':
+                rpr = style.find(W + 'rPr')
+                self._raw[sid] = (_flag(rpr, 'b'), _flag(rpr, 'i'),
+                                  based.get(W + 'val') if based is not None else None)
+            elif kind == 'paragraph':
+                if re.match(r'(heading \d|title)$', name):
+                    self.para_kind[sid] = 'h'
+                else:
+                    ppr = style.find(W + 'pPr')
+                    if ppr is not None and _has_numbering(ppr):
+                        self.para_kind[sid] = 'li'
+
+    def char_format(self, sid):
+        if sid not in self.char:
+            bold = italic = None
+            seen = set()
+            current = sid
+            while current in self._raw and current not in seen:
+                seen.add(current)
+                b, i, current = self._raw[current]
+                bold = b if bold is None else bold
+                italic = i if italic is None else italic
+            self.char[sid] = (bool(bold), bool(italic))
+        return self.char[sid]
+
+
+def _has_numbering(ppr):
+    num = ppr.find(W + 'numPr')
+    if num is None:
+        return False
+    num_id = num.find(W + 'numId')
+    return num_id is None or num_id.get(W + 'val') != '0'
+
+
+class DocxStructureReader(object):
+    def __init__(self, docx_path):
+        self.docx_path = docx_path
+
+    def _load_parts(self, zf):
+        self.rels = {}
+        try:
+            root = ET.fromstring(zf.read('word/_rels/document.xml.rels'))
+            for rel in root:
+                if rel.get('TargetMode') == 'External':
+                    continue
+                target = rel.get('Target', '')
+                # Pandoc names media after its path inside word/
+                target = re.sub(r'^/?word/', '', target.lstrip('/'))
+                self.rels[rel.get('Id')] = posixpath.normpath(target)
+        except KeyError:
+            pass
+        try:
+            self.styles = _Styles(zf.read('word/styles.xml'))
+        except KeyError:
+            self.styles = _Styles(None)
+
+    def blocks(self):
+        """Yield the top-level blocks of the document body in order"""
+        with zipfile.ZipFile(self.docx_path) as zf:
+            self._load_parts(zf)
+            with zf.open('word/document.xml') as f:
+                depth = 0
+                body_depth = None
+                for event, el in ET.iterparse(f, events=('start', 'end')):
+                    if event == 'start':
+                        depth += 1
+                        if el.tag == W + 'body':
+                            body_depth = depth
+                        continue
+                    if body_depth is not None and depth == body_depth + 1:
+                        for block in self._top_level(el):
+                            yield block
+                        # Finished subtrees are not needed again
+                        el.clear()
+                    depth -= 1
+
+    def _top_level(self, el):
+        if el.tag == W + 'p':
+            block = self._paragraph(el)
+            if block is not None:
+                yield block
+        elif el.tag == W + 'tbl':
+            yield self._table(el)
+        elif el.tag in (W + 'sdt', W + 'customXml'):
+            content = el.find(W + 'sdtContent') if el.tag == W + 'sdt' else el
+            for child in (content if content is not None else []):
+                for block in self._top_level(child):
+                    yield block
+
+    # --- paragraphs ---
+
+    def _segments(self, el, out):
+        """Flatten inline content into (text, bold, italic) tuples, DocxImage items and '\\n' for line breaks"""
+        for child in el:
+            tag = child.tag
+            if tag == W + 'r':
+                self._run(child, out)
+            elif tag in (W + 'pPr', W + 'rPr', W + 'del', W + 'moveFrom'):
+                continue
+            elif tag in (M + 'oMath', M + 'oMathPara'):
+                text = ''.join(t.text or '' for t in child.iter(M + 't'))
+                if text:
+                    out.append((text, False, False))
+            else:
+                self._segments(child, out)
+
+    def _run(self, run, out):
+        rpr = run.find(W + 'rPr')
+        bold, italic = _flag(rpr, 'b'), _flag(rpr, 'i')
+        if rpr is not None and (bold is None or italic is None):
+            rstyle = rpr.find(W + 'rStyle')
+            if rstyle is not None:
+                style_bold, style_italic = self.styles.char_format(rstyle.get(W + 'val'))
+                bold = style_bold if bold is None else bold
+                italic = style_italic if italic is None else italic
+        bold, italic = bool(bold), bool(italic)
+        for child in run:
+            tag = child.tag
+            if tag == W + 't':
+                if child.text:
+                    out.append((child.text, bold, italic))
+            elif tag == W + 'tab':
+                out.append(('\t', bold, italic))
+            elif tag in (W + 'br', W + 'cr'):
+                out.append('\n')
+            elif tag in (W + 'drawing', W + 'pict', MC + 'AlternateContent'):
+                out.extend(self._images(child))
+
+    def _images(self, el):
+        if el.tag == MC + 'AlternateContent':
+            for branch in (el.find(MC + 'Choice'), el.find(MC + 'Fallback')):
+                if branch is not None:
+                    found = self._images_in(branch)
+                    if found:
+                        return found
+            return []
+        return self._images_in(el)
+
+    def _images_in(self, el):
+        images = []
+        for container in list(el.iter(WP + 'inline')) + list(el.iter(WP + 'anchor')):
+            extent = container.find(WP + 'extent')
+            width = height = None
+            if extent is not None:
+                width = int(extent.get('cx', '0')) / EMU_PER_INCH
+                height = int(extent.get('cy', '0')) / EMU_PER_INCH
+            for blip in container.iter(A + 'blip'):
+                ref = self.rels.get(blip.get(R + 'embed'))
+                if ref:
+                    images.append(DocxImage(ref, width, height))
+        for data in el.iter(V + 'imagedata'):
+            ref = self.rels.get(data.get(R + 'id'))
+            if ref:
+                images.append(DocxImage(ref, None, None))
+        return images
+
+    def _paragraph(self, p):
+        out = []
+        self._segments(p, out)
+        text = ''.join(s[0] for s in out if type(s) is tuple)
+        images = [s for s in out if isinstance(s, DocxImage)]
+        if not text.strip() and not images:
+            # Pandoc drops empty paragraphs
+            return None
+        kind = 'p'
+        ppr = p.find(W + 'pPr')
+        if ppr is not None:
+            pstyle = ppr.find(W + 'pStyle')
+            if pstyle is not None:
+                kind = self.styles.para_kind.get(pstyle.get(W + 'val'), 'p')
+            if _has_numbering(ppr):
+                kind = 'li'
+        return Block(kind, strong=_first_span(out, 1), em=_first_span(out, 2), text=text, images=images)
+
+    # --- tables ---
+
+    def _table(self, tbl):
+        images = []
+        grid = [int(float(col.get(W + 'w', '0') or 0)) for col in tbl.findall(W + 'tblGrid/' + W + 'gridCol')]
+        widths = _column_widths(grid)
+        total = sum(w for w in widths if w)
+        parts = [f'<table style="width:{round(100 * total)}%;">' if 0 < total < 1 else '<table>']
+        if any(widths):
+            parts.append('<colgroup>')
+            for width in widths:
+                parts.append(f'<col style="width: {int(100 * width)}%"/>' if width else '<col/>')
+            parts.append('</colgroup>')
+        rows = tbl.findall(W + 'tr')
+        header = bool(rows) and self._is_header(tbl, rows[0])
+        body_rows = rows[1:] if header else rows
+        if header:
+            parts.append('<thead>')
+            parts.append(self._row(rows[0], 'th', images))
+            parts.append('</thead>')
+        if body_rows:
+            parts.append('<tbody>')
+            for row in body_rows:
+                parts.append(self._row(row, 'td', images))
+            parts.append('</tbody>')
+        parts.append('</table>')
+        return Block('table', text='', images=images, html='\n'.join(parts))
+
+    def _is_header(self, tbl, first_row):
+        trpr = first_row.find(W + 'trPr')
+        if trpr is not None and _flag(trpr, 'tblHeader'):
+            return True
+        look = tbl.find(W + 'tblPr/' + W + 'tblLook')
+        if look is None:
+            return False
+        if look.get(W + 'firstRow') is not None:
+            return look.get(W + 'firstRow') in ('1', 'true', 'on')
+        try:
+            return bool(int(look.get(W + 'val', '0'), 16) & 0x0020)
+        except ValueError:
+            return False
+
+    def _row(self, row, cell_tag, images):
+        cells = []
+        for tc in row.findall(W + 'tc'):
+            tcpr = tc.find(W + 'tcPr')
+            attrs = ''
+            if tcpr is not None:
+                vmerge = tcpr.find(W + 'vMerge')
+                if vmerge is not None and vmerge.get(W + 'val') != 'restart':
+                    # Continuation of a vertically merged cell
+                    continue
+                span = tcpr.find(W + 'gridSpan')
+                if span is not None and span.get(W + 'val', '1') != '1':
+                    attrs = f' colspan="{span.get(W + "val")}"'
+            cells.append(f'<{cell_tag}{attrs}>{self._cell(tc, images)}</{cell_tag}>')
+        return '<tr>\n' + '\n'.join(cells) + '\n</tr>'
+
+    def _cell(self, tc, images):
+        chunks = []
+        for child in tc:
+            if child.tag == W + 'p':
+                if child.find('.//' + M + 'oMath') is not None:
+                    raise NeedsPandoc('table cell with an equation')
+                out = []
+                self._segments(child, out)
+                images.extend(s for s in out if isinstance(s, DocxImage))
+                inline = _inline_html(out)
+                if inline:
+                    chunks.append(inline)
+            elif child.tag == W + 'tbl':
+                nested = self._table(child)
+                images.extend(nested.images)
+                chunks.append(nested.html)
+        if len(chunks) == 1 and not chunks[0].startswith('<table'):
+            return chunks[0]
+        return '\n'.join(c if c.startswith('<table') else f'<p>{c}</p>' for c in chunks)
+
+
+def _column_widths(grid):
+    """Pandoc's relative column widths for a table grid in twips; None for a column without one"""
+    widths = [w / float(PANDOC_TEXT_WIDTH - PANDOC_COLUMN_GAP * (len(grid) - 1)) if w else None for w in grid]
+    total = sum(w for w in widths if w)
+    if total > 1:
+        widths = [w / total if w else None for w in widths]
+    return widths
+
+
+def _first_span(segments, field):
+    """Text of the first run of consecutive segments with the bold (1) or italic (2) flag set"""
+    parts = []
+    for seg in segments:
+        if type(seg) is tuple and seg[field]:
+            parts.append(seg[0])
+        elif parts and (seg == '\n' or type(seg) is tuple):
+            break
+    return ''.join(parts) if parts else None
+
+
+def _inline_html(segments):
+    """Pandoc's HTML for a cell paragraph: whitespace collapsed, and kept outside <strong>/<em>"""
+    parts = []
+    group, fmt = [], None
+    space = False  # whitespace seen since the last emitted text
+
+    def flush():
+        nonlocal space
+        text = re.sub(r'[ \t\r\n]+', ' ', ''.join(group))
+        del group[:]
+        core = text.strip(' ')
+        if text[:1] == ' ':
+            space = True
+        if core:
+            if space and parts:
+                parts.append(' ')
+            core = html.escape(core, quote=False)
+            bold, italic = fmt
+            if bold:
+                core = f'<strong>{core}</strong>'
+            if italic:
+                core = f'<em>{core}</em>'
+            parts.append(core)
+            space = text[-1:] == ' '
+
+    for seg in segments:
+        if type(seg) is tuple:
+            if (seg[1], seg[2]) != fmt:
+                flush()
+                fmt = (seg[1], seg[2])
+            group.append(seg[0])
+            continue
+        flush()
+        fmt = None
+        if seg == '\n':
+            parts.append('<br/>\n')
+        else:
+            if space and parts:
+                parts.append(' ')
+            parts.append(img_html(seg))
+        space = False
+    flush()
+    return ''.join(parts).strip()
+
+
+def read_blocks(docx_path):
+    return list(DocxStructureReader(docx_path).blocks())
+
+
+VISUALS_READER_ENV = 'DOC2VIZ_VISUALS_READER'
+
+
+def visuals_reader():
+    """'docx' (default) or 'html' to map visuals from a Pandoc HTML conversion instead"""
+    return 'html' if os.environ.get(VISUALS_READER_ENV, '').strip().lower() == 'html' else 'docx'
@@ -0,0 +1,201 @@
+"""
+Output encoders for question and solution images.
+
+Every renderer used to hard-wire its own save() call. Now the format and a
+speed/size preset are chosen here:
+
+    DOC2VIZ_OUTPUT_FORMAT   png | jpeg | webp | webp-lossless | svg | pdf
+                            (default: the variant's format, JPEG for
+                            mcq_section and mock_questions, PNG otherwise)
+    DOC2VIZ_ENCODER_PRESET  fast | balanced | small (default balanced)
+
+'fast' favours throughput, 'small' favours bandwidth. The JPEG 'balanced'
+preset is the previous quality-70 optimized encoding. For PNG, 'small' is
+the previous optimize + compress_level=9 encoding of question_passage,
+which is slow on large canvases; 'balanced' is zlib level 6, Pillow's
+default. scripts/bench/encoder_bench.py measures encode time against bytes
+per question for every combination.
+
+svg and pdf are vector formats (common/svg.py, common/pdf.py). pdf and
+preview (the contact sheets of --preview, common/preview.py) are paged: the
+questions of a section go into one document rather than one file each, and
+finish() must be called once rendering is done. With DOC2VIZ_SPRITES set,
+the raster formats are paged the same way: questions are packed into
+sprite sheets with a JSON index (common/sprites.py).
+"""
+import os
+import functools
+import collections
+
+from common import profiling, canvas, svg, pdf, preview, sprites
+
+FORMAT_ENV = 'DOC2VIZ_OUTPUT_FORMAT'
+PRESET_ENV = 'DOC2VIZ_ENCODER_PRESET'
+
+EXTENSIONS = {
+    'png': '.png',
+    'jpeg': '.jpg',
+    'webp': '.webp',
+    'webp-lossless': '.webp',
+    'svg': '.svg',
+    'pdf': '.pdf',
+    'preview': '.jpg',
+}
+
+PRESETS = {
+    'png': {
+        'fast': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'small': {'optimize': True, 'compress_level': 9},
+    },
+    'jpeg': {
+        'fast': {'quality': 70},
+        'balanced': {'quality': 70, 'optimize': True},
+        'small': {'quality': 60, 'optimize': True, 'progressive': True},
+    },
+    'webp': {
+        'fast': {'quality': 75, 'method': 0},
+        'balanced': {'quality': 75, 'method': 4},
+        'small': {'quality': 65, 'method': 6},
+    },
+    'webp-lossless': {
+        'fast': {'lossless': True, 'quality': 0, 'method': 0},
+        'balanced': {'lossless': True, 'quality': 75, 'method': 4},
+        'small': {'lossless': True, 'quality': 90, 'method': 6},
+    },
+    # Vector output; the presets set the PNG encoding of embedded figures
+    'svg': {
+        'fast': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'small': {'optimize': True, 'compress_level': 9},
+    },
+    # Page bitmaps of the Pillow fallback; the reportlab backend draws vectors
+    'pdf': {
+        'fast': {'dpi': 150, 'quality': 80},
+        'balanced': {'dpi': 200, 'quality': 85},
+        'small': {'dpi': 150, 'quality': 70},
+    },
+    # Contact sheets of --preview runs, which are about speed
+    'preview': {
+        'fast': {'quality': 60},
+        'balanced': {'quality': 70},
+        'small': {'quality': 60, 'optimize': True},
+    },
+}
+
+PAGED_FORMATS = ('pdf', 'preview')
+
+PIL_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'webp-lossless': 'WEBP'}
+
+
+class Encoder(collections.namedtuple('Encoder', 'format preset')):
+    @property
+    def extension(self):
+        return EXTENSIONS[self.format]
+
+    @property
+    def options(self):
+        return PRESETS[self.format][self.preset]
+
+    @property
+    def sprites(self):
+        """True when questions are packed into sprite sheets"""
+        return self.format in PIL_FORMATS and sprites.enabled()
+
+    @property
+    def paged(self):
+        """True when all images of a section go into one document"""
+        return self.format in PAGED_FORMATS or self.sprites
+
+    def settings(self):
+        """Render manifest settings: changing format or preset re-renders"""
+        settings = {'format': self.format, 'preset': self.preset}
+        if self.format == 'pdf':
+            settings['backend'] = pdf.backend()
+        if self.format == 'preview':
+            settings['width'] = preview.width()
+        if self.sprites:
+            settings['sprites'] = sprites.sheet_size()
+        return settings
+
+    def path_for(self, out_path):
+        """out_path with this format's extension; the section document for paged formats"""
+        if self.format == 'pdf':
+            return pdf.document_path(out_path)
+        if self.format == 'preview':
+            return preview.sheet_path(out_path)
+        if self.sprites:
+            return sprites.index_path(out_path)
+        return os.path.splitext(out_path)[0] + self.extension
+
+    def prepare(self, img):
+        """img in a mode the format can store"""
+        if self.format == 'png':
+            return canvas.for_png(img)
+        if self.format == 'jpeg':
+            return img if img.mode in ('L', 'RGB', 'CMYK') else img.convert('RGB')
+        # WebP stores RGB(A) only
+        return img if img.mode in ('RGB', 'RGBA') else img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+    def encode(self, img, fp):
+        """Write img to a path or file object"""
+        if self.format == 'svg':
+            svg.write(img, fp, self.options)
+            return
+        if self.format == 'pdf':
+            pdf.write(img, fp, self.options)
+            return
+        if self.format == 'preview':
+            preview.thumbnail(img).save(fp, format='JPEG', **self.options)
+            return
+        self.prepare(img).save(fp, format=PIL_FORMATS[self.format], **self.options)
+
+    @profiling.timed('encode')
+    def save(self, img, out_path):
+        """Write img next to out_path with this format's extension; returns the path written"""
+        path = self.path_for(out_path)
+        if self.format == 'pdf':
+            pdf.add_page(img, path, self.options)
+        elif self.format == 'preview':
+            preview.add(img, out_path, path, self.options)
+        elif self.sprites:
+            sprites.add(img, out_path, self)
+        else:
+            self.encode(img, path)
+        return path
+
+    def finish(self):
+        """Complete the documents of paged formats and return their paths; nothing to do for one file per image"""
+        if self.format == 'pdf':
+            return pdf.finish()
+        if self.format == 'preview':
+            return preview.finish()
+        if self.sprites:
+            return sprites.finish()
+        return []
+
+
+def requested_format():
+    """DOC2VIZ_OUTPUT_FORMAT as set, '' when the variant's default applies"""
+    return os.environ.get(FORMAT_ENV, '').strip().lower()
+
+
+def current(default_format):
+    """Encoder chosen by the environment, with the variant's default format"""
+    return _resolve(requested_format(), os.environ.get(PRESET_ENV, '').strip().lower(), default_format)
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve(fmt, preset, default_format):
+    # Cached, so an unknown value is reported once per job rather than per image
+    fmt = fmt or default_format
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in PRESETS:
+        print(f"Unknown {FORMAT_ENV} '{fmt}', using {default_format}")
+        fmt = default_format
+    preset = preset or 'balanced'
+    if preset not in PRESETS[fmt]:
+        print(f"Unknown {PRESET_ENV} '{preset}', using balanced")
+        preset = 'balanced'
+    return Encoder(fmt, preset)
@@ -0,0 +1,159 @@
+"""
+Decoding and sizing of embedded figures.
+
+The renderers used to decode every figure at full resolution and resize it
+with LANCZOS to its box, even when a 4000px scan ends up 700px wide or a
+tiny icon is blown up. prepare_figure() does the same job more cheaply:
+
+- JPEGs are decoded at reduced scale with draft() when the figure will
+  shrink. The draft keeps at least twice the target size of the whole
+  figure. Trimming and sizing are worked out in source pixels, and when the
+  trimmed content is too small a part of the draft to fill its box, the
+  figure is decoded again at full size.
+- Large downscales go through reduce() first (resize with reducing_gap),
+  and the final LANCZOS pass works on a much smaller image.
+- Upscales use BICUBIC, since LANCZOS adds nothing for small images.
+- The source is closed as soon as it is decoded.
+
+The box is a Fit: each variant's min/max width and height, applied with
+the zoom rule the renderers already used. Prepared figures are kept in a
+per-job FigureCache keyed by source file, mtime and Fit.
+"""
+import os
+import collections
+
+from PIL import Image
+
+from common import profiling, blockcache, docx_media, imageops
+
+FIGURE_CACHE_MB_ENV = 'DOC2VIZ_FIGURE_CACHE_MB'
+
+# resize() first shrinks by an integer factor with reduce() while the image is
+# more than this many times larger than the target
+REDUCING_GAP = 3.0
+# Draft decoding keeps at least this multiple of the target size
+DRAFT_HEADROOM = 2
+
+
+class Fit(collections.namedtuple('Fit', 'min_width max_width min_height max_height')):
+    """Target box for a figure; None leaves a bound open"""
+
+    def size(self, w, h):
+        """(w, h) scaled by the renderers' zoom rule"""
+        zoom = 1.0
+        if self.min_width and w < self.min_width:
+            zoom = self.min_width / w
+        elif self.max_width and w > self.max_width:
+            zoom = self.max_width / w
+        if self.min_height and h < self.min_height:
+            zoom = max(zoom, self.min_height / h)
+        elif self.max_height and h > self.max_height:
+            zoom = min(zoom, self.max_height / h)
+        return max(1, int(w * zoom)), max(1, int(h * zoom))
+
+
+def decode(img, fit, draft=True):
+    """Decode an unloaded image, at reduced scale when it is a JPEG that will shrink"""
+    if draft and img.format == 'JPEG':
+        w, h = fit.size(*img.size)
+        if w < img.width and h < img.height:
+            img.draft(img.mode, (w * DRAFT_HEADROOM, h * DRAFT_HEADROOM))
+    img.load()
+    return img
+
+
+def resize(img, size):
+    if size == img.size:
+        return img
+    if size[0] < img.width and size[1] < img.height:
+        return img.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img.resize(size, Image.BICUBIC)
+
+
+def source_key(entry, fallback_paths):
+    """
+    Identity of the file a JSON Image entry resolves to, with its mtime, or
+    None if it cannot be found. Embedded media is identified by the DOCX and
+    its zip member.
+    """
+    provider = docx_media.current()
+    if provider is not None:
+        member = provider.member_for(entry)
+        if member is not None:
+            return ('docx', provider.docx_path, os.path.getmtime(provider.docx_path), member)
+    for path in fallback_paths:
+        if path and os.path.exists(path):
+            return ('file', os.path.abspath(path), os.path.getmtime(path))
+    return None
+
+
+@profiling.timed('figure_decode_resize')
+def _prepare(entry, fallback_paths, fit, trim, draft=True):
+    """The prepared figure, or None when a draft decode left too few pixels"""
+    source = docx_media.open_image(entry, *fallback_paths, load=False)
+    if source is None:
+        # source_key() found it a moment ago
+        raise FileNotFoundError(entry)
+    with source:
+        source_width = source.width
+        img = decode(source, fit, draft)
+        # Pixels of the decoded image per source pixel; below 1 after a draft
+        scale = img.width / float(source_width)
+        if trim:
+            img = imageops.trim(img, padding=int(round(imageops.DEFAULT_PADDING * scale)))
+        size = fit.size(max(1, int(round(img.width / scale))), max(1, int(round(img.height / scale))))
+        if scale < 1 and (size[0] > img.width or size[1] > img.height):
+            # The draft was sized for the whole figure, and its content is only a small part of it
+            return None
+        img = resize(img, size)
+        # Detach from the source so closing it frees the decoded original
+        if img is source:
+            img = img.copy()
+    return img
+
+
+def prepare_figure(entry, fallback_paths, fit, trim=True, cache=None):
+    """
+    Figure for a JSON Image entry, decoded, trimmed to its content and sized
+    to fit; None if it cannot be found. Decoding errors propagate. Figures
+    are shared through the job's FigureCache, so callers must not modify
+    the returned image.
+    """
+    if cache is None:
+        cache = default_cache()
+    key = source_key(entry, fallback_paths)
+    if key is None:
+        return None
+    img, _ = cache.get_or_render((key, fit, trim), lambda: (_prepare_figure(entry, fallback_paths, fit, trim), None))
+    return img
+
+
+def _prepare_figure(entry, fallback_paths, fit, trim):
+    img = _prepare(entry, fallback_paths, fit, trim)
+    if img is None:
+        img = _prepare(entry, fallback_paths, fit, trim, draft=False)
+    return img
+
+
+class FigureCache(blockcache.BlockCache):
+    """
+    Prepared figures of the job, least recently used evicted beyond
+    DOC2VIZ_FIGURE_CACHE_MB (default 128). A figure referenced by several
+    questions (direction blocks, figures listed both in visuals.json and in
+    the Markdown) is decoded and resized once.
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(FIGURE_CACHE_MB_ENV, '128')) * 1024 * 1024)
+        super(FigureCache, self).__init__(max_bytes)
+
+
+_default = None
+
+
+def default_cache():
+    global _default
+    if _default is None:
+        _default = FigureCache()
+    return _default
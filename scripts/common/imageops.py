@@ -0,0 +1,70 @@
+"""
+Vectorized pixel operations on rendered tables and figures.
+
+wkhtmltoimage renders tables on a fixed-width page and many figures carry
+wide blank borders. Pasting those margins into a question canvas makes it
+taller, so it costs memory and encoded bytes for nothing. trim() crops an
+image to its content bounding box. It finds the box with NumPy row and
+column reductions over the pixel array instead of walking pixels in
+Python. is_grayscale() tells canvas.py whether a pasted image needs an RGB
+canvas.
+"""
+import numpy as np
+from PIL import Image
+
+from common import profiling
+
+# Channel difference from the background that still counts as background
+# (JPEG noise and antialiasing of blank borders)
+DEFAULT_TOLERANCE = 10
+# Blank pixels kept around the content so borders and strokes are not flush with the crop
+DEFAULT_PADDING = 4
+
+
+def content_bbox(img, tolerance=DEFAULT_TOLERANCE, background=None):
+    """
+    (left, top, right, bottom) of the pixels that differ from the background,
+    or None for a blank image. The background defaults to the top-left pixel.
+    Fully transparent pixels always count as background.
+    """
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    rgba = np.asarray(img.convert('RGBA' if has_alpha else 'RGB'))
+    rgb = rgba[..., :3].astype(np.int16)
+    if background is None:
+        background = rgb[0, 0]
+    else:
+        background = np.asarray(background[:3], dtype=np.int16)
+    content = (np.abs(rgb - background) > tolerance).any(axis=2)
+    if has_alpha:
+        content &= rgba[..., 3] > 0
+    rows = np.flatnonzero(content.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(content.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+@profiling.timed('trim')
+def trim(img, padding=DEFAULT_PADDING, tolerance=DEFAULT_TOLERANCE, background=None):
+    """img cropped to its content plus padding; blank images are returned unchanged"""
+    if not isinstance(img, Image.Image):
+        # Vector tables (svg.SvgCanvas) are laid out tight already
+        return img
+    bbox = content_bbox(img, tolerance, background)
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    box = (max(0, left - padding), max(0, top - padding),
+           min(img.width, right + padding), min(img.height, bottom + padding))
+    if box == (0, 0, img.width, img.height):
+        return img
+    return img.crop(box)
+
+
+def is_grayscale(img, tolerance=DEFAULT_TOLERANCE):
+    """True if no pixel's channels differ by more than tolerance"""
+    if img.mode in ('1', 'L', 'LA', 'I', 'I;16', 'F'):
+        return True
+    rgb = np.asarray(img.convert('RGB'))
+    spread = rgb.max(axis=2).astype(np.int16) - rgb.min(axis=2)
+    return bool((spread <= tolerance).all())
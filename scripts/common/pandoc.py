@@ -0,0 +1,250 @@
+"""
+Pandoc runner with a content-addressed artifact cache.
+
+The Pandoc output for a DOCX only depends on the document, the Pandoc
+version and the command-line flags - not on the variant, the renderer or
+its settings. pandoc_text() reads the converted document from Pandoc's
+stdout pipe, so the pipeline stages that consume it right away never touch
+the disk, and caches it with the extracted media and Pandoc's messages under
+
+    sha256(DOCX bytes) + pandoc --version + output format + flags
+
+so a document converted again (under any scripts/* variant) skips Pandoc.
+The media directory differs on every run, so occurrences of it in the
+output are stored as a placeholder and substituted on a hit. When a local
+`pandoc server` is configured (common/pandoc_server.py) it converts there
+instead and falls back to the CLI if the server fails.
+
+The cache lives in DOC2VIZ_PANDOC_CACHE_DIR (default <tmp>/doc2viz-pandoc-cache)
+and is trimmed least-recently-used to DOC2VIZ_PANDOC_CACHE_MB (default 512).
+DOC2VIZ_PANDOC_CACHE=0 disables it.
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from common import pandoc_server, profiling
+
+CACHE_ENV = 'DOC2VIZ_PANDOC_CACHE'
+CACHE_DIR_ENV = 'DOC2VIZ_PANDOC_CACHE_DIR'
+CACHE_MB_ENV = 'DOC2VIZ_PANDOC_CACHE_MB'
+
+CACHE_FORMAT = 3
+MEDIA_PLACEHOLDER = '@@DOC2VIZ_MEDIA_DIR@@'
+OUTPUT_NAME = 'output'
+MEDIA_NAME = 'media'
+META_NAME = 'meta.json'
+
+_version = None
+
+
+def pandoc_version():
+    """First line of `pandoc --version`; raises FileNotFoundError if Pandoc is not installed"""
+    global _version
+    if _version is None and pandoc_server.enabled():
+        try:
+            # Same spelling as the CLI, so cache entries are shared between backends
+            _version = f'pandoc {pandoc_server.version()}'
+        except pandoc_server.PandocServerError as e:
+            _server_failed(e)
+    if _version is None:
+        result = subprocess.run(['pandoc', '--version'], capture_output=True, text=True)
+        _version = (result.stdout.splitlines() or [''])[0].strip()
+    return _version
+
+
+def _server_failed(error):
+    sys.stderr.write(f"{error}; falling back to the pandoc CLI\n")
+    pandoc_server.disable()
+
+
+def _server_options(media_dir, extra_args):
+    """pandoc server options equivalent to the CLI flags, or None if the server cannot honour them"""
+    if media_dir:
+        # The server has no file system access
+        return None
+    options = {}
+    for arg in extra_args:
+        if arg == '--mathml':
+            options['html-math-method'] = {'method': 'mathml'}
+        else:
+            return None
+    return options
+
+
+def cache_enabled():
+    return os.environ.get(CACHE_ENV, '1') != '0'
+
+
+def cache_dir():
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(tempfile.gettempdir(), 'doc2viz-pandoc-cache')
+
+
+def _docx_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(docx_path, to, extract_media, extra_args):
+    payload = json.dumps({
+        'format': CACHE_FORMAT,
+        'docx': _docx_digest(docx_path),
+        'pandoc': pandoc_version(),
+        'to': to,
+        'extract_media': bool(extract_media),
+        'args': list(extra_args),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _media_refs(media_dir):
+    """Spellings of media_dir that Pandoc may write into its output"""
+    refs = {media_dir, media_dir.replace('\\', '/')}
+    return sorted(refs, key=len, reverse=True)
+
+
+def _copy_tree(src, dst):
+    for dirpath, _, filenames in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for filename in filenames:
+            shutil.copyfile(os.path.join(dirpath, filename), os.path.join(target, filename))
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _load(entry, media_dir):
+    """Restore a cached conversion; returns (text, stdout, stderr) or None on a miss"""
+    meta_path = os.path.join(entry, META_NAME)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(entry, OUTPUT_NAME), 'r', encoding='utf-8') as f:
+            text = f.read()
+    except (OSError, ValueError):
+        return None
+    if media_dir:
+        text = text.replace(MEDIA_PLACEHOLDER, media_dir)
+        cached_media = os.path.join(entry, MEDIA_NAME)
+        if os.path.isdir(cached_media):
+            _copy_tree(cached_media, media_dir)
+    # Recency for eviction
+    os.utime(meta_path, None)
+    return text, meta.get('stdout', ''), meta.get('stderr', '')
+
+
+def _store(entry, text, media_dir, stdout, stderr):
+    root = os.path.dirname(entry)
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=root)
+    try:
+        if media_dir:
+            for ref in _media_refs(media_dir):
+                text = text.replace(ref, MEDIA_PLACEHOLDER)
+            if os.path.isdir(media_dir):
+                _copy_tree(media_dir, os.path.join(tmp, MEDIA_NAME))
+        with open(os.path.join(tmp, OUTPUT_NAME), 'w', encoding='utf-8') as f:
+            f.write(text)
+        with open(os.path.join(tmp, META_NAME), 'w', encoding='utf-8') as f:
+            json.dump({'stdout': stdout, 'stderr': stderr}, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another job stored the same conversion first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    _evict(root)
+
+
+def _evict(root):
+    max_bytes = int(float(os.environ.get(CACHE_MB_ENV, '512')) * 1024 * 1024)
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith('.tmp-'):
+            continue
+        try:
+            used = os.path.getmtime(os.path.join(path, META_NAME))
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        entries.append((used, _tree_size(path), path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _run_cached(cmd, docx_path, to, media_dir, extra_args, run):
+    """
+    Answer cmd from the cache or call run(), which returns (CompletedProcess,
+    converted text). Returns (CompletedProcess, text, hit).
+    """
+    if not cache_enabled():
+        return run() + (False,)
+    entry = os.path.join(cache_dir(), cache_key(docx_path, to, media_dir, extra_args))
+    if os.path.isdir(entry):
+        with profiling.timed('pandoc_cache_hit'):
+            cached = _load(entry, media_dir)
+        if cached is not None:
+            text, stdout, stderr = cached
+            return subprocess.CompletedProcess(cmd, 0, stdout, stderr), text, True
+    result, text = run()
+    if result.returncode == 0:
+        try:
+            _store(entry, text, media_dir, result.stdout, result.stderr)
+        except (OSError, UnicodeDecodeError):
+            # Caching is best effort; the conversion itself succeeded
+            pass
+    return result, text, False
+
+
+@profiling.timed('pandoc')
+def pandoc_text(docx_path, to, media_dir=None, extra_args=()):
+    """
+    Run `pandoc -s docx_path -t to [--extract-media=media_dir] extra_args` and
+    read the document from its stdout pipe instead of an output file, or
+    convert on the local pandoc server when one is configured. Returns a
+    CompletedProcess whose stdout is the converted document and whose stderr
+    holds Pandoc's messages. Answered from the artifact cache when the same
+    conversion ran before; failed runs are never cached.
+    """
+    cmd = ['pandoc', '-s', docx_path, '-t', to]
+    if media_dir:
+        cmd.append(f'--extract-media={media_dir}')
+    cmd.extend(extra_args)
+
+    def run():
+        options = _server_options(media_dir, extra_args)
+        if options is not None and pandoc_server.enabled():
+            try:
+                text, stderr = pandoc_server.convert(docx_path, to, options=options)
+                return subprocess.CompletedProcess(cmd, 0, '', stderr), text
+            except pandoc_server.PandocServerError as e:
+                _server_failed(e)
+        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', errors='replace')
+        # The document is the cached output; only the messages go to meta.json
+        return subprocess.CompletedProcess(cmd, result.returncode, '', result.stderr), result.stdout
+
+    result, text, _ = _run_cached(cmd, docx_path, to, media_dir, extra_args, run)
+    return subprocess.CompletedProcess(cmd, result.returncode, text, result.stderr)
@@ -0,0 +1,159 @@
+"""
+Client for a local `pandoc server`.
+
+Every Pandoc CLI run pays for starting the Haskell runtime. When
+DOC2VIZ_PANDOC_SERVER_URL points at a running `pandoc server` (the web
+server launches one when DOC2VIZ_PANDOC_SERVER=1), pandoc.pandoc_text()
+sends conversions to that warm process instead. HTTP connections are kept
+alive in a small pool (DOC2VIZ_PANDOC_SERVER_POOL, default 4).
+
+Any failure raises PandocServerError and the caller falls back to the CLI;
+after a connection failure the server is not tried again in this process.
+"""
+import os
+import json
+import base64
+import queue
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+SERVER_URL_ENV = 'DOC2VIZ_PANDOC_SERVER_URL'
+POOL_SIZE_ENV = 'DOC2VIZ_PANDOC_SERVER_POOL'
+TIMEOUT_ENV = 'DOC2VIZ_PANDOC_SERVER_TIMEOUT'
+
+# Binary input formats are sent base64-encoded
+BINARY_FORMATS = {'docx', 'odt', 'epub', 'pptx', 'xlsx'}
+
+
+class PandocServerError(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP connections to one host, reused across requests"""
+
+    def __init__(self, url, size=4, timeout=60.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.path = parts.path.rstrip('/')
+        self.https = parts.scheme == 'https'
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max(1, size))
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, body bytes); retries once if an idle connection went stale"""
+        for attempt in (0, 1):
+            try:
+                conn = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                conn = self._connect()
+                reused = False
+            try:
+                conn.request(method, self.path + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise PandocServerError(f"pandoc server unreachable: {e}")
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_lock = threading.Lock()
+_pool = None
+_disabled = False
+
+
+def server_url():
+    return os.environ.get(SERVER_URL_ENV) or None
+
+
+def enabled():
+    return server_url() is not None and not _disabled
+
+
+def disable():
+    """Stop using the server for the rest of this process"""
+    global _disabled
+    _disabled = True
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ConnectionPool(server_url(),
+                                   size=int(os.environ.get(POOL_SIZE_ENV, '4')),
+                                   timeout=float(os.environ.get(TIMEOUT_ENV, '60')))
+        return _pool
+
+
+def version():
+    """Pandoc version reported by the server, e.g. '3.1.11'"""
+    status, data = _get_pool().request('GET', '/version')
+    if status != 200:
+        raise PandocServerError(f"pandoc server /version returned {status}")
+    return data.decode('utf-8').strip()
+
+
+def format_message(message):
+    """A pandoc server log message as the CLI would print it on stderr"""
+    verbosity = message.get('verbosity', 'WARNING')
+    kind = message.get('type', '')
+    if kind == 'CouldNotConvertTeXMath':
+        return f"[{verbosity}] Could not convert TeX math {message.get('contents', '')}, rendering as TeX"
+    details = {k: v for k, v in message.items() if k not in ('verbosity', 'type')}
+    return f"[{verbosity}] {kind}" + (f" {json.dumps(details, ensure_ascii=False)}" if details else '')
+
+
+def convert(input_path, to, from_format='docx', standalone=True, options=None):
+    """
+    Convert input_path on the server. Returns (output text, stderr text),
+    with the server's log messages formatted like CLI warnings.
+    """
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    params = {
+        'text': base64.b64encode(data).decode('ascii') if from_format in BINARY_FORMATS else data.decode('utf-8'),
+        'from': from_format,
+        'to': to,
+        'standalone': standalone,
+    }
+    params.update(options or {})
+    status, body = _get_pool().request('POST', '/', body=json.dumps(params).encode('utf-8'),
+                                       headers={'Content-Type': 'application/json', 'Accept': 'application/json'})
+    if status != 200:
+        raise PandocServerError(f"pandoc server returned {status}: {body.decode('utf-8', 'replace').strip()}")
+    try:
+        result = json.loads(body)
+    except ValueError as e:
+        raise PandocServerError(f"pandoc server sent invalid JSON: {e}")
+    if 'error' in result:
+        raise PandocServerError(f"pandoc server error: {result['error']}")
+    output = result.get('output', '')
+    if result.get('base64'):
+        output = base64.b64decode(output).decode('utf-8')
+    stderr = '\n'.join(format_message(m) for m in result.get('messages', []))
+    return output, stderr
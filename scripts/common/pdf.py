@@ -0,0 +1,277 @@
+"""
+PDF output: one multi-page document per section.
+
+With DOC2VIZ_OUTPUT_FORMAT=pdf the renderers still build one canvas per
+question, but Encoder.save() hands it to add_page() instead of writing a
+file. The questions of a section flow top to bottom onto A4 pages, scaled
+to the text width, into <section>/questions.pdf (solutions.pdf for
+solutions_mock). A page is written out as soon as it is full, so only the
+current page is held. finish() completes the open documents; the upload
+ZIP then holds a few PDFs instead of hundreds of images.
+
+Two backends:
+
+- reportlab (optional dependency): the canvases are the recording
+  svg.SvgCanvas, replayed as PDF text, lines and rectangles. Each font file
+  is embedded once per document (subset), figures are stored once however
+  often they appear, and the text stays selectable.
+- Pillow, when reportlab is not installed: the raster canvases are
+  composed onto page bitmaps at the preset's dpi and appended to the PDF
+  page by page.
+"""
+import os
+
+from PIL import Image
+
+from common import svg, canvas, profiling
+
+PAGE_WIDTH, PAGE_HEIGHT = 595.28, 841.89  # A4 in points
+PAGE_MARGIN = 36
+QUESTION_GAP = 12
+
+
+def available():
+    """True when reportlab is installed and pages are written as vector PDF"""
+    try:
+        import reportlab  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def backend():
+    return 'reportlab' if available() else 'pillow'
+
+
+def document_path(out_path):
+    """<section dir>/questions.pdf for .../question_12.png, solutions.pdf for solution_*"""
+    directory, name = os.path.split(out_path)
+    kind = name.split('_', 1)[0] or 'page'
+    return os.path.join(directory, kind + 's.pdf')
+
+
+class Layout(object):
+    """Places canvases of any height top to bottom on fixed-size pages"""
+
+    def __init__(self, page_size=(PAGE_WIDTH, PAGE_HEIGHT), margin=PAGE_MARGIN, gap=QUESTION_GAP):
+        self.page_width, self.page_height = page_size
+        self.margin = margin
+        self.gap = gap
+        self.cursor = None
+
+    def place(self, width, height):
+        """(new_page, x, top, scale) in points, top measured from the top of the page"""
+        content_width = self.page_width - 2 * self.margin
+        content_height = self.page_height - 2 * self.margin
+        scale = min(content_width / width, content_height / height)
+        h = height * scale
+        x = self.margin + (content_width - width * scale) / 2
+        new_page = self.cursor is None or self.cursor + h > self.page_height - self.margin
+        if new_page:
+            self.cursor = self.margin
+        top = self.cursor
+        self.cursor += h + self.gap
+        return new_page, x, top, scale
+
+
+def _rgb(value):
+    """reportlab colour for an svg colour string"""
+    from reportlab.lib import colors
+    if value.startswith('rgb('):
+        r, g, b = (int(v) for v in value[4:-1].split(','))
+        return colors.Color(r / 255.0, g / 255.0, b / 255.0)
+    if value.startswith('#') and len(value) == 4:
+        value = '#' + ''.join(c * 2 for c in value[1:])
+    return colors.toColor(value)
+
+
+class VectorDocument(object):
+    """Section PDF drawn with reportlab from recorded svg.SvgCanvas pages"""
+
+    def __init__(self, target, title=None, options=None):
+        from reportlab.pdfgen import canvas as rl_canvas
+        self.pdf = rl_canvas.Canvas(target, pagesize=(PAGE_WIDTH, PAGE_HEIGHT), pageCompression=1)
+        if title:
+            self.pdf.setTitle(title)
+        self.layout = Layout()
+        self.pages = 0
+        self._fonts = {}
+        self._readers = {}
+
+    def _font_name(self, font):
+        """reportlab name of a PIL font, registered (and later embedded) once"""
+        path = getattr(font, 'path', None)
+        if not path:
+            return 'Helvetica'
+        name = self._fonts.get(path)
+        if name is None:
+            from reportlab.pdfbase import pdfmetrics
+            from reportlab.pdfbase.ttfonts import TTFont
+            name = 'doc2viz-' + os.path.splitext(os.path.basename(path))[0]
+            if name not in pdfmetrics.getRegisteredFontNames():
+                pdfmetrics.registerFont(TTFont(name, path))
+            self._fonts[path] = name
+        return name
+
+    def _reader(self, im):
+        from reportlab.lib.utils import ImageReader
+        entry = self._readers.get(id(im))
+        if entry is None:
+            if im.mode not in ('L', 'RGB', 'RGBA'):
+                im = im.convert('RGBA' if 'A' in im.getbands() else 'RGB')
+            entry = self._readers[id(im)] = (im, ImageReader(im))
+        return entry[1]
+
+    def add_page(self, img):
+        if isinstance(img, Image.Image):
+            raster, img = img, svg.SvgCanvas(img.size, color=None)
+            img.paste(raster, (0, 0))
+        new_page, x, top, scale = self.layout.place(img.width, img.height)
+        if new_page and self.pages:
+            self.pdf.showPage()
+        if new_page:
+            self.pages += 1
+        pdf = self.pdf
+        pdf.saveState()
+        path = pdf.beginPath()
+        path.rect(x, PAGE_HEIGHT - top - img.height * scale, img.width * scale, img.height * scale)
+        pdf.clipPath(path, stroke=0, fill=0)
+        self._draw(img, x, PAGE_HEIGHT - top, scale)
+        pdf.restoreState()
+
+    def _draw(self, recorded, left, top, s):
+        """Replay an SvgCanvas with its (0, 0) at (left, top) in PDF points"""
+        from reportlab.pdfbase import pdfmetrics
+        pdf = self.pdf
+        if recorded.background is not None:
+            pdf.setFillColor(_rgb(recorded.background))
+            pdf.rect(left, top - recorded.height * s, recorded.width * s, recorded.height * s, stroke=0, fill=1)
+        for element in recorded.elements:
+            kind = element[0]
+            if kind == 'text':
+                _, x, y, text, font, fill, length = element
+                name = self._font_name(font)
+                size = getattr(font, 'size', 11) * s
+                t = pdf.beginText(left + x * s, top - y * s)
+                t.setFont(name, size)
+                natural = pdfmetrics.stringWidth(text, name, size)
+                if len(text) > 1 and length and natural:
+                    # Pin the run to the width PIL measured, like textLength in the SVG
+                    t.setHorizScale(100.0 * length * s / natural)
+                pdf.setFillColor(_rgb(fill))
+                t.textOut(text)
+                pdf.drawText(t)
+            elif kind == 'line':
+                _, x0, y0, x1, y1, stroke, width = element
+                pdf.setStrokeColor(_rgb(stroke))
+                pdf.setLineWidth(width * s)
+                pdf.line(left + x0 * s, top - y0 * s, left + x1 * s, top - y1 * s)
+            elif kind == 'rect':
+                _, x0, y0, x1, y1, fill, outline, width = element
+                inset = width / 2.0 if outline else 0
+                w = max(0, x1 - x0 + 1 - 2 * inset) * s
+                h = max(0, y1 - y0 + 1 - 2 * inset) * s
+                if fill:
+                    pdf.setFillColor(_rgb(fill))
+                if outline:
+                    pdf.setStrokeColor(_rgb(outline))
+                    pdf.setLineWidth(width * s)
+                pdf.rect(left + (x0 + inset) * s, top - (y0 + inset) * s - h, w, h,
+                         stroke=1 if outline else 0, fill=1 if fill else 0)
+            elif kind == 'image':
+                _, x, y, im = element
+                mask = 'auto' if 'A' in im.getbands() else None
+                pdf.drawImage(self._reader(im), left + x * s, top - (y + im.height) * s,
+                              width=im.width * s, height=im.height * s, mask=mask)
+            elif kind == 'group':
+                _, x, y, child = element
+                self._draw(child, left + x * s, top - y * s, s)
+
+    def close(self):
+        if not self.pages:
+            self.pdf.showPage()
+        self.pdf.save()
+
+
+class RasterDocument(object):
+    """Section PDF of page bitmaps, written with Pillow one page at a time"""
+
+    def __init__(self, target, title=None, options=None):
+        options = dict(options or {})
+        self.target = target
+        self.title = title
+        self.dpi = options.pop('dpi', 200)
+        self.options = options
+        self.layout = Layout()
+        self.pages = 0
+        self._pending = []
+
+    def _px(self, points):
+        return int(round(points * self.dpi / 72.0))
+
+    def add_page(self, img):
+        if isinstance(img, svg.SvgCanvas):
+            raise TypeError('vector canvases need reportlab')
+        new_page, x, top, scale = self.layout.place(img.width, img.height)
+        if new_page:
+            self._flush()
+        size = (max(1, self._px(img.width * scale)), max(1, self._px(img.height * scale)))
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        self._pending.append((img, (self._px(x), self._px(top))))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        images = [img for img, _ in self._pending]
+        page = Image.new(canvas.mode_for(images), (self._px(PAGE_WIDTH), self._px(PAGE_HEIGHT)), 'white')
+        for img, box in self._pending:
+            page.paste(img.convert(page.mode) if img.mode != page.mode else img, box)
+        self._pending = []
+        extra = {'title': self.title} if self.title and not self.pages else {}
+        page.save(self.target, format='PDF', resolution=self.dpi, append=bool(self.pages), **extra, **self.options)
+        self.pages += 1
+
+    def close(self):
+        self._flush()
+        if not self.pages:
+            Image.new('L', (self._px(PAGE_WIDTH), self._px(PAGE_HEIGHT)), 'white').save(
+                self.target, format='PDF', resolution=self.dpi)
+
+
+def open_document(target, title=None, options=None):
+    """A section document writing to a path (or, for a single page, a file object)"""
+    if available():
+        return VectorDocument(target, title=title, options=options)
+    return RasterDocument(target, title=title, options=options)
+
+
+_documents = {}
+
+
+@profiling.timed('pdf_page')
+def add_page(img, path, options=None):
+    """Append a question canvas to the section document at path, opening it on first use"""
+    document = _documents.get(path)
+    if document is None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        title = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        document = _documents[path] = open_document(path, title=title, options=options)
+    document.add_page(img)
+
+
+def finish():
+    """Complete and close every open section document; returns their paths"""
+    paths = []
+    while _documents:
+        path, document = _documents.popitem()
+        document.close()
+        paths.append(path)
+    return paths
+
+
+def write(img, fp, options=None):
+    """Write a single canvas as a one-page PDF to a path or binary file object"""
+    document = open_document(fp, options=options)
+    document.add_page(img)
+    document.close()
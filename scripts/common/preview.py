@@ -0,0 +1,131 @@
+"""
+Low-resolution preview of a paper.
+
+Operators mostly upload a paper to check that it was parsed correctly, and
+full-resolution renders of every question take a while. With --preview
+(json_to_question_images.py or wordToMD.py), questions are laid out exactly
+as usual on the recording canvas of common/svg.py, so:
+
+- tables are drawn as vector grids and wkhtmltoimage never runs,
+- nothing is rasterized at full size; each question is drawn once at
+  DOC2VIZ_PREVIEW_WIDTH (default 400px) with proportionally smaller fonts.
+
+The thumbnails of a section are packed into one labelled contact sheet,
+<section>/contact_sheet.jpg, encoded as a plain JPEG. A full-resolution run
+of the same paper later replaces the sheets through the render manifest.
+"""
+import os
+
+from PIL import Image, ImageDraw, ImageFont
+
+from common import svg, canvas, profiling
+
+PREVIEW_WIDTH_ENV = 'DOC2VIZ_PREVIEW_WIDTH'
+DEFAULT_WIDTH = 400
+SHEET_NAME = 'contact_sheet'
+SHEET_COLUMNS = 4
+SHEET_GUTTER = 16
+LABEL_SIZE = 14
+# JPEG cannot store more than 65535px per side; stay well below
+MAX_SHEET_HEIGHT = 30000
+
+LABEL_FONT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'dejavu-fonts-ttf-2.37', 'ttf', 'DejaVuSans.ttf'))
+
+
+def enable(width=None):
+    """Switch this process, and pipelines it starts, to preview output"""
+    from common import encoders
+    os.environ[encoders.FORMAT_ENV] = 'preview'
+    os.environ[PREVIEW_WIDTH_ENV] = str(int(width or DEFAULT_WIDTH))
+
+
+def width():
+    try:
+        return max(50, int(os.environ.get(PREVIEW_WIDTH_ENV, DEFAULT_WIDTH)))
+    except ValueError:
+        return DEFAULT_WIDTH
+
+
+def sheet_path(out_path):
+    """<section dir>/contact_sheet.jpg for any question or solution of that section"""
+    return os.path.join(os.path.dirname(out_path), SHEET_NAME + '.jpg')
+
+
+@profiling.timed('preview_thumbnail')
+def thumbnail(img):
+    """A question canvas drawn at the preview width"""
+    return svg.rasterize(img, width())
+
+
+def _label_font():
+    try:
+        return ImageFont.truetype(LABEL_FONT, LABEL_SIZE)
+    except OSError:
+        return ImageFont.load_default()
+
+
+class ContactSheet(object):
+    """Labelled thumbnails of one section, laid out in rows when written"""
+
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options or {}
+        self.thumbnails = []
+
+    def add(self, img, label):
+        self.thumbnails.append((thumbnail(img), label))
+
+    def _columns(self, cell_width, label_height):
+        heights = [thumb.height + label_height for thumb, _ in self.thumbnails]
+        columns = SHEET_COLUMNS
+        while columns < len(heights):
+            rows = [max(heights[i:i + columns]) for i in range(0, len(heights), columns)]
+            if sum(rows) + SHEET_GUTTER * (len(rows) + 1) <= MAX_SHEET_HEIGHT:
+                break
+            columns += 1
+        return max(1, min(columns, len(heights)))
+
+    @profiling.timed('preview_sheet')
+    def save(self):
+        font = _label_font()
+        label_height = LABEL_SIZE + 8
+        cell_width = max(thumb.width for thumb, _ in self.thumbnails)
+        columns = self._columns(cell_width, label_height)
+        rows = [self.thumbnails[i:i + columns] for i in range(0, len(self.thumbnails), columns)]
+        row_heights = [max(thumb.height for thumb, _ in row) + label_height for row in rows]
+        size = (columns * cell_width + (columns + 1) * SHEET_GUTTER,
+                sum(row_heights) + (len(rows) + 1) * SHEET_GUTTER)
+        images = [thumb for thumb, _ in self.thumbnails]
+        sheet = Image.new(canvas.mode_for(images), size, '#e6e6e6')
+        draw = ImageDraw.Draw(sheet)
+        y = SHEET_GUTTER
+        for row, row_height in zip(rows, row_heights):
+            x = SHEET_GUTTER
+            for thumb, label in row:
+                draw.text((x, y), label, font=font, fill='black')
+                sheet.paste(thumb if thumb.mode == sheet.mode else thumb.convert(sheet.mode), (x, y + label_height))
+                x += cell_width + SHEET_GUTTER
+            y += row_height + SHEET_GUTTER
+        sheet.save(self.path, format='JPEG', **self.options)
+        return self.path
+
+
+_sheets = {}
+
+
+def add(img, out_path, path, options=None):
+    """Add a question canvas, labelled after out_path, to the contact sheet at path"""
+    sheet = _sheets.get(path)
+    if sheet is None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        sheet = _sheets[path] = ContactSheet(path, options)
+    sheet.add(img, os.path.splitext(os.path.basename(out_path))[0].replace('_', ' '))
+
+
+def finish():
+    """Write every contact sheet; returns their paths"""
+    paths = []
+    while _sheets:
+        _, sheet = _sheets.popitem()
+        paths.append(sheet.save())
+    return paths
@@ -0,0 +1,152 @@
+"""
+Lightweight timers for pipeline stages and hot helpers.
+
+Timers are always collected (the overhead is one perf_counter call per
+entry/exit). A report is only written when profiling is enabled, either
+with the --profile flag of the entry-point scripts or through the
+DOC2VIZ_PROFILE_DIR environment variable, which child processes inherit.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+
+PROFILE_DIR_ENV = 'DOC2VIZ_PROFILE_DIR'
+PROFILE_PSTATS_ENV = 'DOC2VIZ_PROFILE_PSTATS'
+
+_timings = {}
+_state = {'enabled': False, 'output_dir': None, 'role': None, 'meta': {}, 'profiler': None, 'started': None}
+
+
+def record(name, duration_s):
+    """Add one measurement (in seconds) to the named timer"""
+    entry = _timings.get(name)
+    if entry is None:
+        entry = _timings[name] = [0, 0.0, 0.0]
+    entry[0] += 1
+    entry[1] += duration_s
+    if duration_s > entry[2]:
+        entry[2] = duration_s
+
+
+class _Timer(object):
+    """Usable both as a decorator and as a context manager"""
+
+    def __init__(self, name):
+        self.name = name
+        self._starts = []
+
+    def __enter__(self):
+        self._starts.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self._starts.pop())
+        return False
+
+    def __call__(self, func):
+        name = self.name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+
+
+def timed(name=None):
+    """
+    Time a block or a function:
+        with timed('wkhtmltoimage'): ...
+        @timed('clean_markdown_content')
+        def clean_markdown_content(...): ...
+    """
+    if callable(name):
+        # Bare @timed usage
+        return _Timer(None)(name)
+    return _Timer(name)
+
+
+def snapshot():
+    """Current timers as {name: {count, total_ms, mean_ms, max_ms}}, slowest first"""
+    report = {}
+    for name, (count, total, longest) in sorted(_timings.items(), key=lambda kv: -kv[1][1]):
+        report[name] = {
+            'count': count,
+            'total_ms': round(total * 1000, 3),
+            'mean_ms': round(total * 1000 / count, 3) if count else 0.0,
+            'max_ms': round(longest * 1000, 3),
+        }
+    return report
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def enable(output_dir, role, pstats=False, meta=None):
+    """
+    Turn on report writing for this process. The report (and optional pstats
+    dump) is written to output_dir when the process exits. The settings are
+    exported to the environment so child scripts profile themselves too.
+    """
+    if _state['enabled']:
+        return
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    os.environ[PROFILE_DIR_ENV] = output_dir
+    os.environ[PROFILE_PSTATS_ENV] = '1' if pstats else ''
+    _state.update(enabled=True, output_dir=output_dir, role=role, meta=dict(meta or {}), started=time.perf_counter())
+    if pstats:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _state['profiler'] = profiler
+    atexit.register(write_report)
+
+
+def enable_from_env(role, meta=None):
+    """Enable profiling if a parent process asked for it through the environment"""
+    output_dir = os.environ.get(PROFILE_DIR_ENV)
+    if output_dir:
+        enable(output_dir, role, pstats=bool(os.environ.get(PROFILE_PSTATS_ENV)), meta=meta)
+
+
+def update_meta(**fields):
+    _state['meta'].update(fields)
+
+
+def write_report():
+    """Write <role>.timings.json (and <role>.pstats) into the profile directory"""
+    if not _state['enabled']:
+        return None
+    output_dir = _state['output_dir']
+    role = _state['role'] or 'pipeline'
+    profiler = _state['profiler']
+    if profiler is not None:
+        profiler.disable()
+        _state['profiler'] = None
+        try:
+            profiler.dump_stats(os.path.join(output_dir, f'{role}.pstats'))
+        except Exception as e:
+            print(f"Failed to write pstats file: {e}", file=sys.stderr)
+    report = {
+        'role': role,
+        'pid': os.getpid(),
+        'wall_ms': round((time.perf_counter() - _state['started']) * 1000, 3),
+        'meta': _state['meta'],
+        'timers': snapshot(),
+    }
+    report_path = os.path.join(output_dir, f'{role}.timings.json')
+    try:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"Failed to write timing report: {e}", file=sys.stderr)
+        return None
+    return report_path
@@ -0,0 +1,84 @@
+"""
+Machine-readable progress events for the conversion pipeline.
+
+Events are written as JSON lines to a dedicated channel chosen by the
+DOC2VIZ_PROGRESS_FD environment variable:
+    - a file descriptor number (e.g. "3") inherited from the parent process
+    - "stderr" to interleave events with normal stderr output
+When the variable is unset, events are silently dropped.
+"""
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+from common import profiling
+
+PROGRESS_FD_ENV = 'DOC2VIZ_PROGRESS_FD'
+
+_stream = None
+_stream_opened = False
+
+
+def _get_stream():
+    global _stream, _stream_opened
+    if _stream_opened:
+        return _stream
+    _stream_opened = True
+    target = os.environ.get(PROGRESS_FD_ENV, '').strip()
+    if not target:
+        _stream = None
+    elif target == 'stderr':
+        _stream = sys.stderr
+    else:
+        try:
+            _stream = os.fdopen(int(target), 'w', buffering=1, encoding='utf-8', closefd=False)
+        except (ValueError, OSError):
+            _stream = None
+    return _stream
+
+
+def emit(event, **fields):
+    """Write a single progress event; never raises"""
+    stream = _get_stream()
+    if stream is None:
+        return
+    record = {'event': event, 'ts': round(time.time(), 3), 'pid': os.getpid()}
+    record.update(fields)
+    try:
+        stream.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        stream.flush()
+    except Exception:
+        pass
+
+
+@contextmanager
+def stage(name, **fields):
+    """Emit stage_start/stage_end events around a pipeline stage, with wall-clock duration"""
+    emit('stage_start', stage=name, **fields)
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        profiling.record('stage.' + name, elapsed)
+        duration_ms = round(elapsed * 1000, 2)
+        emit('stage_end', stage=name, status=status, duration_ms=duration_ms, **fields)
+
+
+def report(stage_name, completed, total, **fields):
+    """Emit an item-level progress event (e.g. N of M questions rendered)"""
+    emit('progress', stage=stage_name, completed=completed, total=total, **fields)
+
+
+def subprocess_kwargs():
+    """Keyword arguments for subprocess.run so a child script keeps writing to the same channel"""
+    target = os.environ.get(PROGRESS_FD_ENV, '').strip()
+    if target.isdigit() and os.name != 'nt':
+        return {'pass_fds': (int(target),)}
+    return {}
@@ -0,0 +1,127 @@
+"""
+Render manifest for incremental re-rendering.
+
+Editors often upload the same paper again after fixing a typo or two. The
+manifest, stored next to the output folder as
+conversions/<upload_folder>.render_manifest.json, maps every rendered image
+(relative to the output folder) to a hash of what produced it:
+    - the question/solution JSON, with Image entries replaced by the
+      digests of the media they point to (paths change on every upload)
+    - the font file, the renderer source, the shared common/ modules
+      (trimming, figure sizing, tables, canvases, encoders) and the
+      render settings
+On the next run, items whose hash and output file are unchanged are not
+rendered again, and images of items that disappeared are deleted.
+"""
+import os
+import json
+import hashlib
+
+from common import docx_media
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '.render_manifest.json'
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_digests = {}
+
+
+def file_digest(path):
+    """sha256 of a file, memoized on (path, size, mtime); None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = _digests[key] = h.hexdigest()
+    return digest
+
+
+def common_digest():
+    """Digest of every common/*.py, like pipelineVersion() in src/lib/result-cache.ts"""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(COMMON_DIR)):
+        if name.endswith('.py'):
+            h.update(name.encode('utf-8'))
+            h.update((file_digest(os.path.join(COMMON_DIR, name)) or '').encode('ascii'))
+    return h.hexdigest()
+
+
+def manifest_path_for(outdir):
+    return os.path.abspath(outdir).rstrip('/\\') + MANIFEST_SUFFIX
+
+
+def _image_ref(entry):
+    """Stable stand-in for an Image entry: the media digest when found, else its file name"""
+    if not isinstance(entry, str):
+        return entry
+    path = docx_media.media_ref(entry)
+    provider = docx_media.current()
+    digest = (provider.digest(path) if provider else None) or file_digest(path)
+    return {'sha256': digest} if digest else {'missing': os.path.basename(path.replace('\\', '/'))}
+
+
+class RenderManifest(object):
+    def __init__(self, outdir, renderer_file, font_path, settings=None):
+        self.outdir = os.path.abspath(outdir)
+        self.path = manifest_path_for(outdir)
+        self._salt = json.dumps({
+            'renderer': file_digest(renderer_file),
+            'common': common_digest(),
+            'font': file_digest(font_path) if font_path else None,
+            'settings': settings or {},
+        }, sort_keys=True)
+        self.previous = {}
+        self.items = {}
+        self.reused = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('version') == MANIFEST_VERSION:
+                self.previous = stored.get('items', {})
+        except (OSError, ValueError):
+            pass
+
+    def item_hash(self, item):
+        normalized = dict(item)
+        if isinstance(normalized.get('Image'), list):
+            normalized['Image'] = [_image_ref(entry) for entry in normalized['Image']]
+        payload = self._salt + json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _key(self, output_path):
+        return os.path.relpath(os.path.abspath(output_path), self.outdir).replace(os.sep, '/')
+
+    def is_current(self, output_path, item_hash):
+        """True if output_path was rendered from the same inputs and still exists"""
+        if self.previous.get(self._key(output_path)) == item_hash and os.path.exists(output_path):
+            self.reused += 1
+            return True
+        return False
+
+    def record(self, output_path, item_hash):
+        self.items[self._key(output_path)] = item_hash
+
+    def remove_stale(self):
+        """Delete images recorded by the previous run that this run did not produce"""
+        removed = []
+        for key in self.previous:
+            if key in self.items:
+                continue
+            path = os.path.join(self.outdir, *key.split('/'))
+            try:
+                os.remove(path)
+                removed.append(key)
+            except OSError:
+                pass
+        return removed
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'items': self.items}, f, indent=1, sort_keys=True)
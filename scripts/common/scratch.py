@@ -0,0 +1,108 @@
+"""
+Per-job scratch directory for temporary render files.
+
+Every temporary file a job needs (the HTML pages handed to wkhtmltoimage,
+and its PNG output when it cannot write to stdout) lives in one directory
+owned by the job: <tmp>/doc2viz-scratch-<pid>-<random>, or under
+DOC2VIZ_SCRATCH_DIR. Files are deleted as soon as their user is done with
+them (ScratchDir.file()), and the directory itself is removed when the
+process exits. Directories left behind by killed jobs are swept the next
+time a job creates its own.
+"""
+import os
+import time
+import shutil
+import atexit
+import tempfile
+import threading
+import contextlib
+
+SCRATCH_DIR_ENV = 'DOC2VIZ_SCRATCH_DIR'
+PREFIX = 'doc2viz-scratch-'
+# Directories of dead processes older than this are swept
+STALE_AFTER_S = 3600
+
+
+def scratch_root():
+    return os.environ.get(SCRATCH_DIR_ENV) or tempfile.gettempdir()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def sweep_stale(root=None, max_age=STALE_AFTER_S):
+    """Remove scratch directories of processes that no longer run"""
+    root = root or scratch_root()
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        if not name.startswith(PREFIX):
+            continue
+        path = os.path.join(root, name)
+        try:
+            pid = int(name[len(PREFIX):].split('-', 1)[0])
+            if _pid_alive(pid) and pid != os.getpid():
+                continue
+            if now - os.path.getmtime(path) < max_age:
+                continue
+        except (ValueError, OSError):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class ScratchDir(object):
+    def __init__(self, root=None):
+        root = root or scratch_root()
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f'{PREFIX}{os.getpid()}-', dir=root)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def new_path(self, suffix=''):
+        """A fresh path inside the directory; the caller deletes it or leaves it to cleanup()"""
+        with self._lock:
+            self._counter += 1
+            return os.path.join(self.path, f'{self._counter:06d}{suffix}')
+
+    @contextlib.contextmanager
+    def file(self, suffix='', data=None):
+        """A scratch file path (holding data when given), deleted when the block exits"""
+        path = self.new_path(suffix)
+        if data is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+        try:
+            yield path
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+_current = None
+_current_lock = threading.Lock()
+
+
+def current():
+    """The scratch directory of this job, created on first use and removed at exit"""
+    global _current
+    with _current_lock:
+        if _current is None:
+            sweep_stale()
+            _current = ScratchDir()
+            atexit.register(_current.cleanup)
+        return _current
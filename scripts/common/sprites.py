@@ -0,0 +1,195 @@
+"""
+Sprite sheet output: many questions per image, plus a JSON index.
+
+Opening a section as 150 separate files is slow in review tools and in the
+browser. With DOC2VIZ_SPRITES=1 (or --sprites), each question canvas is
+packed into large sheets as soon as it is rendered. The sheets are encoded
+with the run's output encoder as <section>/sprites_<n>.<ext>, and
+<section>/sprites.json gives every question's sheet and bounding box:
+
+    {"sheets": ["sprites_1.jpg", ...],
+     "items": {"question_12": {"sheet": "sprites_1.jpg", "x": 0, "y": 1804,
+                               "width": 1600, "height": 348}, ...}}
+
+Sheets are at most DOC2VIZ_SPRITES px on a side (4096 when set to 1). The
+width is a whole number of question widths. Questions are placed bottom-left
+on a skyline, so columns of different heights fill up evenly. A full sheet
+is encoded and freed right away, so memory stays at one sheet.
+"""
+import os
+import json
+
+from PIL import Image
+
+from common import profiling
+
+SPRITES_ENV = 'DOC2VIZ_SPRITES'
+DEFAULT_SHEET_SIZE = 4096
+SPRITE_GAP = 8
+INDEX_NAME = 'sprites.json'
+
+
+def sheet_size():
+    """Maximum sheet side in px, or 0 when sprites are off"""
+    value = os.environ.get(SPRITES_ENV, '').strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return 0
+    try:
+        size = int(value)
+    except ValueError:
+        return DEFAULT_SHEET_SIZE
+    return DEFAULT_SHEET_SIZE if size == 1 else max(256, size)
+
+
+def enabled():
+    return sheet_size() > 0
+
+
+def enable(size=None):
+    """Switch this process, and pipelines it starts, to sprite sheet output"""
+    os.environ[SPRITES_ENV] = str(int(size or DEFAULT_SHEET_SIZE))
+
+
+def index_path(out_path):
+    """<section dir>/sprites.json for any question or solution of that section"""
+    return os.path.join(os.path.dirname(out_path), INDEX_NAME)
+
+
+class Skyline(object):
+    """Bottom-left packing of rectangles into a sheet of fixed width and maximum height"""
+
+    def __init__(self, width, max_height):
+        self.width = width
+        self.max_height = max_height
+        # (x, y, width) segments of the top edge of what has been placed
+        self.segments = [(0, 0, width)]
+        self.height = 0
+
+    def place(self, w, h):
+        """(x, y) for a w x h rectangle, or None if the sheet has no room for it"""
+        best = None
+        for i, (x, _, _) in enumerate(self.segments):
+            if x + w > self.width:
+                break
+            # The rectangle rests on the highest segment it spans
+            y = 0
+            right = x + w
+            for sx, sy, sw in self.segments[i:]:
+                if sx >= right:
+                    break
+                y = max(y, sy)
+            if y + h <= self.max_height and (best is None or y < best[1]):
+                best = (x, y)
+        if best is None:
+            return None
+        x, y = best
+        self._raise(x, w, y + h)
+        self.height = max(self.height, y + h)
+        return best
+
+    def _raise(self, x, w, top):
+        right = x + w
+        segments = []
+        for sx, sy, sw in self.segments:
+            if sx + sw <= x or sx >= right:
+                segments.append((sx, sy, sw))
+                continue
+            if sx < x:
+                segments.append((sx, sy, x - sx))
+            if sx + sw > right:
+                segments.append((right, sy, sx + sw - right))
+        segments.append((x, top, w))
+        segments.sort()
+        # Merge neighbours at the same height
+        merged = [segments[0]]
+        for sx, sy, sw in segments[1:]:
+            px, py, pw = merged[-1]
+            if py == sy and px + pw == sx:
+                merged[-1] = (px, py, pw + sw)
+            else:
+                merged.append((sx, sy, sw))
+        self.segments = merged
+
+
+class SpriteSection(object):
+    """Sheets and index of one section"""
+
+    def __init__(self, directory, encoder, max_side):
+        self.directory = directory
+        self.encoder = encoder
+        self.max_side = max_side
+        self.sheets = []
+        self.items = {}
+        self._sheet = None
+        self._packer = None
+
+    def _new_sheet(self, img):
+        # Whole question widths per row, so same-width questions tile without waste
+        cell = img.width + SPRITE_GAP
+        columns = max(1, (self.max_side + SPRITE_GAP) // cell)
+        width = max(img.width, columns * cell - SPRITE_GAP)
+        height = max(self.max_side, img.height)
+        self._packer = Skyline(width + SPRITE_GAP, height + SPRITE_GAP)
+        self._sheet = Image.new(img.mode, (width, height), 'white')
+
+    def add(self, img, name):
+        if self._sheet is None:
+            self._new_sheet(img)
+        position = self._packer.place(img.width + SPRITE_GAP, img.height + SPRITE_GAP)
+        if position is None:
+            self._flush()
+            self._new_sheet(img)
+            position = self._packer.place(img.width + SPRITE_GAP, img.height + SPRITE_GAP)
+        if img.mode != self._sheet.mode:
+            if img.mode == 'RGB' and self._sheet.mode == 'L':
+                self._sheet = self._sheet.convert('RGB')
+            else:
+                img = img.convert(self._sheet.mode)
+        self._sheet.paste(img, position)
+        x, y = position
+        self.items[name] = {'sheet': self._sheet_name(len(self.sheets)), 'x': x, 'y': y,
+                            'width': img.width, 'height': img.height}
+
+    def _sheet_name(self, number):
+        return f'sprites_{number + 1}{self.encoder.extension}'
+
+    @profiling.timed('sprite_sheet')
+    def _flush(self):
+        if self._sheet is None:
+            return
+        name = self._sheet_name(len(self.sheets))
+        used = self._sheet.crop((0, 0, self._sheet.width, max(1, self._packer.height - SPRITE_GAP)))
+        self.encoder.encode(used, os.path.join(self.directory, name))
+        self.sheets.append(name)
+        self._sheet = None
+        self._packer = None
+
+    def close(self):
+        """Write the last sheet and the index; returns the paths written"""
+        self._flush()
+        index = os.path.join(self.directory, INDEX_NAME)
+        with open(index, 'w', encoding='utf-8') as f:
+            json.dump({'sheets': self.sheets, 'items': self.items}, f, ensure_ascii=False, indent=1)
+        return [index] + [os.path.join(self.directory, name) for name in self.sheets]
+
+
+_sections = {}
+
+
+def add(img, out_path, encoder):
+    """Pack a question canvas, named after out_path, into its section's sheets"""
+    directory = os.path.dirname(os.path.abspath(out_path))
+    section = _sections.get(directory)
+    if section is None:
+        os.makedirs(directory, exist_ok=True)
+        section = _sections[directory] = SpriteSection(directory, encoder, sheet_size())
+    section.add(img, os.path.splitext(os.path.basename(out_path))[0])
+
+
+def finish():
+    """Write the remaining sheets and every index; returns the paths written"""
+    paths = []
+    while _sections:
+        _, section = _sections.popitem()
+        paths.extend(section.close())
+    return paths
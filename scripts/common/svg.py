@@ -0,0 +1,518 @@
+"""
+SVG backend for question and solution images.
+
+With DOC2VIZ_OUTPUT_FORMAT=svg the renderers draw on an SvgCanvas instead of
+a PIL image. It takes the same calls the layout code already makes:
+canvas.draw(img).text/line/rectangle, textbbox/textlength for measuring
+(answered by PIL with the real font), paste() and crop(). It records them as
+SVG elements, so justification, centring and option layout are exactly those
+of the raster output:
+
+- text becomes <text> runs. Weight and style come from the font file
+  (DejaVuSans-Bold, -Oblique, ...). textLength pins every run to the width PIL
+  measured, so the layout holds when the viewer substitutes a font.
+  Underlines are the <line> elements the renderers already draw.
+- HTML tables are laid out as native SVG grids by TableRenderer. It
+  stands in for the wkhtmltoimage renderer and mirrors the renderers'
+  TABLE_STYLE.
+- Figures (PIL images) are embedded as PNG data URIs. With
+  DOC2VIZ_SVG_FIGURES=link they are written once to figures/<sha1>.png next
+  to the SVG and linked instead.
+
+rasterize() draws a recorded canvas back as a PIL image at another width;
+the preview mode (common/preview.py) uses it for its thumbnails.
+"""
+import io
+import os
+import math
+import base64
+import hashlib
+from html import escape
+
+from PIL import Image, ImageDraw, ImageFont
+
+from common import imageops, blockcache
+
+FIGURES_ENV = 'DOC2VIZ_SVG_FIGURES'
+FONT_FAMILY_FALLBACK = 'sans-serif'
+
+FONT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'dejavu-fonts-ttf-2.37', 'ttf'))
+
+# Measurements go through a real PIL draw, so layout matches the raster backend
+_measure = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+
+def _color(value, default='#000'):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return f'rgb({value},{value},{value})'
+    return 'rgb({},{},{})'.format(*value[:3])
+
+
+def _num(value):
+    return f'{value:.2f}'.rstrip('0').rstrip('.') if isinstance(value, float) else str(value)
+
+
+def _font_attrs(font):
+    """(family, size, weight, style) of a PIL font"""
+    try:
+        family, style = font.getname()
+        size = font.size
+    except AttributeError:
+        return FONT_FAMILY_FALLBACK, 11, 'normal', 'normal'
+    style = (style or '').lower()
+    weight = 'bold' if 'bold' in style else 'normal'
+    slant = 'italic' if ('oblique' in style or 'italic' in style) else 'normal'
+    return family, size, weight, slant
+
+
+class SvgDraw(object):
+    """The subset of PIL.ImageDraw the renderers use, recording onto an SvgCanvas"""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+
+    def textbbox(self, xy, text, font=None, *args, **kwargs):
+        return _measure.textbbox(xy, text, font=font, *args, **kwargs)
+
+    def textlength(self, text, font=None, *args, **kwargs):
+        return _measure.textlength(text, font=font, *args, **kwargs)
+
+    def text(self, xy, text, fill=None, font=None, *args, **kwargs):
+        if font is None:
+            font = ImageFont.load_default()
+        x, y = xy
+        ascent = font.getmetrics()[0] if hasattr(font, 'getmetrics') else 0
+        # PIL multiline text advances by the height of 'A' plus 4px spacing
+        line_step = _measure.textbbox((0, 0), 'A', font=font)[3] + 4
+        for i, line in enumerate(str(text).split('\n')):
+            if line:
+                self.canvas.elements.append(('text', x, y + i * line_step + ascent, line, font, _color(fill),
+                                             self.textlength(line, font=font)))
+
+    def line(self, xy, fill=None, width=1, *args, **kwargs):
+        points = list(xy)
+        if points and not isinstance(points[0], (tuple, list)):
+            points = list(zip(points[0::2], points[1::2]))
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            self.canvas.elements.append(('line', x0, y0, x1, y1, _color(fill), width))
+
+    def rectangle(self, xy, fill=None, outline=None, width=1, *args, **kwargs):
+        if isinstance(xy[0], (tuple, list)):
+            (x0, y0), (x1, y1) = xy
+        else:
+            x0, y0, x1, y1 = xy
+        self.canvas.elements.append(('rect', x0, y0, x1, y1, fill and _color(fill), outline and _color(outline), width))
+
+
+class SvgCanvas(object):
+    """Drop-in for the PIL canvases of make_question_image/make_solution_image"""
+
+    mode = 'SVG'
+
+    def __init__(self, size, color='white'):
+        self.width, self.height = int(size[0]), int(size[1])
+        self.background = None if color is None else _color(color)
+        self.elements = []
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def getbands(self):
+        # Rough pixel-equivalent for the byte budgets of the block caches
+        return ('L',)
+
+    def paste(self, im, box=None, mask=None):
+        x, y = (box or (0, 0))[:2]
+        if isinstance(im, SvgCanvas):
+            self.elements.append(('group', x, y, im))
+        elif isinstance(im, Image.Image):
+            self.elements.append(('image', x, y, im))
+
+    def crop(self, box):
+        left, top, right, bottom = box
+        cropped = SvgCanvas((right - left, bottom - top), color=None)
+        cropped.elements.append(('group', -left, -top, self))
+        return cropped
+
+    def copy(self):
+        return self.crop((0, 0, self.width, self.height))
+
+    def _body(self, out, figures):
+        if self.background is not None:
+            out.append(f'<rect width="{self.width}" height="{self.height}" fill="{self.background}"/>')
+        for element in self.elements:
+            kind = element[0]
+            if kind == 'text':
+                _, x, y, text, font, fill, length = element
+                family, size, weight, slant = _font_attrs(font)
+                attrs = f'x="{_num(x)}" y="{_num(y)}" font-size="{size}"'
+                if family != FONT_FAMILY_FALLBACK:
+                    attrs += f' font-family="{escape(family)}, {FONT_FAMILY_FALLBACK}"'
+                if weight != 'normal':
+                    attrs += f' font-weight="{weight}"'
+                if slant != 'normal':
+                    attrs += f' font-style="{slant}"'
+                if fill != '#000' and fill != 'black':
+                    attrs += f' fill="{fill}"'
+                if len(text) > 1 and length:
+                    attrs += f' textLength="{_num(float(length))}" lengthAdjust="spacingAndGlyphs"'
+                out.append(f'<text {attrs}>{escape(text)}</text>')
+            elif kind == 'line':
+                _, x0, y0, x1, y1, stroke, width = element
+                out.append(f'<line x1="{_num(x0)}" y1="{_num(y0)}" x2="{_num(x1)}" y2="{_num(y1)}" '
+                           f'stroke="{stroke}" stroke-width="{width}"/>')
+            elif kind == 'rect':
+                _, x0, y0, x1, y1, fill, outline, width = element
+                # PIL draws the outline inside the inclusive box
+                inset = width / 2.0 if outline else 0
+                attrs = (f'x="{_num(x0 + inset)}" y="{_num(y0 + inset)}" '
+                         f'width="{_num(max(0, x1 - x0 + 1 - 2 * inset))}" height="{_num(max(0, y1 - y0 + 1 - 2 * inset))}"')
+                attrs += f' fill="{fill}"' if fill else ' fill="none"'
+                if outline:
+                    attrs += f' stroke="{outline}" stroke-width="{width}"'
+                out.append(f'<rect {attrs}/>')
+            elif kind == 'image':
+                _, x, y, im = element
+                out.append(f'<image x="{x}" y="{y}" width="{im.width}" height="{im.height}" href="{figures(im)}"/>')
+            elif kind == 'group':
+                _, x, y, child = element
+                out.append(f'<g transform="translate({_num(x)},{_num(y)})">' if (x or y) else '<g>')
+                child._body(out, figures)
+                out.append('</g>')
+
+    def to_svg(self, figures):
+        """SVG document; figures(image) returns the href of a pasted PIL image"""
+        out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+               f'viewBox="0 0 {self.width} {self.height}">']
+        self._body(out, figures)
+        out.append('</svg>')
+        return '\n'.join(out)
+
+
+def _png_bytes(im, options):
+    if im.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+        im = im.convert('RGBA' if 'A' in im.getbands() else 'RGB')
+    buf = io.BytesIO()
+    im.save(buf, format='PNG', **options)
+    return buf.getvalue()
+
+
+# Figures shared by several questions are encoded once per job (the image is kept so its id stays unique)
+_encoded = {}
+
+
+def _figure_png(im, options):
+    key = (id(im), tuple(sorted(options.items())))
+    entry = _encoded.get(key)
+    if entry is None:
+        entry = _encoded[key] = (im, _png_bytes(im, options))
+    return entry[1]
+
+
+def write(img, fp, png_options=None):
+    """Write a canvas (or a plain PIL image) as SVG to a path or binary file object"""
+    png_options = png_options or {}
+    if isinstance(img, Image.Image):
+        raster, img = img, SvgCanvas(img.size, color=None)
+        img.paste(raster, (0, 0))
+    link_dir = None
+    if os.environ.get(FIGURES_ENV, 'embed').strip().lower() == 'link' and isinstance(fp, str):
+        link_dir = os.path.dirname(os.path.abspath(fp))
+
+    def figures(im):
+        data = _figure_png(im, png_options)
+        if link_dir is None:
+            return 'data:image/png;base64,' + base64.b64encode(data).decode('ascii')
+        name = hashlib.sha1(data).hexdigest() + '.png'
+        path = os.path.join(link_dir, 'figures', name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        return 'figures/' + name
+
+    document = img.to_svg(figures).encode('utf-8')
+    if isinstance(fp, str):
+        with open(fp, 'wb') as f:
+            f.write(document)
+    else:
+        fp.write(document)
+
+
+
+# --- Rasterizing ----------------------------------------------------------
+
+_scaled_fonts = {}
+# Figures shared by several questions are scaled once per size (the source is kept so its id stays unique)
+_scaled_figures = {}
+# Opaque blocks pasted into many canvases (passages, direction sets) are drawn once per scale
+_scaled_blocks = blockcache.BlockCache(32 * 1024 * 1024)
+
+
+def _scaled_font(font, scale):
+    path = getattr(font, 'path', None)
+    size = max(1, int(round(getattr(font, 'size', 11) * scale)))
+    if not path:
+        return ImageFont.load_default()
+    key = (path, size)
+    scaled = _scaled_fonts.get(key)
+    if scaled is None:
+        scaled = _scaled_fonts[key] = ImageFont.truetype(path, size)
+    return scaled
+
+
+def _scaled_figure(im, scale):
+    size = (max(1, int(round(im.width * scale))), max(1, int(round(im.height * scale))))
+    key = (id(im), size)
+    entry = _scaled_figures.get(key)
+    if entry is None:
+        scaled = im if size == im.size else im.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        entry = _scaled_figures[key] = (im, scaled)
+    return entry[1]
+
+
+def _figures_of(img):
+    for element in img.elements:
+        if element[0] == 'image':
+            yield element[3]
+        elif element[0] == 'group':
+            for im in _figures_of(element[3]):
+                yield im
+
+
+def _raster_text(out, draw, x, y, text, font, fill, length):
+    """
+    Draw a text run with its baseline start at (x, y), stretched to length
+    like lengthAdjust="spacingAndGlyphs": at a scaled font size the glyphs
+    no longer add up to the scaled layout width, and words would fuse or
+    drift apart
+    """
+    natural = _measure.textlength(text, font=font)
+    if len(text) < 2 or not length or not natural or abs(natural - length) < 0.5:
+        draw.text((x, y), text, font=font, fill=fill, anchor='ls')
+        return
+    x0, y0, x1, y1 = font.getbbox(text, anchor='ls')
+    if x1 <= x0 or y1 <= y0:
+        return
+    # Keep the sub-pixel baseline offset draw.text() would use, so runs stay on one line
+    fy = y - math.floor(y)
+    mask = Image.new('L', (x1 - x0, y1 - y0 + 1), 0)
+    ImageDraw.Draw(mask).text((-x0, fy - y0), text, font=font, fill=255, anchor='ls')
+    stretch = length / natural
+    mask = mask.resize((max(1, int(round(mask.width * stretch))), mask.height), Image.BILINEAR)
+    left, top = int(round(x + x0 * stretch)), int(math.floor(y)) + y0
+    out.paste(fill, (left, top, left + mask.width, top + mask.height), mask)
+
+
+def _raster_body(img, out, draw, left, top, s):
+    if img.background is not None:
+        draw.rectangle((left, top, left + img.width * s, top + img.height * s), fill=img.background)
+    for element in img.elements:
+        kind = element[0]
+        if kind == 'text':
+            _, x, y, text, font, fill, length = element
+            _raster_text(out, draw, left + x * s, top + y * s, text, _scaled_font(font, s), fill, length * s)
+        elif kind == 'line':
+            _, x0, y0, x1, y1, stroke, width = element
+            draw.line((left + x0 * s, top + y0 * s, left + x1 * s, top + y1 * s), fill=stroke,
+                      width=max(1, int(round(width * s))))
+        elif kind == 'rect':
+            _, x0, y0, x1, y1, fill, outline, width = element
+            draw.rectangle((left + x0 * s, top + y0 * s, left + x1 * s, top + y1 * s), fill=fill, outline=outline,
+                           width=max(1, int(round(width * s))) if outline else 0)
+        elif kind == 'image':
+            _, x, y, im = element
+            scaled = _scaled_figure(im, s)
+            if scaled.mode != out.mode:
+                scaled = scaled.convert(out.mode)
+            out.paste(scaled, (int(round(left + x * s)), int(round(top + y * s))))
+        elif kind == 'group':
+            _, x, y, child = element
+            if child.background is None:
+                _raster_body(child, out, draw, left + x * s, top + y * s, s)
+                continue
+            # The entry keeps child alive, so its id cannot be reused while cached
+            block, _ = _scaled_blocks.get_or_render((id(child), s), lambda: (_rasterize(child, s), child))
+            out.paste(block if block.mode == out.mode else block.convert(out.mode),
+                      (int(round(left + x * s)), int(round(top + y * s))))
+
+
+def _rasterize(img, scale):
+    size = (max(1, int(round(img.width * scale))), max(1, int(round(img.height * scale))))
+    grayscale = all(imageops.is_grayscale(im) for im in _figures_of(img))
+    out = Image.new('L' if grayscale else 'RGB', size, 'white')
+    _raster_body(img, out, ImageDraw.Draw(out), 0, 0, scale)
+    return out
+
+
+def rasterize(img, width):
+    """
+    PIL image of a canvas scaled to width. Text is drawn afresh at the scaled
+    font size rather than shrunk from a full-size bitmap.
+    """
+    scale = width / float(img.width)
+    if isinstance(img, Image.Image):
+        return img.resize((max(1, int(round(width))), max(1, int(round(img.height * scale)))),
+                          Image.LANCZOS, reducing_gap=3.0)
+    return _rasterize(img, scale)
+
+# --- Tables ---------------------------------------------------------------
+
+# Mirrors the renderers' TABLE_STYLE: 22px text, 8px cell padding, 1px #222 borders,
+# #f2f2f2 bold header cells, #f9f9f9 even body rows; the 8px page margin of the
+# wkhtmltoimage page is replaced by the 4px border the raster trim keeps
+TABLE_FONT_SIZE = 22
+TABLE_PADDING = 8
+TABLE_BORDER = '#222'
+TABLE_HEADER_FILL = '#f2f2f2'
+TABLE_EVEN_FILL = '#f9f9f9'
+TABLE_PAGE_MARGIN = 8
+TABLE_TRIM_MARGIN = 4
+TABLE_LINE_HEIGHT = 1.2
+
+
+def _table_rows(table_html):
+    """[(cells, section)] with cells as (text, is_header, colspan, rowspan)"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(table_html, 'html.parser')
+    table = soup.find('table') or soup
+    rows = []
+    for tr in table.find_all('tr'):
+        if tr.find_parent('table') is not table:
+            continue
+        cells = []
+        for cell in tr.find_all(['td', 'th'], recursive=False):
+            text = ' '.join(cell.get_text(' ', strip=True).split())
+            cells.append((text, cell.name == 'th',
+                          max(1, int(cell.get('colspan', 1) or 1)), max(1, int(cell.get('rowspan', 1) or 1))))
+        parent = tr.parent.name if tr.parent is not None else ''
+        rows.append((cells, parent))
+    return rows
+
+
+def _wrap(text, font, width):
+    lines = []
+    for paragraph in text.split('\n'):
+        words = paragraph.split()
+        line = ''
+        for word in words:
+            candidate = f'{line} {word}' if line else word
+            if not line or _measure.textlength(candidate, font=font) <= width:
+                line = candidate
+            else:
+                lines.append(line)
+                line = word
+        lines.append(line)
+    return lines or ['']
+
+
+class TableRenderer(object):
+    """Vector stand-in for wkhtml.TableRenderer: render(table_html) returns an SvgCanvas"""
+
+    def __init__(self, width, font_path=None):
+        self.width = width
+        font_path = font_path or os.path.join(FONT_DIR, 'DejaVuSans.ttf')
+        self.font = ImageFont.truetype(font_path, TABLE_FONT_SIZE)
+        bold_path = os.path.join(os.path.dirname(font_path), 'DejaVuSans-Bold.ttf')
+        self.bold = ImageFont.truetype(bold_path, TABLE_FONT_SIZE) if os.path.exists(bold_path) else self.font
+        self._tables = {}
+
+    def prefetch(self, tables):
+        pass
+
+    def render(self, table_html):
+        table = self._tables.get(table_html)
+        if table is None:
+            table = self._tables[table_html] = self._layout(table_html)
+        return table
+
+    def _layout(self, table_html):
+        rows = _table_rows(table_html)
+        # Place cells on a grid, honouring rowspan/colspan
+        grid = []
+        occupied = set()
+        for r, (cells, section) in enumerate(rows):
+            c = 0
+            for text, header, colspan, rowspan in cells:
+                while (r, c) in occupied:
+                    c += 1
+                grid.append((r, c, text, header, colspan, rowspan, section))
+                for dr in range(rowspan):
+                    for dc in range(colspan):
+                        occupied.add((r + dr, c + dc))
+                c += colspan
+        n_rows = max([r + 1 for r, _ in occupied] + [len(rows), 1])
+        n_cols = max([c + 1 for _, c in occupied] + [1])
+        table_width = self.width - 2 * TABLE_PAGE_MARGIN
+        pad = 2 * TABLE_PADDING + 1
+
+        # Auto layout like a width:100% table: natural widths, scaled to the table width,
+        # never below the longest word of a column
+        natural = [pad] * n_cols
+        minimum = [pad] * n_cols
+        for r, c, text, header, colspan, rowspan, section in grid:
+            if colspan != 1:
+                continue
+            font = self.bold if header else self.font
+            natural[c] = max(natural[c], _measure.textlength(text, font=font) + pad)
+            longest = max([_measure.textlength(w, font=font) for w in text.split()] + [0])
+            minimum[c] = max(minimum[c], longest + pad)
+        total = sum(natural)
+        if total <= table_width:
+            widths = [w * table_width / total for w in natural]
+        else:
+            spare = table_width - sum(minimum)
+            flexible = sum(n - m for n, m in zip(natural, minimum)) or 1
+            widths = [m + max(0, spare) * (n - m) / flexible for n, m in zip(natural, minimum)]
+        xs = [0]
+        for w in widths:
+            xs.append(xs[-1] + w)
+
+        line_height = int(TABLE_FONT_SIZE * TABLE_LINE_HEIGHT)
+        laid_out = []
+        heights = [0] * n_rows
+        for r, c, text, header, colspan, rowspan, section in grid:
+            font = self.bold if header else self.font
+            cell_width = xs[c + colspan] - xs[c]
+            lines = _wrap(text, font, cell_width - pad)
+            needed = len(lines) * line_height + pad
+            laid_out.append((r, c, header, colspan, rowspan, section, font, lines))
+            if rowspan == 1:
+                heights[r] = max(heights[r], needed)
+        for r, c, header, colspan, rowspan, section, font, lines in laid_out:
+            if rowspan > 1:
+                needed = len(lines) * line_height + pad
+                have = sum(heights[r:r + rowspan])
+                if needed > have:
+                    heights[r + rowspan - 1] += needed - have
+        ys = [0]
+        for h in heights:
+            ys.append(ys[-1] + h)
+
+        margin = TABLE_TRIM_MARGIN
+        svg = SvgCanvas((int(round(xs[-1])) + 2 * margin + 1, int(round(ys[-1])) + 2 * margin + 1))
+        draw = SvgDraw(svg)
+        row_in_section = {}
+        for r, (cells, section) in enumerate(rows):
+            row_in_section[r] = sum(1 for s in rows[:r] if s[1] == section) + 1
+        for r, c, header, colspan, rowspan, section, font, lines in laid_out:
+            x0, x1 = margin + xs[c], margin + xs[c + colspan]
+            y0, y1 = margin + ys[r], margin + ys[r + rowspan]
+            if header:
+                fill = TABLE_HEADER_FILL
+            elif row_in_section.get(r, 1) % 2 == 0:
+                fill = TABLE_EVEN_FILL
+            else:
+                fill = '#fff'
+            draw.rectangle((x0, y0, x1, y1), fill=fill, outline=TABLE_BORDER, width=1)
+            text_top = y0 + (y1 - y0 - len(lines) * line_height) / 2
+            for i, line in enumerate(lines):
+                w = _measure.textlength(line, font=font)
+                draw.text((x0 + (x1 - x0 - w) / 2, text_top + i * line_height + (line_height - TABLE_FONT_SIZE) / 2),
+                          line, font=font, fill='black')
+        return svg
@@ -0,0 +1,178 @@
+"""
+Table rasterization with wkhtmltoimage, batched per job.
+
+Starting wkhtmltoimage launches a whole WebKit, which costs far more than
+laying out one table. The renderers register the tables of a job with
+TableRenderer.prefetch() before their render loop. The first table that is
+actually needed then renders all registered tables on one page, each in a
+block with a known id (doc2viz-table-<n>) followed by a marker band, in a
+single wkhtmltoimage run. The page is sliced apart at the marker rows, and
+each slice matches a render of that table on a page of its own (8px page
+margin included).
+
+Tables that were not registered, or that a batch could not deliver (a
+failed run, or a page taller than WebKit can paint), are rendered one at a
+time as before. A batch image is released once every question that
+registered the table has drawn it, so a job holds only the tables still to
+come.
+
+Pages are written to the job's scratch directory (common/scratch.py) and
+the PNG is read from wkhtmltoimage's stdout, so no output file is left.
+"""
+import io
+import subprocess
+
+from PIL import Image
+
+from common import profiling, scratch, canvas, svg
+
+MARKER_RGB = (255, 0, 254)
+MARKER_HEIGHT = 2
+# Matches the default 8px body margin of a single-table page
+BLOCK_PADDING = 8
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def page_html(body, style):
+    return f"""
+                <html><head>
+                <meta charset='utf-8'>
+                <style>
+                {style}
+                </style>
+                </head><body>{body}</body></html>
+                """
+
+
+def batch_html(tables, style):
+    marker = '#%02x%02x%02x' % MARKER_RGB
+    blocks = ''.join(
+        f'<div id="doc2viz-table-{i}" style="padding:{BLOCK_PADDING}px;background:#fff">{table}</div>'
+        f'<div style="height:{MARKER_HEIGHT}px;background:{marker};margin:0;padding:0"></div>'
+        for i, table in enumerate(tables))
+    style = f'{style}\n        html, body {{ margin: 0; padding: 0; background: #fff; }}'
+    return page_html(blocks, style)
+
+
+def render_page(html, width, quality=90):
+    """
+    Rasterize one HTML page; returns a loaded PIL image. The PNG is read
+    from wkhtmltoimage's stdout; builds that write nothing there get a
+    scratch output file instead.
+    """
+    base = ['wkhtmltoimage', '--width', str(width), '--quality', str(quality), '--format', 'png']
+    job_scratch = scratch.current()
+    with job_scratch.file('.html', html.encode('utf-8')) as html_path:
+        with profiling.timed('wkhtmltoimage'):
+            result = subprocess.run(base + [html_path, '-'], check=True, capture_output=True)
+        if result.stdout.startswith(PNG_SIGNATURE):
+            img = Image.open(io.BytesIO(result.stdout))
+            img.load()
+            return img
+        with job_scratch.file('.png') as img_path:
+            with profiling.timed('wkhtmltoimage'):
+                subprocess.run(base + [html_path, img_path], check=True, capture_output=True)
+            with Image.open(img_path) as img:
+                img.load()
+                return img.copy()
+
+
+def _marker_rows(img):
+    """(start, end) row ranges of the marker bands, top to bottom"""
+    rgb = img.convert('RGB')
+    px = rgb.load()
+    # Two columns inside the left block padding: white everywhere except on the
+    # markers, even when a table wider than the page widens the image past the
+    # marker divs
+    left, inner = 1, min(BLOCK_PADDING, rgb.width) - 2
+    bands = []
+    start = None
+    for y in range(rgb.height):
+        is_marker = px[left, y] == MARKER_RGB and px[inner, y] == MARKER_RGB
+        if is_marker and start is None:
+            start = y
+        elif not is_marker and start is not None:
+            bands.append((start, y))
+            start = None
+    if start is not None:
+        bands.append((start, rgb.height))
+    return bands
+
+
+@profiling.timed('wkhtmltoimage_batch')
+def render_batch(tables, width, style, quality=90):
+    """
+    Render tables on one page and slice them apart. Returns a list with a
+    PIL image per table, or None for tables the page did not deliver.
+    """
+    try:
+        page = render_page(batch_html(tables, style), width, quality)
+    except Exception as e:
+        print(f"Batch table render failed, rendering tables one by one: {e}")
+        return [None] * len(tables)
+    slices = []
+    top = 0
+    for start, end in _marker_rows(page)[:len(tables)]:
+        slices.append(page.crop((0, top, page.width, start)))
+        top = end
+    return slices + [None] * (len(tables) - len(slices))
+
+
+class TableRenderer(object):
+    def __init__(self, style, width, quality=90):
+        self.style = style
+        self.width = width
+        self.quality = quality
+        self._pending = []
+        self._images = {}
+        # Registrations not yet drawn, per table
+        self._uses = {}
+
+    def prefetch(self, tables):
+        """
+        Register tables to be rendered together when the first of them is
+        needed, once for every render() that will follow
+        """
+        for table in tables:
+            self._uses[table] = self._uses.get(table, 0) + 1
+            if table not in self._images and table not in self._pending:
+                self._pending.append(table)
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        for table, img in zip(pending, render_batch(pending, self.width, self.style, self.quality)):
+            if img is not None:
+                self._images[table] = img
+
+    def render(self, table_html):
+        """PIL image of one table (a copy, so callers may modify it); raises if wkhtmltoimage fails"""
+        if table_html in self._pending:
+            self._flush()
+        remaining = self._uses.pop(table_html, 1) - 1
+        if remaining > 0:
+            self._uses[table_html] = remaining
+            img = self._images.get(table_html)
+            if img is not None:
+                return img.copy()
+        else:
+            # Last registered use: hand over the batch image itself
+            img = self._images.pop(table_html, None)
+            if img is not None:
+                return img
+        return render_page(page_html(table_html, self.style), self.width, self.quality)
+
+
+_renderers = {}
+
+
+def table_renderer(style, width, quality=90):
+    """
+    The job-wide TableRenderer for a table style and page width; for SVG
+    output, an svg.TableRenderer that lays tables out as vector grids
+    """
+    vector = canvas.vector()
+    key = (style, width, quality, vector)
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = _renderers[key] = svg.TableRenderer(width) if vector else TableRenderer(style, width, quality)
+    return renderer
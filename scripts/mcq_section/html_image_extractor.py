@@ -1,25 +1,30 @@
 import os
+import sys
 import subprocess
 import re
+import json
 from bs4 import BeautifulSoup
 
-def convert_docx_to_html(docx_path, html_path, media_dir):
-    cmd = [
-        "pandoc", "-s", docx_path, "-o", html_path,
-        f"--extract-media={media_dir}"
-    ]
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import docx_reader, pandoc, profiling
+
+@profiling.timed('convert_docx_to_html')
+def convert_docx_to_html(docx_path):
+    """Pandoc HTML for the DOCX, read from Pandoc's stdout"""
     # Suppress [WARNING] messages from pandoc
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    result = pandoc.pandoc_text(docx_path, 'html')
     # Print only non-warning stderr lines
     for line in result.stderr.splitlines():
         if '[WARNING]' not in line:
             print(line)
     if result.returncode != 0:
-        raise subprocess.CalledProcessError(result.returncode, cmd, output=result.stdout, stderr=result.stderr)
+        raise subprocess.CalledProcessError(result.returncode, result.args, stderr=result.stderr)
+    return result.stdout
 
-def extract_images_from_html(html_path):
-    with open(html_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
+@profiling.timed('extract_images_from_html')
+def extract_images_from_html(html, output_dir):
+    soup = BeautifulSoup(html, "html.parser")
     # Map: qnum -> {"tables": [...], "images": [...]}
     q_map = {}
     # For storing context text for 'common' visuals
@@ -179,8 +184,8 @@ def extract_images_from_html(html_path):
                 "tables": ctx["tables"],
                 "images": ctx["images"]
             })
-    # Save the result to visuals.json in the same directory as the HTML
-    visuals_json_path = os.path.join(os.path.dirname(html_path), "visuals.json")
+    # Save the result to visuals.json in output_dir
+    visuals_json_path = os.path.join(output_dir, "visuals.json")
     try:
         with open(visuals_json_path, "w", encoding="utf-8") as f:
             import json
@@ -190,14 +195,103 @@ def extract_images_from_html(html_path):
         print(f"[extract_images_from_html] Failed to save visuals JSON: {e}")
     return result
 
+def _preceding_paragraphs(blocks, idx):
+    """Top-level paragraphs before blocks[idx], nearest first (find_previous_sibling over <p>)"""
+    for j in range(idx - 1, -1, -1):
+        if blocks[j].kind == 'p':
+            yield blocks[j]
+
+@profiling.timed('extract_visuals_from_docx')
+def extract_visuals_from_docx(docx_path):
+    """
+    Same visuals as extract_images_from_html, read from the DOCX structure
+    (common.docx_reader) instead of a Pandoc HTML conversion.
+    """
+    blocks = docx_reader.read_blocks(docx_path)
+    q_map = {}
+    common_contexts = []
+
+    def add(qnum, context_text, visual_type, visual, dedupe=False):
+        if qnum is not None:
+            bucket = q_map.setdefault(qnum, {"tables": [], "images": []})
+        else:
+            bucket = next((ctx for ctx in common_contexts if ctx["context_text"] == context_text), None)
+            if bucket is None:
+                bucket = {"context_text": context_text, "tables": [], "images": []}
+                common_contexts.append(bucket)
+        if not (dedupe and visual in bucket[visual_type]):
+            bucket[visual_type].append(visual)
+
+    # Tables: nearest preceding question number, or the Directions block they follow
+    for idx, block in enumerate(blocks):
+        if block.kind != 'table':
+            continue
+        qnum = None
+        context_text = None
+        for prev in _preceding_paragraphs(blocks, idx):
+            qnum = docx_reader.question_number(prev)
+            if qnum is not None:
+                break
+            if prev.em and 'Directions' in prev.em:
+                context_text = docx_reader.normalize_space(prev.em)
+                break
+        add(qnum, context_text, "tables", block.html)
+
+    # Images: nearest preceding question number, else the question of their own paragraph
+    for idx, block in enumerate(blocks):
+        for image in block.images:
+            qnum = next((q for q in map(docx_reader.question_number, _preceding_paragraphs(blocks, idx)) if q is not None), None)
+            if qnum is None:
+                qnum = docx_reader.question_number(block)
+            add(qnum, None, "images", docx_reader.img_src(image), dedupe=True)
+
+    result = [{"question_number": qnum, "tables": q_map[qnum]["tables"], "images": q_map[qnum]["images"]}
+              for qnum in sorted(q_map)]
+    for ctx in common_contexts:
+        if ctx["context_text"] is not None or ctx["tables"]:
+            result.append({
+                "question_number": "common",
+                "context_text": ctx["context_text"],
+                "tables": ctx["tables"],
+                "images": ctx["images"]
+            })
+    return result
+
 def extract_images_via_html(docx_path, output_dir):
     os.makedirs(output_dir, exist_ok=True)
-    html_path = os.path.join(output_dir, "content.html")
-    media_dir = os.path.join(output_dir, "media")
-    convert_docx_to_html(docx_path, html_path, media_dir)
-    images = extract_images_from_html(html_path)
+    # No --extract-media: images are read from the DOCX by common.docx_media
+    html = convert_docx_to_html(docx_path)
+    images = extract_images_from_html(html, output_dir)
     return images
 
+
+def extract_visuals_via_docx(docx_path, output_dir, save=True):
+    visuals = extract_visuals_from_docx(docx_path)
+    if save:
+        os.makedirs(output_dir, exist_ok=True)
+        visuals_json_path = os.path.join(output_dir, "visuals.json")
+        with open(visuals_json_path, "w", encoding="utf-8") as f:
+            json.dump(visuals, f, ensure_ascii=False, indent=2)
+    return visuals
+
+def extract_visuals(docx_path, output_dir, save=True):
+    """
+    Visuals for a DOCX, read from its structure (also written to visuals.json
+    when save is set). Falls back to the Pandoc HTML extraction, which always
+    writes visuals.json, when DOC2VIZ_VISUALS_READER=html, when the document
+    needs Pandoc (an equation in a table) or when the reader fails.
+    """
+    if docx_reader.visuals_reader() == 'html':
+        return extract_images_via_html(docx_path, output_dir)
+    try:
+        return extract_visuals_via_docx(docx_path, output_dir, save)
+    except docx_reader.NeedsPandoc as e:
+        print(f"[extract_visuals] {e}, using Pandoc HTML")
+        return extract_images_via_html(docx_path, output_dir)
+    except Exception as e:
+        print(f"[extract_visuals] DOCX reader failed ({e}), using Pandoc HTML")
+        return extract_images_via_html(docx_path, output_dir)
+
 if __name__ == "__main__":
     import argparse
     import json
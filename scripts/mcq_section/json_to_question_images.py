@@ -1,10 +1,26 @@
 import os
+import sys
 import json
 from PIL import Image, ImageDraw, ImageFont
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import progress, profiling, blockcache, render_manifest, docx_media, wkhtml, imageops, figures, canvas, encoders, preview, sprites
+
 # You may need to adjust this path to a TTF font file available on your system
 DEFAULT_FONT = os.path.join(os.path.dirname(__file__), '../dejavu-fonts-ttf-2.37/ttf/DejaVuSans.ttf')
 
+# Tables are rasterized by wkhtmltoimage with this stylesheet at this page width
+TABLE_STYLE = '''
+    table { border-collapse: collapse; width: 100%; font-size: 22px; }
+    th, td { border: 1px solid #222; padding: 8px; text-align: center; background: #fff; }
+    th { background: #f2f2f2; font-weight: bold; }
+    tr:nth-child(even) td { background: #f9f9f9; }
+'''
+TABLE_WIDTH = 1200
+# Default of DOC2VIZ_OUTPUT_FORMAT for this variant
+OUTPUT_FORMAT = 'jpeg'
+
 # Utility to wrap text for PIL
 from textwrap import wrap
 
@@ -39,7 +55,34 @@ def render_text_to_image(text, width=1600, font_path=DEFAULT_FONT, font_size=32,
         y += line_height
     return img
 
-def make_question_image(q, out_path, font_path=DEFAULT_FONT):
+def render_common_block(text, width, font_path, font_size, margin, wrap_width, line_height):
+    """
+    Draw main_common_data exactly as make_question_image lays it out (left
+    aligned, wrapped by characters) on a canvas that starts at the top of
+    the question image. Returns (image, number of lines). The canvas extends
+    half a line below the block so descenders are not clipped.
+    """
+    font = ImageFont.truetype(font_path, font_size)
+    lines = []
+    for para in text.split('\n'):
+        lines.extend(wrap(para, width=wrap_width) or [''])
+    img = canvas.new((width, margin + line_height * len(lines) + line_height // 2))
+    draw = canvas.draw(img)
+    y = margin
+    for line in lines:
+        draw.text((margin, y), line, font=font, fill='black')
+        y += line_height
+    return img, len(lines)
+
+def prefetch_tables(questions):
+    """Register the tables of the questions about to be drawn, so the first one drawn lays them all out in one wkhtmltoimage run"""
+    wkhtml.table_renderer(TABLE_STYLE, TABLE_WIDTH).prefetch(
+        table_html
+        for q in questions
+        for table_html in q.get('Table') or [])
+
+@profiling.timed('make_question_image')
+def make_question_image(q, out_path, font_path=DEFAULT_FONT, block_cache=None):
     # Compose the text block, justify only the question, left-align options
     blocks = []
     if q.get('main_common_data'):
@@ -52,47 +95,16 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         for opt in q['Options']:
             blocks.append((opt, 'left'))  # Left align each option
 
-    # If there are tables, render them using wkhtmltopdf and insert as images
-    import tempfile
-    import subprocess
-    from PIL import Image
+    # If there are tables, render them using wkhtmltoimage and insert as images
     table_imgs = []
     # Render tables from q['Table'] (from cleaned JSON)
-    classic_table_style = '''
-        table { border-collapse: collapse; width: 100%; font-size: 22px; }
-        th, td { border: 1px solid #222; padding: 8px; text-align: center; background: #fff; }
-        th { background: #f2f2f2; font-weight: bold; }
-        tr:nth-child(even) td { background: #f9f9f9; }
-    '''
+    tables = wkhtml.table_renderer(TABLE_STYLE, TABLE_WIDTH)
     if q.get('Table'):
-        for idx, table_html in enumerate(q['Table']):
-            with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False, encoding='utf-8') as tf:
-                html_path = tf.name
-                # Classic HTML wrapper for table
-                tf.write(f"""
-                <html><head>
-                <meta charset='utf-8'>
-                <style>
-                {classic_table_style}
-                </style>
-                </head><body>{table_html}</body></html>
-                """)
-            img_temp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            img_temp.close()
-            img_path = img_temp.name
-            # Use wkhtmltoimage (from wkhtmltopdf suite) to render HTML table to PNG
+        for table_html in q['Table']:
             try:
-                subprocess.run([
-                    'wkhtmltoimage', '--width', '1200', '--quality', '90', html_path, img_path
-                ], check=True)
-                table_img = Image.open(img_path)
-                table_imgs.append(table_img)
+                table_imgs.append(imageops.trim(tables.render(table_html)))
             except Exception as e:
                 print(f"Failed to render table with wkhtmltoimage: {e}")
-            finally:
-                os.unlink(html_path)
-                # Optionally, keep img_path for debugging
-                # os.unlink(img_path)
 
     # Also render tables from visuals.json if available and mapped to this question
     # visuals.json should be in the output_test dir (2 levels up from out_path)
@@ -110,31 +122,10 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
                     entry_qno = entry.get('Question Number') or entry.get('question_number')
                     if str(entry_qno) == str(qno):
                         for table_html in entry.get('tables', []):
-                            with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False, encoding='utf-8') as tf:
-                                html_path = tf.name
-                                tf.write(f"""
-                                <html><head>
-                                <meta charset='utf-8'>
-                                <style>
-                                {classic_table_style}
-                                </style>
-                                </head><body>{table_html}</body></html>
-                                """)
-                            img_temp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-                            img_temp.close()
-                            img_path = img_temp.name
                             try:
-                                subprocess.run([
-                                    'wkhtmltoimage', '--width', '1200', '--quality', '90', html_path, img_path
-                                ], check=True)
-                                table_img = Image.open(img_path)
-                                table_imgs.append(table_img)
+                                table_imgs.append(imageops.trim(tables.render(table_html)))
                             except Exception as e:
                                 print(f"Failed to render table from visuals.json with wkhtmltoimage: {e}")
-                            finally:
-                                os.unlink(html_path)
-                                # Optionally, keep img_path for debugging
-                                # os.unlink(img_path)
     except Exception as e:
         print(f"Error loading or rendering tables from visuals.json: {e}")
 
@@ -147,6 +138,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
     max_img_width = int(0.9 * width) // 2  # Allow up to 2 per row, 90% of width
     min_img_height = 200
     max_img_height = 700
+    figure_fit = figures.Fit(min_img_width, max_img_width, min_img_height, max_img_height)
     if q.get('Image'):
         for img_path in q['Image']:
             try:
@@ -155,22 +147,9 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
                 if not os.path.isabs(img_full_path):
                     out_test_dir = os.path.abspath(os.path.join(os.path.dirname(out_path), '..', '..'))
                     img_full_path = os.path.normpath(os.path.join(out_test_dir, img_full_path))
-                if os.path.exists(img_full_path):
-                    img = Image.open(img_full_path)
-                    w, h = img.size
-                    # Zoom up if image is small, shrink if too large
-                    zoom = 1.0
-                    if w < min_img_width:
-                        zoom = min_img_width / w
-                    elif w > max_img_width:
-                        zoom = max_img_width / w
-                    if h < min_img_height:
-                        zoom = max(zoom, min_img_height / h)
-                    elif h > max_img_height:
-                        zoom = min(zoom, max_img_height / h)
-                    w = int(w * zoom)
-                    h = int(h * zoom)
-                    img = img.resize((w, h), Image.LANCZOS)
+                # Zoom up if image is small, shrink if too large
+                img = figures.prepare_figure(img_path, [img_full_path], figure_fit)
+                if img is not None:
                     image_imgs.append(img)
                 else:
                     print(f"Image not found: {img_full_path}")
@@ -190,7 +169,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         lines = []
         aligns = []
         block_types = []  # Track block type for justification
-        for text, align in blocks:
+        for text, align in text_blocks:
             is_question = (align == 'center' and text == q.get('Question'))
             for para in text.split('\n'):
                 wrapped = wrap(para, width=wrap_width)
@@ -212,12 +191,27 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         text_height = margin * 2 + line_height * len(lines)
         return lines, aligns, block_types, line_height, text_height, font
 
+    # The shared direction block is drawn once per job and pasted into every question of its range
+    text_blocks = blocks
+    common_img = None
+    common_lines = 0
+    if q.get('main_common_data'):
+        if block_cache is None:
+            block_cache = blockcache.default_cache()
+        common_text = q['main_common_data']
+        common_line_height = int(max_font_size * 1.5)
+        common_img, common_lines = block_cache.get_or_render(
+            ('mcq_section', common_text, width, font_path, max_font_size, margin, wrap_width),
+            lambda: render_common_block(common_text, width, font_path, max_font_size, margin, wrap_width, common_line_height)
+        )
+        text_blocks = blocks[1:]
+
     # Try to fit text with decreasing font size
     font_size = max_font_size
     max_img_height = 900  # Further decrease the height of the question image
     while font_size >= min_font_size:
         lines, aligns, block_types, line_height, text_height, font = get_lines_and_height(font_size)
-        img_height = text_height
+        img_height = text_height + common_lines * line_height
         for timg in table_imgs:
             img_height += timg.height + 30
         for iimg in image_imgs:
@@ -226,9 +220,13 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         break
 
     # Draw on a tall temp image, then crop to content
-    temp_img = Image.new('RGB', (width, img_height), color='white')
-    draw = ImageDraw.Draw(temp_img)
+    # Grayscale unless a table or figure has colour
+    temp_img = canvas.new((width, img_height), table_imgs + image_imgs)
+    draw = canvas.draw(temp_img)
     y = margin
+    if common_img is not None:
+        temp_img.paste(common_img, (0, 0))
+        y += common_lines * line_height
     n_lines = len(lines)
     for idx, (line, align, block_type) in enumerate(zip(lines, aligns, block_types)):
         try:
@@ -309,34 +307,58 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         i += 1
     # Crop to content (remove extra bottom space)
     cropped_img = temp_img.crop((0, 0, width, y))
-    cropped_img.save(out_path.replace('.png', '.jpg'), format='JPEG', quality=70, optimize=True)
+    encoders.current(OUTPUT_FORMAT).save(cropped_img, out_path)
 
 
-def main():
+def main(argv=None, data=None):
+    """Command-line entry point; wordToMD.py calls it in-process with the parsed data"""
     import argparse
     import os
     parser = argparse.ArgumentParser(description='Generate question images from DOCX or JSON')
     parser.add_argument('--docx', type=str, default=None, help='Path to input DOCX file (optional, will run full pipeline if provided)')
     parser.add_argument('--json', type=str, default=None, help='Path to cleaned JSON (optional, overrides DOCX if provided)')
+    parser.add_argument('--media-docx', type=str, default=None, help='DOCX to read embedded images from (default: --docx)')
     parser.add_argument('--outdir', type=str, default=None, help='Output directory (default: conversions/<upload_folder> at project root)')
     parser.add_argument('--docxname', type=str, default=None, help='Original Word document name (without extension)')
     parser.add_argument('--filename', type=str, default=None, help='Alias for --docxname (for compatibility)')
     parser.add_argument('--font', type=str, default=None, help='Font path')
-    args = parser.parse_args()
+    parser.add_argument('--force', action='store_true', help='Re-render every image even if the render manifest says it is up to date')
+    parser.add_argument('--profile', nargs='?', const='profiles', default=None, metavar='DIR', help='Write a timing report (and pstats with --pstats) into DIR')
+    parser.add_argument('--pstats', action='store_true', help='With --profile, also dump a cProfile/pstats file')
+    parser.add_argument('--preview', nargs='?', type=int, const=preview.DEFAULT_WIDTH, default=None, metavar='WIDTH', help='Quick check: one low-resolution contact sheet per section, questions WIDTH px wide (default 400)')
+    parser.add_argument('--sprites', nargs='?', type=int, const=sprites.DEFAULT_SHEET_SIZE, default=None, metavar='SIZE', help='Pack the questions of each section into sprite sheets of at most SIZE px (default 4096) with a JSON index')
+    args = parser.parse_args(argv)
+    # Profiling is either requested directly or inherited from wordToMD.py --profile
+    if args.profile:
+        profiling.enable(args.profile, 'render', pstats=args.pstats)
+    else:
+        profiling.enable_from_env('render')
+    if args.preview:
+        preview.enable(args.preview)
+    if args.sprites:
+        sprites.enable(args.sprites)
+
+    # Embedded images are decoded from the DOCX itself; Pandoc no longer extracts them to disk
+    media_docx = args.media_docx or args.docx
+    if media_docx and os.path.exists(media_docx):
+        docx_media.set_current(docx_media.DocxMediaProvider(media_docx))
 
     # Support --filename as an alias for --docxname
     if args.filename and not args.docxname:
         args.docxname = args.filename
 
     # Load data
-    if args.docx:
+    if data is not None:
+        # Already parsed by wordToMD.py in the same process
+        pass
+    elif args.docx:
         from wordToMD import convert_docx_to_markdown
         from md_cleaner import clean_markdown_content
         from md_to_json import parse_cleaned_markdown
         output_base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'output_test'))
         md_content, md_path, media_dir, extracted_images = convert_docx_to_markdown(
             args.docx, output_base_dir,
-            extract_media=True, mathml=True, save_md=True, extract_images=True
+            extract_media=False, mathml=True, save_md=True, extract_images=True
         )
         cleaned_md_path = os.path.join(output_base_dir, 'cleaned.md')
         cleaned_content = clean_markdown_content(
@@ -408,9 +430,16 @@ def main():
     os.makedirs(outdir, exist_ok=True)
     print(f"Images will be saved in: {os.path.abspath(outdir)}")
 
+    encoder = encoders.current(OUTPUT_FORMAT)
+    # Images whose inputs have not changed since the last upload of this paper are reused
+    manifest = render_manifest.RenderManifest(outdir, __file__, font_path, settings=dict(encoder.settings(), canvas=canvas.setting()))
+    if args.force:
+        manifest.previous = {}
+
     # Get content
     content = data['Content']
-    # Iterate over all sections
+    # Iterate over all sections, deciding up front which questions are drawn
+    plan = []
     for section, section_data in content.items():
         section_label = section.strip()
         # If section_label is empty, dump images directly in outdir
@@ -423,13 +452,37 @@ def main():
         for q in questions:
             qno = q.get('Question Number', 'unknown')
             out_path = os.path.join(section_dir, f'question_{qno}.png')
-            make_question_image(q, out_path, font_path=font_path)
+            image_path = encoder.path_for(out_path)
+            item_hash = manifest.item_hash(q)
+            # Paged output rewrites the whole section document, so every item is drawn
+            draw = encoder.paged or not manifest.is_current(image_path, item_hash)
+            plan.append((q, out_path, image_path, item_hash, draw))
+    total_questions = len(plan)
+    rendered = 0
+    # Reused questions keep their image, so their tables are not laid out
+    prefetch_tables(q for q, _, _, _, draw in plan if draw)
+    with progress.stage('render', total=total_questions):
+        for q, out_path, image_path, item_hash, draw in plan:
+            if draw:
+                make_question_image(q, out_path, font_path=font_path)
+            manifest.record(image_path, item_hash)
+            rendered += 1
+            progress.report('render', rendered, total_questions)
             # print(f"Saved: {out_path}")
+        # Section documents and sprite sheets are recorded too, so a run in another format removes them
+        for document_path in encoder.finish():
+            manifest.record(document_path, None)
+
+    manifest.remove_stale()
+    manifest.save()
+    if manifest.reused:
+        print(f"Reused {manifest.reused} unchanged images")
 
     # Zip the upload_folder and print the path
     import shutil
     zip_base = os.path.join(conversions_dir, upload_folder)
-    zip_path = shutil.make_archive(zip_base, 'zip', outdir)
+    with progress.stage('archive'):
+        zip_path = shutil.make_archive(zip_base, 'zip', outdir)
     
     print("===ZIP===")
     print(os.path.abspath(zip_path))
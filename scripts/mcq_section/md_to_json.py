@@ -1,10 +1,38 @@
 import os
 import re
+import sys
 import json
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import profiling
+
+
+def media_ref(img_path):
+    """Normalize a Pandoc media reference to media/<file>, the name of the word/media/ member in the DOCX"""
+    img_path = re.sub(r'<[^>]+>', '', img_path).strip().replace('\\', '/')
+    return 'media/' + img_path.rsplit('/', 1)[-1]
+
+def load_visuals(visuals_json_path):
+    """Entries of a visuals.json written by html_image_extractor, or None if it is missing or unreadable"""
+    if not os.path.exists(visuals_json_path):
+        return None
+    try:
+        with open(visuals_json_path, 'r', encoding='utf-8') as vf:
+            return json.load(vf)
+    except Exception:
+        return None
+
 def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
+    """Parse a cleaned.md file, with the visuals.json next to it in html_extraction/"""
     with open(cleaned_md_path, 'r', encoding='utf-8') as f:
         content = f.read()
+    visuals = load_visuals(os.path.join(os.path.dirname(cleaned_md_path), 'html_extraction', 'visuals.json'))
+    return parse_cleaned_markdown_text(content, visuals, extracted_images, os.path.basename(cleaned_md_path))
+
+@profiling.timed('parse_cleaned_markdown')
+def parse_cleaned_markdown_text(content, visuals=None, extracted_images=None, filename='cleaned.md'):
+    """Parse cleaned Markdown text; visuals are the visuals.json entries for the same document"""
     # --- Custom: Extract image paths from Markdown and map to questions ---
     # Build a map: question number -> image paths found in markdown
     md_image_map = {}
@@ -34,18 +62,9 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
     #         img_path = os.path.join('output_test', m.group(1))
     #     return img_path
 
-    # Always resolve image path to full path in the correct media folder (not media/media)
-    visuals_json_path = os.path.join(os.path.dirname(cleaned_md_path), 'html_extraction', 'visuals.json')
-    # Fix: Use media/media as the actual image directory
-    media_dir = os.path.join(os.path.dirname(visuals_json_path), 'media', 'media')
+    # Images stay Pandoc media references (media/<file>); renderers read them from the DOCX
     for img_match in md_img_matches:
-        img_path = img_match.group(1)
-        # Remove any 'media/' or 'media/media/' prefix, always use only the filename
-        img_path_clean = img_path.replace('\\', '/').replace('..', '')
-        img_path_clean = re.sub(r'^(media/)+', '', img_path_clean)
-        img_path_clean = img_path_clean.replace('media/', '')
-        filename = os.path.basename(img_path_clean)
-        abs_img_path = os.path.abspath(os.path.join(media_dir, filename))
+        img_ref = media_ref(img_match.group(1))
         img_pos = img_match.start()
         q_for_img = None
         for q_idx, q_match in enumerate(qnum_matches):
@@ -57,33 +76,18 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
             q_key = str(q_for_img)
             if q_key not in md_image_map:
                 md_image_map[q_key] = []
-            if abs_img_path not in md_image_map[q_key]:
-                md_image_map[q_key].append(abs_img_path)
+            if img_ref not in md_image_map[q_key]:
+                md_image_map[q_key].append(img_ref)
 
-    # If a visuals JSON file exists, load it and build a qnum->images/tables map
+    # Build a qnum->images/tables map from the visuals.json entries
     visuals_map = {}
     visuals_common_contexts = []
-    visuals_json_path = os.path.join(os.path.dirname(cleaned_md_path), 'html_extraction', 'visuals.json')
-    media_dir = os.path.join(os.path.dirname(visuals_json_path), 'media')
-    if os.path.exists(visuals_json_path):
+    if visuals:
         try:
-            with open(visuals_json_path, 'r', encoding='utf-8') as vf:
-                visuals_list = json.load(vf)
-            def resolve_media_path(img_path):
-                # If already absolute, return as is
-                if os.path.isabs(img_path):
-                    return img_path
-                # Normalize slashes
-                img_path = img_path.replace('\\', '/').replace('..', '')
-                # Remove any leading './' or '.\'
-                img_path = re.sub(r'^\./+', '', img_path)
-                # Always join with .../media/media/filename, regardless of input
-                filename = os.path.basename(img_path)
-                return os.path.abspath(os.path.join(media_dir, 'media', filename))
-            for entry in visuals_list:
+            for entry in visuals:
                 qnum = str(entry.get('question_number'))
                 # Use 'images' and 'tables' keys (lowercase) as per visuals.json
-                images = [resolve_media_path(p) for p in entry.get('images', [])]
+                images = [media_ref(p) for p in entry.get('images', [])]
                 tables = entry.get('tables', [])
                 if qnum == 'common' and 'context_text' in entry:
                     visuals_common_contexts.append({
@@ -98,8 +102,6 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
                     }
         except Exception as e:
             visuals_map = {}
-    with open(cleaned_md_path, 'r', encoding='utf-8') as f:
-        content = f.read()
 
     # Find all section headers (e.g., <strong>TEST -- I</strong>)
     section_pattern = re.compile(r'<strong>\s*TEST\s*[-–]+\s*([IVX1-9]+)\s*</strong>', re.IGNORECASE)
@@ -438,7 +440,7 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
         
     # Compose the JSON structure
     data = {
-        'filename': os.path.basename(cleaned_md_path),
+        'filename': filename,
         'Content': all_sections
     }
     
@@ -448,6 +450,7 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
         
     return data
 
+@profiling.timed('map_images_to_content')
 def map_images_to_content(data, extracted_images):
     """
     Map extracted images to the appropriate questions or common data sections
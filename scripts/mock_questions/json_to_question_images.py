@@ -1,10 +1,26 @@
 import os
+import sys
 import json
 from PIL import Image, ImageDraw, ImageFont
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import progress, profiling, blockcache, render_manifest, docx_media, wkhtml, imageops, figures, canvas, encoders, preview, sprites
+
 # You may need to adjust this path to a TTF font file available on your system
 DEFAULT_FONT = os.path.join(os.path.dirname(__file__), '../dejavu-fonts-ttf-2.37/ttf/DejaVuSans.ttf')
 
+# Tables are rasterized by wkhtmltoimage with this stylesheet at this page width
+TABLE_STYLE = '''
+    table { border-collapse: collapse; width: 100%; font-size: 22px; }
+    th, td { border: 1px solid #222; padding: 8px; text-align: center; background: #fff; }
+    th { background: #f2f2f2; font-weight: bold; }
+    tr:nth-child(even) td { background: #f9f9f9; }
+'''
+TABLE_WIDTH = 1200
+# Default of DOC2VIZ_OUTPUT_FORMAT for this variant
+OUTPUT_FORMAT = 'jpeg'
+
 # Utility to wrap text for PIL
 from textwrap import wrap
 
@@ -39,7 +55,15 @@ def render_text_to_image(text, width=1600, font_path=DEFAULT_FONT, font_size=32,
         y += line_height
     return img
 
-def make_question_image(q, out_path, font_path=DEFAULT_FONT):
+def prefetch_tables(questions):
+    """Register the tables of the questions about to be drawn, so the first one drawn lays them all out in one wkhtmltoimage run"""
+    wkhtml.table_renderer(TABLE_STYLE, TABLE_WIDTH).prefetch(
+        table_html
+        for q in questions
+        for table_html in q.get('Table') or [])
+
+@profiling.timed('make_question_image')
+def make_question_image(q, out_path, font_path=DEFAULT_FONT, block_cache=None):
     # Compose the text block, justify only the question, left-align options
     blocks = []
     def has_html_style_tags(text):
@@ -88,44 +112,15 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         elif common_len < 200:
             width = min_width
 
-    # If there are tables, render them using wkhtmltopdf and insert as images (from cleaned JSON only)
-    import tempfile
-    import subprocess
-    from PIL import Image
+    # If there are tables, render them using wkhtmltoimage and insert as images (from cleaned JSON only)
     table_imgs = []
-    classic_table_style = '''
-        table { border-collapse: collapse; width: 100%; font-size: 22px; }
-        th, td { border: 1px solid #222; padding: 8px; text-align: center; background: #fff; }
-        th { background: #f2f2f2; font-weight: bold; }
-        tr:nth-child(even) td { background: #f9f9f9; }
-    '''
+    tables = wkhtml.table_renderer(TABLE_STYLE, TABLE_WIDTH)
     if q.get('Table'):
-        for idx, table_html in enumerate(q['Table']):
-            with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False, encoding='utf-8') as tf:
-                html_path = tf.name
-                tf.write(f"""
-                <html><head>
-                <meta charset='utf-8'>
-                <style>
-                {classic_table_style}
-                </style>
-                </head><body>{table_html}</body></html>
-                """)
-            img_temp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            img_temp.close()
-            img_path = img_temp.name
+        for table_html in q['Table']:
             try:
-                subprocess.run([
-                    'wkhtmltoimage', '--width', '1200', '--quality', '90', html_path, img_path
-                ], check=True)
-                table_img = Image.open(img_path)
-                table_imgs.append(table_img)
+                table_imgs.append(imageops.trim(tables.render(table_html)))
             except Exception as e:
                 print(f"Failed to render table with wkhtmltoimage: {e}")
-            finally:
-                os.unlink(html_path)
-                # Optionally, keep img_path for debugging
-                # os.unlink(img_path)
 
     # If there are images (from the JSON 'Image' field), load them to paste after options/at last
     image_imgs = []
@@ -134,6 +129,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
     max_img_width = int(0.9 * width) // 2  # Allow up to 2 per row, 90% of width
     min_img_height = 200
     max_img_height = 700
+    figure_fit = figures.Fit(min_img_width, max_img_width, min_img_height, max_img_height)
     import re
     if q.get('Image'):
         for img_entry in q['Image']:
@@ -167,28 +163,10 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
                             candidate_paths.append(os.path.normpath(os.path.join(candidate, norm_img_path)))
                             break
                         cur_dir = os.path.dirname(cur_dir)
-                    # Try all candidate paths, use the first that exists
-                    img_full_path = None
-                    for cpath in candidate_paths:
-                        if os.path.exists(cpath):
-                            img_full_path = cpath
-                            break
-                    if img_full_path and os.path.exists(img_full_path):
-                        img = Image.open(img_full_path)
-                        w, h = img.size
-                        # Zoom up if image is small, shrink if too large
-                        zoom = 1.0
-                        if w < min_img_width:
-                            zoom = min_img_width / w
-                        elif w > max_img_width:
-                            zoom = max_img_width / w
-                        if h < min_img_height:
-                            zoom = max(zoom, min_img_height / h)
-                        elif h > max_img_height:
-                            zoom = min(zoom, max_img_height / h)
-                        w = int(w * zoom)
-                        h = int(h * zoom)
-                        img = img.resize((w, h), Image.LANCZOS)
+                    # Embedded media comes from the DOCX, else use the first candidate path that exists
+                    # Zoom up if image is small, shrink if too large
+                    img = figures.prepare_figure(img_path, candidate_paths, figure_fit)
+                    if img is not None:
                         image_imgs.append(img)
                     else:
                         print(f"Image not found: {img_path} (tried: {candidate_paths})")
@@ -207,7 +185,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         # Use 90% of image width for text area
         return int(width * 0.88) if is_common else int(width * 0.80)
 
-    def get_lines_and_height(font_size):
+    def get_lines_and_height(font_size, text_blocks):
         font = ImageFont.truetype(font_path, font_size)
         # Prepare font variants
         font_dir = os.path.dirname(font_path)
@@ -257,7 +235,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
                 else:
                     merged.append((t, s))
             return merged
-        for idx, (text, align) in enumerate(blocks):
+        for idx, (text, align) in enumerate(text_blocks):
             is_question = (align.startswith('center') and text == q.get('Question'))
             is_common = (
                 (align == 'center_justify' and (text == q.get('main_common_data') or text == q.get('sub_common_data')))
@@ -331,7 +309,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
                         block_types.append('question' if is_question else ('common' if is_common else 'other'))
                         html_styles.append(None)
             # Add a blank line after each block except options and except after common data
-            is_last_common = is_common and (idx == len(blocks)-1 or not (blocks[idx+1][1] == 'center_justify'))
+            is_last_common = is_common and (idx == len(text_blocks)-1 or not (text_blocks[idx+1][1] == 'center_justify'))
             if align != 'left' or text == q.get('Question'):
                 if not is_common or not is_last_common:
                     lines.append('')
@@ -342,12 +320,114 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         text_height = margin * 2 + line_height * len(lines)
         return lines, aligns, block_types, line_height, text_height, font, fonts, html_styles
 
+    def draw_lines(draw, lines, aligns, block_types, html_styles, font, fonts, line_height, y):
+        # Draw laid-out lines starting at y; returns the y below the last line
+        n_lines = len(lines)
+        for idx, (line, align, block_type) in enumerate(zip(lines, aligns, block_types)):
+            html_style = html_styles[idx]
+            if html_style:
+                # Render styled HTML line (bold/italic/underline for <strong>/<b>/<em>/<i>/<u>)
+                x = (width - draw.textlength(line, font=font)) // 2
+                for t, style in html_style:
+                    # Determine font style
+                    font_key = 'normal'
+                    if style.get('bold') and style.get('italic'):
+                        font_key = 'bold_italic'
+                    elif style.get('bold'):
+                        font_key = 'bold'
+                    elif style.get('italic'):
+                        font_key = 'italic'
+                    fnt = fonts.get(font_key, font)
+                    # Draw underline if needed
+                    if style.get('underline'):
+                        draw.text((x, y), t, font=fnt, fill='black')
+                        # Draw underline manually
+                        try:
+                            bbox = draw.textbbox((x, y), t, font=fnt)
+                            underline_y = bbox[3] + 2
+                            draw.line((bbox[0], underline_y, bbox[2], underline_y), fill='black', width=2)
+                        except Exception:
+                            pass
+                    else:
+                        draw.text((x, y), t, font=fnt, fill='black')
+                    x += draw.textlength(t, font=fnt)
+                y += line_height
+                continue
+            try:
+                bbox = draw.textbbox((0, 0), line, font=font)
+                w = bbox[2] - bbox[0]
+                h = bbox[3] - bbox[1]
+            except AttributeError:
+                w, h = font.getsize(line)
+            # Justify question and common data lines except last line of their block
+            if (block_type == 'question' and align == 'center') or (block_type == 'common' and align == 'center_justify'):
+                # Find if this is the last line of the block
+                is_last = False
+                for j in range(idx+1, n_lines):
+                    if block_types[j] == block_type:
+                        is_last = False
+                        break
+                    if block_types[j] != block_type:
+                        is_last = True
+                        break
+                else:
+                    is_last = True
+                if not is_last and len(line.strip().split()) > 1:
+                    # Justify this line
+                    words = line.strip().split()
+                    n_spaces = len(words) - 1
+                    total_text_width = sum(draw.textlength(word, font=font) for word in words)
+                    space_width = (width - 2*margin - total_text_width) / n_spaces if n_spaces > 0 else 0
+                    x = margin
+                    for i, word in enumerate(words):
+                        draw.text((x, y), word, font=font, fill='black')
+                        word_width = draw.textlength(word, font=font)
+                        x += word_width
+                        if i < n_spaces:
+                            x += space_width
+                    y += line_height
+                    continue
+                else:
+                    # Center last line or single-word lines
+                    x = (width - w) // 2
+            elif align == 'center' or align == 'center_justify':
+                x = (width - w) // 2
+            elif align == 'right':
+                x = width - w - margin
+            else:
+                x = margin
+            draw.text((x, y), line, font=font, fill='black')
+            y += line_height
+        return y
+
+    # The shared direction block is laid out and drawn once per job, then pasted into every question of its range
+    text_blocks = blocks
+    common_img = None
+    common_lines = 0
+    if q.get('main_common_data'):
+        if block_cache is None:
+            block_cache = blockcache.default_cache()
+        common_text = q['main_common_data']
+
+        def render_common_block():
+            c_lines, c_aligns, c_types, c_line_height, _, c_font, c_fonts, c_styles = get_lines_and_height(max_font_size, blocks[:1])
+            # Canvas starts at the top of the question image and runs half a line past the block for descenders
+            c_img = canvas.new((width, margin + c_line_height * len(c_lines) + c_line_height // 2))
+            draw_lines(canvas.draw(c_img), c_lines, c_aligns, c_types, c_styles, c_font, c_fonts, c_line_height, margin)
+            return c_img, len(c_lines)
+
+        common_img, common_lines = block_cache.get_or_render(
+            ('mock_questions', common_text, blocks[0][1], common_text == q.get('Question'), width, font_path, max_font_size, margin),
+            render_common_block
+        )
+        text_blocks = blocks[1:]
+
     # Try to fit text with decreasing font size
     font_size = max_font_size
     max_img_height = 900  # Further decrease the height of the question image
     while font_size >= min_font_size:
-        lines, aligns, block_types, line_height, text_height, font, fonts, html_styles = get_lines_and_height(font_size)
-        img_height = text_height
+        lines, aligns, block_types, line_height, text_height, font, fonts, html_styles = get_lines_and_height(font_size, text_blocks)
+        img_height = text_height + common_lines * line_height
         for timg in table_imgs:
             img_height += timg.height + 30
         for iimg in image_imgs:
@@ -355,85 +435,14 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         break
 
     # Draw on a tall temp image, then crop to content
-    temp_img = Image.new('RGB', (width, img_height), color='white')
-    draw = ImageDraw.Draw(temp_img)
+    # Grayscale unless a table or figure has colour
+    temp_img = canvas.new((width, img_height), table_imgs + image_imgs)
+    draw = canvas.draw(temp_img)
     y = margin
-    n_lines = len(lines)
-    for idx, (line, align, block_type) in enumerate(zip(lines, aligns, block_types)):
-        html_style = html_styles[idx] if 'html_styles' in locals() else None
-        if html_style:
-            # Render styled HTML line (bold/italic/underline for <strong>/<b>/<em>/<i>/<u>)
-            x = (width - draw.textlength(line, font=font)) // 2
-            for t, style in html_style:
-                # Determine font style
-                font_key = 'normal'
-                if style.get('bold') and style.get('italic'):
-                    font_key = 'bold_italic'
-                elif style.get('bold'):
-                    font_key = 'bold'
-                elif style.get('italic'):
-                    font_key = 'italic'
-                fnt = fonts.get(font_key, font)
-                # Draw underline if needed
-                if style.get('underline'):
-                    draw.text((x, y), t, font=fnt, fill='black')
-                    # Draw underline manually
-                    try:
-                        bbox = draw.textbbox((x, y), t, font=fnt)
-                        underline_y = bbox[3] + 2
-                        draw.line((bbox[0], underline_y, bbox[2], underline_y), fill='black', width=2)
-                    except Exception:
-                        pass
-                else:
-                    draw.text((x, y), t, font=fnt, fill='black')
-                x += draw.textlength(t, font=fnt)
-            y += line_height
-            continue
-        try:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            w = bbox[2] - bbox[0]
-            h = bbox[3] - bbox[1]
-        except AttributeError:
-            w, h = font.getsize(line)
-        # Justify question and common data lines except last line of their block
-        if (block_type == 'question' and align == 'center') or (block_type == 'common' and align == 'center_justify'):
-            # Find if this is the last line of the block
-            is_last = False
-            for j in range(idx+1, n_lines):
-                if block_types[j] == block_type:
-                    is_last = False
-                    break
-                if block_types[j] != block_type:
-                    is_last = True
-                    break
-            else:
-                is_last = True
-            if not is_last and len(line.strip().split()) > 1:
-                # Justify this line
-                words = line.strip().split()
-                n_spaces = len(words) - 1
-                total_text_width = sum(draw.textlength(word, font=font) for word in words)
-                space_width = (width - 2*margin - total_text_width) / n_spaces if n_spaces > 0 else 0
-                x = margin
-                for i, word in enumerate(words):
-                    draw.text((x, y), word, font=font, fill='black')
-                    word_width = draw.textlength(word, font=font)
-                    x += word_width
-                    if i < n_spaces:
-                        x += space_width
-                y += line_height
-                continue
-            else:
-                # Center last line or single-word lines
-                x = (width - w) // 2
-        elif align == 'center' or align == 'center_justify':
-            x = (width - w) // 2
-        elif align == 'right':
-            x = width - w - margin
-        else:
-            x = margin
-        draw.text((x, y), line, font=font, fill='black')
-        y += line_height
+    if common_img is not None:
+        temp_img.paste(common_img, (0, 0))
+        y += common_lines * line_height
+    y = draw_lines(draw, lines, aligns, block_types, html_styles, font, fonts, line_height, y)
     # Paste table images after text
     for timg in table_imgs:
         temp_img.paste(timg, ((width - timg.width) // 2, y))
@@ -467,29 +476,53 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         i += 1
     # Crop to content (remove extra bottom space)
     cropped_img = temp_img.crop((0, 0, width, y))
-    cropped_img.save(out_path.replace('.png', '.jpg'), format='JPEG', quality=70, optimize=True)
+    encoders.current(OUTPUT_FORMAT).save(cropped_img, out_path)
 
 
-def main():
+def main(argv=None, data=None):
+    """Command-line entry point; wordToMD.py calls it in-process with the parsed data"""
     import argparse
     import os
     parser = argparse.ArgumentParser(description='Generate question images from DOCX or JSON')
     parser.add_argument('--docx', type=str, default=None, help='Path to input DOCX file (optional, will run full pipeline if provided)')
     parser.add_argument('--json', type=str, default=None, help='Path to cleaned JSON (optional, overrides DOCX if provided)')
+    parser.add_argument('--media-docx', type=str, default=None, help='DOCX to read embedded images from (default: --docx)')
     parser.add_argument('--outdir', type=str, default='../output_test/question_images', help='Output directory')
     parser.add_argument('--docxname', type=str, default=None, help='Original Word document name (without extension)')
     parser.add_argument('--font', type=str, default=DEFAULT_FONT, help='Font path')
-    args = parser.parse_args()
+    parser.add_argument('--force', action='store_true', help='Re-render every image even if the render manifest says it is up to date')
+    parser.add_argument('--profile', nargs='?', const='profiles', default=None, metavar='DIR', help='Write a timing report (and pstats with --pstats) into DIR')
+    parser.add_argument('--pstats', action='store_true', help='With --profile, also dump a cProfile/pstats file')
+    parser.add_argument('--preview', nargs='?', type=int, const=preview.DEFAULT_WIDTH, default=None, metavar='WIDTH', help='Quick check: one low-resolution contact sheet per section, questions WIDTH px wide (default 400)')
+    parser.add_argument('--sprites', nargs='?', type=int, const=sprites.DEFAULT_SHEET_SIZE, default=None, metavar='SIZE', help='Pack the questions of each section into sprite sheets of at most SIZE px (default 4096) with a JSON index')
+    args = parser.parse_args(argv)
+    # Profiling is either requested directly or inherited from wordToMD.py --profile
+    if args.profile:
+        profiling.enable(args.profile, 'render', pstats=args.pstats)
+    else:
+        profiling.enable_from_env('render')
+    if args.preview:
+        preview.enable(args.preview)
+    if args.sprites:
+        sprites.enable(args.sprites)
+
+    # Embedded images are decoded from the DOCX itself; Pandoc no longer extracts them to disk
+    media_docx = args.media_docx or args.docx
+    if media_docx and os.path.exists(media_docx):
+        docx_media.set_current(docx_media.DocxMediaProvider(media_docx))
 
     # If DOCX is provided, run the full pipeline
-    if args.docx:
+    if data is not None:
+        # Already parsed by wordToMD.py in the same process
+        pass
+    elif args.docx:
         from wordToMD import convert_docx_to_markdown
         from md_cleaner import clean_markdown_content
         from md_to_json import parse_cleaned_markdown
         output_base_dir = os.path.join(os.path.dirname(args.outdir), 'output_test')
         md_content, md_path, media_dir, extracted_images = convert_docx_to_markdown(
             args.docx, output_base_dir,
-            extract_media=True, mathml=True, save_md=True, extract_images=True
+            extract_media=False, mathml=True, save_md=True, extract_images=True
         )
         cleaned_md_path = os.path.join(output_base_dir, 'cleaned.md')
         cleaned_content = clean_markdown_content(
@@ -537,7 +570,15 @@ def main():
     except Exception as e:
         print(f"[ERROR] Could not create upload_dir {upload_dir}: {e}")
 
+    encoder = encoders.current(OUTPUT_FORMAT)
+    # Images whose inputs have not changed since the last upload of this paper are reused
+    manifest = render_manifest.RenderManifest(upload_dir, __file__, args.font, settings=dict(encoder.settings(), canvas=canvas.setting()))
+    if args.force:
+        manifest.previous = {}
+
     content = data['Content']
+    # Decide up front which questions are drawn
+    plan = []
     for section, section_data in content.items():
         section_label = section.strip() or 'default'
         section_dir = os.path.join(upload_dir, section_label)
@@ -546,13 +587,37 @@ def main():
         for q in questions:
             qno = q.get('Question Number', 'unknown')
             out_path = os.path.join(section_dir, f'question_{qno}.png')
-            make_question_image(q, out_path, font_path=args.font)
+            image_path = encoder.path_for(out_path)
+            item_hash = manifest.item_hash(q)
+            # Paged output rewrites the whole section document, so every item is drawn
+            draw = encoder.paged or not manifest.is_current(image_path, item_hash)
+            plan.append((q, out_path, image_path, item_hash, draw))
+    total_questions = len(plan)
+    rendered = 0
+    # Reused questions keep their image, so their tables are not laid out
+    prefetch_tables(q for q, _, _, _, draw in plan if draw)
+    with progress.stage('render', total=total_questions):
+        for q, out_path, image_path, item_hash, draw in plan:
+            if draw:
+                make_question_image(q, out_path, font_path=args.font)
+            manifest.record(image_path, item_hash)
+            rendered += 1
+            progress.report('render', rendered, total_questions)
             # print(f"Saved: {out_path}")
+        # Section documents and sprite sheets are recorded too, so a run in another format removes them
+        for document_path in encoder.finish():
+            manifest.record(document_path, None)
+
+    manifest.remove_stale()
+    manifest.save()
+    if manifest.reused:
+        print(f"Reused {manifest.reused} unchanged images")
 
     # Zip the filename folder and print the path
     import shutil
     zip_base = os.path.join(conversions_dir, filename)
-    zip_path = shutil.make_archive(zip_base, 'zip', upload_dir)
+    with progress.stage('archive'):
+        zip_path = shutil.make_archive(zip_base, 'zip', upload_dir)
     print("===ZIP===")
     print(zip_path)
 
@@ -1,5 +1,13 @@
+import os
 import re
+import sys
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import profiling
+
+
+@profiling.timed('remove_markdown_tables')
 def remove_markdown_tables(text):
     pattern = re.compile(
         r'''
@@ -11,6 +19,7 @@ def remove_markdown_tables(text):
     )
     return pattern.sub('', text)
 
+@profiling.timed('fix_linebreaks')
 def fix_linebreaks(text):
     lines = text.split('\n')
     fixed_lines = []
@@ -34,6 +43,7 @@ def fix_linebreaks(text):
 import logging
 from pylatexenc.latex2text import LatexNodes2Text
 
+@profiling.timed('strip_image_attributes')
 def strip_image_attributes(md_content):
     """Remove image size attributes from Markdown"""
     # Remove image size attributes from Markdown
@@ -64,6 +74,7 @@ def latex_to_readable(text):
         logging.warning(f"Failed to convert LaTeX: {text}, Error: {e}")
         return text
 
+@profiling.timed('preprocess_latex_content')
 def preprocess_latex_content(md_content):
     def latex_exclude_numbers(match):
         content = match.group(1)
@@ -78,6 +89,7 @@ def preprocess_latex_content(md_content):
     md_content = re.sub(r'\\text\{cm\}\^3', r'cm^3', md_content)
     return md_content
 
+@profiling.timed('convert_underline_syntax')
 def convert_underline_syntax(md_content):
     md_content = re.sub(r'\*{1,2}\[([^\]]+)\]\{\.underline\}\*{1,2}', 
                         lambda m: f'<u>[{m.group(1)}]</u>', md_content)
@@ -97,6 +109,7 @@ def convert_underline_syntax(md_content):
                         lambda m: f'<u>{m.group(1).strip()}</u>', md_content)
     return md_content
 
+@profiling.timed('clean_markdown_content')
 def clean_markdown_content(md_content, process_latex=True, process_underlines=True, save_json=False, cleaned_md_path=None):
     def replace_latex_symbols(md):
         # Replace common LaTeX math commands with Unicode
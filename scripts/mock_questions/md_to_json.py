@@ -1,21 +1,40 @@
 import os
 import re
+import sys
 import json
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import profiling
+
+def load_visuals(visuals_json_path):
+    """Entries of a visuals.json written by html_image_extractor, or None if it is missing or unreadable"""
+    if not os.path.exists(visuals_json_path):
+        return None
+    try:
+        with open(visuals_json_path, 'r', encoding='utf-8') as vf:
+            return json.load(vf)
+    except Exception:
+        return None
+
 def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
+    """Parse a cleaned.md file, with the visuals.json next to it in html_extraction/"""
     with open(cleaned_md_path, 'r', encoding='utf-8') as f:
         content = f.read()
+    visuals = load_visuals(os.path.join(os.path.dirname(cleaned_md_path), 'html_extraction', 'visuals.json'))
+    return parse_cleaned_markdown_text(content, visuals, extracted_images, os.path.basename(cleaned_md_path))
+
+@profiling.timed('parse_cleaned_markdown')
+def parse_cleaned_markdown_text(content, visuals=None, extracted_images=None, filename='cleaned.md'):
+    """Parse cleaned Markdown text; visuals are the visuals.json entries for the same document"""
     # (Markdown image extraction disabled; only visuals.json will be used for images/tables)
 
-    # If a visuals JSON file exists, load it and build a qnum->images/tables map
+    # Build a qnum->images/tables map from the visuals.json entries
     visuals_map = {}
     visuals_common_contexts = []
-    visuals_json_path = os.path.join(os.path.dirname(cleaned_md_path), 'html_extraction', 'visuals.json')
-    if os.path.exists(visuals_json_path):
+    if visuals:
         try:
-            with open(visuals_json_path, 'r', encoding='utf-8') as vf:
-                visuals_list = json.load(vf)
-            for entry in visuals_list:
+            for entry in visuals:
                 qnum = str(entry.get('question_number'))
                 if qnum == 'common' and 'context_text' in entry:
                     visuals_common_contexts.append({
@@ -30,8 +49,6 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
                     }
         except Exception as e:
             visuals_map = {}
-    with open(cleaned_md_path, 'r', encoding='utf-8') as f:
-        content = f.read()
 
     # Find all section headers (e.g., <strong>TEST -- I</strong>)
     section_pattern = re.compile(r'<strong>\s*TEST\s*[-–]+\s*([IVX1-9]+)\s*</strong>', re.IGNORECASE)
@@ -380,7 +397,7 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
         
     # Compose the JSON structure
     data = {
-        'filename': os.path.basename(cleaned_md_path),
+        'filename': filename,
         'Content': all_sections
     }
     
@@ -390,6 +407,7 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
         
     return data
 
+@profiling.timed('map_images_to_content')
 def map_images_to_content(data, extracted_images):
     """
     Map extracted images to the appropriate questions or common data sections
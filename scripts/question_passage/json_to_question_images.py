@@ -1,17 +1,31 @@
 import io
 import os
+import sys
 import json
 from PIL import Image, ImageDraw, ImageFont
 from textwrap import wrap
-import tempfile
-import subprocess
 import re
 from html import unescape
 from bs4 import BeautifulSoup, NavigableString
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import progress, profiling, blockcache, render_manifest, docx_media, wkhtml, imageops, figures, canvas, encoders, preview, sprites
+
 # You may need to adjust this path to a TTF font file available on your system
 DEFAULT_FONT = os.path.join(os.path.dirname(__file__), '../dejavu-fonts-ttf-2.37/ttf/DejaVuSans.ttf')
 
+# Tables are rasterized by wkhtmltoimage with this stylesheet, 80px narrower than the 1200px question image
+TABLE_STYLE = '''
+    table { border-collapse: collapse; width: 100%; font-size: 22px; }
+    th, td { border: 1px solid #222; padding: 8px; text-align: center; background: #fff; }
+    th { background: #f2f2f2; font-weight: bold; }
+    tr:nth-child(even) td { background: #f9f9f9; }
+'''
+TABLE_WIDTH = 1200 - 80
+# Default of DOC2VIZ_OUTPUT_FORMAT for this variant
+OUTPUT_FORMAT = 'png'
+
 # --- Moved get_wrap_width_px to module level ---
 def get_wrap_width_px(current_image_width, is_common):
     """
@@ -29,7 +43,7 @@ def render_text_to_image(text, width=1600, font_path=DEFAULT_FONT, font_size=32,
     lines = []
     for para in text.split('\n'): # Explicitly split by newlines
         lines.extend(wrap(para, width=110)) # Then wrap sub-lines based on character width
-    
+
     line_height = int(font_size * line_spacing)
     img_height = margin * 2 + line_height * len(lines)
     img = Image.new('RGB', (width, img_height), color=bg_color)
@@ -52,7 +66,15 @@ def render_text_to_image(text, width=1600, font_path=DEFAULT_FONT, font_size=32,
         y += line_height
     return img
 
-def make_question_image(q, out_path, font_path=DEFAULT_FONT):
+def prefetch_tables(questions):
+    """Register the tables of the questions about to be drawn, so the first one drawn lays them all out in one wkhtmltoimage run"""
+    wkhtml.table_renderer(TABLE_STYLE, TABLE_WIDTH).prefetch(
+        table_html
+        for q in questions
+        for table_html in q.get('Table') or [])
+
+@profiling.timed('make_question_image')
+def make_question_image(q, out_path, font_path=DEFAULT_FONT, block_cache=None):
     # Global configuration
     image_width = 1200  # Fixed width for consistency
     image_margin = 40
@@ -161,18 +183,18 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
 
     # Process and prepare the blocks of content
     blocks_raw_content = []
-    
+
     if q.get('main_common_data'):
         blocks_raw_content.append((q['main_common_data'], 'justify', 'common'))
         blocks_raw_content.append(('', 'blank_line_insert', 'blank'))
     if q.get('sub_common_data'):
         blocks_raw_content.append((q['sub_common_data'], 'justify', 'common'))
         blocks_raw_content.append(('', 'blank_line_insert', 'blank'))
-    
+
     question_text_raw = q.get('Question', '')
     question_text_raw = question_text_raw.replace(r'\.', '.').replace('\\n', ' ').replace('\n', ' ').strip()
     match_q_num = re.match(r'^\s*(?:<[^>]+>)*\s*(\d+\s*\.)(?:\s*(?:</[^>]+>)*\s*)(.*)', question_text_raw, re.DOTALL | re.IGNORECASE)
-    
+
     if match_q_num:
         main_question_text_str = match_q_num.group(2).strip()
     else:
@@ -186,29 +208,17 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
             blocks_raw_content.append((opt, 'left', 'option'))
 
     table_imgs = []
-    classic_table_style = '''
-        table { border-collapse: collapse; width: 100%; font-size: 22px; }
-        th, td { border: 1px solid #222; padding: 8px; text-align: center; background: #fff; }
-        th { background: #f2f2f2; font-weight: bold; }
-        tr:nth-child(even) td { background: #f9f9f9; }
-    '''
+    tables = wkhtml.table_renderer(TABLE_STYLE, TABLE_WIDTH)
     if q.get('Table'):
         for table_html in q['Table']:
-            with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False, encoding='utf-8') as tf:
-                tf.write(f"<html><head><meta charset='utf-8'><style>{classic_table_style}</style></head><body>{table_html}</body></html>")
-                html_path = tf.name
-            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as img_temp:
-                img_path = img_temp.name
             try:
-                subprocess.run(['wkhtmltoimage', '--width', str(image_width - 80), '--quality', '90', html_path, img_path], check=True, capture_output=True)
-                table_imgs.append(Image.open(img_path))
+                table_imgs.append(imageops.trim(tables.render(table_html)))
             except Exception as e:
                 print(f"Failed to render table: {e}")
-            finally:
-                os.unlink(html_path)
 
     image_imgs = []
     image_margin = 40
+    figure_fit = figures.Fit(None, image_width - (2 * image_margin), None, None)
     if q.get('Image'):
         for img_entry in q['Image']:
             img_path = None
@@ -216,30 +226,24 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
                 m = re.search(r'src=["\']([^"\']+)["\']', img_entry)
                 img_path = m.group(1) if m else img_entry
             if img_path:
-                # Simplified path finding for clarity
-                if not os.path.exists(img_path):
-                    img_path = os.path.join(os.path.dirname(out_path), '..', 'media', os.path.basename(img_path))
-
-                if os.path.exists(img_path):
-                    try:
-                        img = Image.open(img_path)
-                        max_img_w = image_width - (2 * image_margin)
-                        if img.width > max_img_w:
-                            ratio = max_img_w / img.width
-                            img = img.resize((max_img_w, int(img.height * ratio)), Image.LANCZOS)
+                fallback_path = os.path.join(os.path.dirname(out_path), '..', 'media', os.path.basename(img_path))
+                try:
+                    # Shrink to the image width, never enlarge
+                    img = figures.prepare_figure(img_path, [img_path, fallback_path], figure_fit)
+                    if img is None:
+                        print(f"Image not found: {img_path}")
+                    else:
                         image_imgs.append(img)
-                    except Exception as e:
-                        print(f"Failed to load image {img_path}: {e}")
-                else:
-                    print(f"Image not found: {img_path}")
-    
+                except Exception as e:
+                    print(f"Failed to load image {img_path}: {e}")
+
     main_text_margin = 40
     min_variable_font_size = 14
     max_variable_font_size = 22
     line_spacing_multiplier = 1.3
     max_total_image_height = 2000
 
-    def get_layout_metrics(font_config, current_image_width_for_layout):
+    def get_layout_metrics(font_config, current_image_width_for_layout, text_blocks):
         font_dir = os.path.dirname(font_path)
         # Create font objects for all required sizes
         fonts_by_size = {}
@@ -313,7 +317,7 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         layout_lines = []
         total_height = 0
 
-        for text_content, block_align_type, block_category in blocks_raw_content:
+        for text_content, block_align_type, block_category in text_blocks:
             font_size = font_config.get(block_category, font_config['default'])
             current_fonts = fonts_by_size[font_size]
             line_height = int(font_size * line_spacing_multiplier)
@@ -351,9 +355,84 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         total_height = sum(line[5] if len(line) >= 6 else 0 for line in layout_lines) + (2 * main_text_margin)
         return layout_lines, total_height, fonts_by_size
 
+    def draw_layout_lines(draw, layout_lines, y):
+        # Draw lines from get_layout_metrics starting at y; returns the y below the last line
+        for line in layout_lines:
+            if len(line) < 6:  # Skip invalid lines
+                continue
+            
+            content, fonts_set, align, category, width, line_height = line[:6]
+            if category == 'blank_inserted':
+                y += line_height
+                continue
+        
+            x = main_text_margin
+            if align == 'center':
+                x = (image_width - width) // 2
+            elif align == 'right':
+                x = image_width - width - image_margin
+        
+            if len(line) == 7:  # New format with segments
+                current_x = x
+                segments = line[6]
+                for segment_text, style in segments:
+                    font_key = 'normal'
+                    if style.get('bold') and style.get('italic'): font_key = 'bold_italic'
+                    elif style.get('bold'): font_key = 'bold'
+                    elif style.get('italic'): font_key = 'italic'
+                
+                    segment_font = fonts_set[font_key]
+                    # Draw text
+                    draw.text((current_x, y), segment_text, font=segment_font, fill='black')
+                
+                    # Draw underline if needed
+                    if style.get('underline'):
+                        try:
+                            bbox = draw.textbbox((current_x, y), segment_text, font=segment_font)
+                            underline_y = bbox[3] + 2
+                            draw.line((bbox[0], underline_y, bbox[2], underline_y), fill='black', width=2)
+                        except AttributeError:
+                            # Fallback for older Pillow versions
+                            text_width = segment_font.getsize(segment_text)[0]
+                            draw.line((current_x, y + segment_font.getsize(segment_text)[1] + 2,
+                                    current_x + text_width, y + segment_font.getsize(segment_text)[1] + 2),
+                                    fill='black', width=2)
+                
+                    current_x += (segment_font.getlength(segment_text) if hasattr(segment_font, 'getlength') 
+                                else segment_font.getsize(segment_text)[0])
+            else:  # Old format without styling
+                draw.text((x, y), content, font=fonts_set['normal'], fill='black')
+            y += line_height
+        return y
+
+    # The passage (main_common_data) always uses the common font size, so it is laid out and drawn
+    # once per job and pasted into every question of its range
+    text_blocks = blocks_raw_content
+    common_img = None
+    common_height = 0
+    if q.get('main_common_data'):
+        if block_cache is None:
+            block_cache = blockcache.default_cache()
+        common_config = {'common': font_sizes['common'], 'default': font_sizes['common']}
+
+        def render_common_block():
+            c_lines, c_text_height, _ = get_layout_metrics(common_config, image_width, blocks_raw_content[:1])
+            c_height = c_text_height - 2 * main_text_margin
+            # Canvas starts at the top of the question image and runs past the block for descenders
+            c_pad = int(font_sizes['common'] * line_spacing_multiplier)
+            c_img = canvas.new((image_width, main_text_margin + c_height + c_pad))
+            draw_layout_lines(canvas.draw(c_img), c_lines, main_text_margin)
+            return c_img, c_height
+
+        common_img, common_height = block_cache.get_or_render(
+            ('question_passage', q['main_common_data'], image_width, font_path, font_sizes['common'], main_text_margin, line_spacing_multiplier),
+            render_common_block
+        )
+        text_blocks = blocks_raw_content[1:]
+
     lines_to_render_final = []
     final_fonts_by_size = {}
-    
+
     variable_font_size = max_variable_font_size
     while variable_font_size >= min_variable_font_size:
         font_config = {
@@ -363,9 +442,9 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
             'default': variable_font_size
         }
         
-        lines_data, calculated_text_height, fonts_map = get_layout_metrics(font_config, image_width)
+        lines_data, calculated_text_height, fonts_map = get_layout_metrics(font_config, image_width, text_blocks)
         
-        total_content_height = calculated_text_height
+        total_content_height = calculated_text_height + common_height
         total_content_height += sum(t.height + image_margin for t in table_imgs)
         total_content_height += sum(i.height + image_margin for i in image_imgs)
 
@@ -377,84 +456,63 @@ def make_question_image(q, out_path, font_path=DEFAULT_FONT):
         variable_font_size -= 1
 
     # Calculate final height using line_height (6th element) from each line
-    final_height = sum(line[5] if len(line) >= 6 else 0 for line in lines_to_render_final) + (2 * main_text_margin)
+    final_height = sum(line[5] if len(line) >= 6 else 0 for line in lines_to_render_final) + (2 * main_text_margin) + common_height
     # Add heights for tables and images
     final_height += sum(t.height + image_margin for t in table_imgs)
     final_height += sum(i.height + image_margin for i in image_imgs)
-    
-    final_image = Image.new('RGB', (image_width, int(final_height)), color='white')
-    draw = ImageDraw.Draw(final_image)
+
+    # Grayscale unless a table or figure has colour
+    final_image = canvas.new((image_width, int(final_height)), table_imgs + image_imgs)
+    draw = canvas.draw(final_image)
     y = main_text_margin
+    if common_img is not None:
+        final_image.paste(common_img, (0, 0))
+        y += common_height
 
-    for line in lines_to_render_final:
-        if len(line) < 6:  # Skip invalid lines
-            continue
-            
-        content, fonts_set, align, category, width, line_height = line[:6]
-        if category == 'blank_inserted':
-            y += line_height
-            continue
-        
-        x = main_text_margin
-        if align == 'center':
-            x = (image_width - width) // 2
-        elif align == 'right':
-            x = image_width - width - image_margin
-        
-        if len(line) == 7:  # New format with segments
-            current_x = x
-            segments = line[6]
-            for segment_text, style in segments:
-                font_key = 'normal'
-                if style.get('bold') and style.get('italic'): font_key = 'bold_italic'
-                elif style.get('bold'): font_key = 'bold'
-                elif style.get('italic'): font_key = 'italic'
-                
-                segment_font = fonts_set[font_key]
-                # Draw text
-                draw.text((current_x, y), segment_text, font=segment_font, fill='black')
-                
-                # Draw underline if needed
-                if style.get('underline'):
-                    try:
-                        bbox = draw.textbbox((current_x, y), segment_text, font=segment_font)
-                        underline_y = bbox[3] + 2
-                        draw.line((bbox[0], underline_y, bbox[2], underline_y), fill='black', width=2)
-                    except AttributeError:
-                        # Fallback for older Pillow versions
-                        text_width = segment_font.getsize(segment_text)[0]
-                        draw.line((current_x, y + segment_font.getsize(segment_text)[1] + 2,
-                                current_x + text_width, y + segment_font.getsize(segment_text)[1] + 2),
-                                fill='black', width=2)
-                
-                current_x += (segment_font.getlength(segment_text) if hasattr(segment_font, 'getlength') 
-                            else segment_font.getsize(segment_text)[0])
-        else:  # Old format without styling
-            draw.text((x, y), content, font=fonts_set['normal'], fill='black')
-        y += line_height
+    y = draw_layout_lines(draw, lines_to_render_final, y)
 
     for timg in table_imgs:
         final_image.paste(timg, ((image_width - timg.width) // 2, y))
         y += timg.height + image_margin
-    
+
     for iimg in image_imgs:
         final_image.paste(iimg, ((image_width - iimg.width) // 2, y))
         y += iimg.height + image_margin
         
     final_image = final_image.crop((0, 0, image_width, y))
-    
-    # Simple save, compression logic can be re-added if necessary
-    final_image.save(out_path, format='PNG', optimize=True, compress_level=9)
-    
-def main():
+
+    encoders.current(OUTPUT_FORMAT).save(final_image, out_path)
+
+def main(argv=None, data=None):
+    """Command-line entry point; wordToMD.py calls it in-process with the parsed data"""
     import argparse
     parser = argparse.ArgumentParser(description='Generate question images from DOCX or JSON')
     parser.add_argument('--docx', type=str, default=None, help='Path to input DOCX file (optional, will run full pipeline if provided)')
     parser.add_argument('--json', type=str, default=None, help='Path to cleaned JSON (optional, overrides DOCX if provided)')
+    parser.add_argument('--media-docx', type=str, default=None, help='DOCX to read embedded images from (default: --docx)')
     parser.add_argument('--outdir', type=str, default='../output_test/question_images', help='Output directory')
     parser.add_argument('--docxname', type=str, default=None, help='Original Word document name (without extension)')
     parser.add_argument('--font', type=str, default=DEFAULT_FONT, help='Font path')
-    args = parser.parse_args()
+    parser.add_argument('--force', action='store_true', help='Re-render every image even if the render manifest says it is up to date')
+    parser.add_argument('--profile', nargs='?', const='profiles', default=None, metavar='DIR', help='Write a timing report (and pstats with --pstats) into DIR')
+    parser.add_argument('--pstats', action='store_true', help='With --profile, also dump a cProfile/pstats file')
+    parser.add_argument('--preview', nargs='?', type=int, const=preview.DEFAULT_WIDTH, default=None, metavar='WIDTH', help='Quick check: one low-resolution contact sheet per section, questions WIDTH px wide (default 400)')
+    parser.add_argument('--sprites', nargs='?', type=int, const=sprites.DEFAULT_SHEET_SIZE, default=None, metavar='SIZE', help='Pack the questions of each section into sprite sheets of at most SIZE px (default 4096) with a JSON index')
+    args = parser.parse_args(argv)
+    # Profiling is either requested directly or inherited from wordToMD.py --profile
+    if args.profile:
+        profiling.enable(args.profile, 'render', pstats=args.pstats)
+    else:
+        profiling.enable_from_env('render')
+    if args.preview:
+        preview.enable(args.preview)
+    if args.sprites:
+        sprites.enable(args.sprites)
+
+    # Embedded images are decoded from the DOCX itself; Pandoc no longer extracts them to disk
+    media_docx = args.media_docx or args.docx
+    if media_docx and os.path.exists(media_docx):
+        docx_media.set_current(docx_media.DocxMediaProvider(media_docx))
 
     try:
         from md_cleaner import clean_markdown_content
@@ -465,11 +523,14 @@ def main():
         print("Please ensure 'md_cleaner.py', 'md_to_json.py', and 'wordToMD.py' are in your PYTHONPATH or the same directory.")
         return
 
-    if args.docx:
+    if data is not None:
+        # Already parsed by wordToMD.py in the same process
+        pass
+    elif args.docx:
         output_base_dir = os.path.join(os.path.dirname(args.outdir), 'output_test')
         md_content, md_path, media_dir, extracted_images = convert_docx_to_markdown(
             args.docx, output_base_dir,
-            extract_media=True, mathml=True, save_md=True, extract_images=True
+            extract_media=False, mathml=True, save_md=True, extract_images=True
         )
         cleaned_md_path = os.path.join(output_base_dir, 'cleaned.md')
         cleaned_content = clean_markdown_content(
@@ -527,22 +588,53 @@ def main():
             except OSError as e:
                 print(f"Warning: Could not remove old directory {old_dir}: {e}. It might not be empty or in use.")
 
+    encoder = encoders.current(OUTPUT_FORMAT)
+    # Images whose inputs have not changed since the last upload of this paper are reused
+    manifest = render_manifest.RenderManifest(upload_dir, __file__, args.font, settings=dict(encoder.settings(), canvas=canvas.setting()))
+    if args.force:
+        manifest.previous = {}
+
     content = data['Content']
+    # Decide up front which questions are drawn
+    plan = []
     for section, section_data in content.items():
         section_label = section.strip()
         section_dir = os.path.join(upload_dir, section_label) if section_label else upload_dir
         os.makedirs(section_dir, exist_ok=True)
-        
+
         questions = section_data['Data']['questions']
         for q_data in questions:
             q_num = q_data.get('Question Number', 'unknown')
             out_path = os.path.join(section_dir, f'question_{q_num}.png')
-            make_question_image(q_data, out_path, font_path=args.font)
-
+            item_hash = manifest.item_hash(q_data)
+            image_path = encoder.path_for(out_path)
+            # Paged output rewrites the whole section document, so every item is drawn
+            draw = encoder.paged or not manifest.is_current(image_path, item_hash)
+            plan.append((q_data, out_path, image_path, item_hash, draw))
+    total_questions = len(plan)
+    rendered = 0
+    # Reused questions keep their image, so their tables are not laid out
+    prefetch_tables(q for q, _, _, _, draw in plan if draw)
+    with progress.stage('render', total=total_questions):
+        for q_data, out_path, image_path, item_hash, draw in plan:
+            if draw:
+                make_question_image(q_data, out_path, font_path=args.font)
+            manifest.record(image_path, item_hash)
+            rendered += 1
+            progress.report('render', rendered, total_questions)
+        # Section documents and sprite sheets are recorded too, so a run in another format removes them
+        for document_path in encoder.finish():
+            manifest.record(document_path, None)
+
+    manifest.remove_stale()
+    manifest.save()
+    if manifest.reused:
+        print(f"Reused {manifest.reused} unchanged images")
     print(f"Question images generated in: conversions/{docx_base}")
 
     zip_base = os.path.join(conversions_dir, docx_base)
-    zip_path = shutil.make_archive(zip_base, 'zip', upload_dir)
+    with progress.stage('archive'):
+        zip_path = shutil.make_archive(zip_base, 'zip', upload_dir)
 
     zip_dir, zip_file = os.path.split(zip_path)
     clean_zip_file = re.sub(r'^\d{8,}-', '', zip_file)
@@ -1,4 +1,11 @@
+import os
 import re
+import sys
+
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import profiling
+
 
 def fix_markdown_underline_spans(text):
     """
@@ -13,6 +20,7 @@ def fix_markdown_underline_spans(text):
 
 
 
+@profiling.timed('remove_markdown_tables')
 def remove_markdown_tables(text):
     pattern = re.compile(
         r"""
@@ -30,6 +38,7 @@ def remove_markdown_tables(text):
 import logging
 from pylatexenc.latex2text import LatexNodes2Text
 
+@profiling.timed('strip_image_attributes')
 def strip_image_attributes(md_content):
     """Remove image size attributes from Markdown"""
     # Remove image size attributes from Markdown
@@ -61,6 +70,7 @@ def latex_to_readable(text):
         logging.warning(f"Failed to convert LaTeX: {text}, Error: {e}")
         return text
 
+@profiling.timed('preprocess_latex_content')
 def preprocess_latex_content(md_content):
     def latex_exclude_numbers(match):
         content = match.group(1)
@@ -75,6 +85,7 @@ def preprocess_latex_content(md_content):
     md_content = re.sub(r'\\text\{cm\}\^3', r'cm^3', md_content)
     return md_content
 
+@profiling.timed('convert_underline_syntax')
 def convert_underline_syntax(md_content):
     md_content = re.sub(r'\*{1,2}\[([^\]]+)\]\{\.underline\}\*{1,2}', 
                         lambda m: f'<u>[{m.group(1)}]</u>', md_content)
@@ -109,6 +120,7 @@ def fix_nested_underline_quotes(text):
 
 
 
+@profiling.timed('clean_markdown_content')
 def clean_markdown_content(md_content, process_latex=True, process_underlines=True, save_json=False, cleaned_md_path=None):
     # First clean up PASSAGE headers in both Markdown and HTML formats
     md_content = re.sub(r'^\s*(?:\*\*|<strong>)PASSAGE\s*[-—–]+\s*[IVX]+(?:\*\*|</strong>)\s*$', '', md_content, flags=re.MULTILINE | re.IGNORECASE)
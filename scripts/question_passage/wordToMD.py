@@ -4,6 +4,10 @@ import subprocess
 import logging
 import sys
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import artifacts, pandoc, progress, profiling
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -11,29 +15,24 @@ class ConversionError(Exception):
     """Custom exception for conversion failures"""
     pass
 
-def extract_docx_to_md(input_docx_path, output_md_path, extract_media=True, mathml=False):
-    """Convert DOCX to Markdown with Pandoc with detailed error handling"""
-    base_dir = os.path.dirname(os.path.abspath(output_md_path))
-    media_dir = os.path.join(base_dir, 'media')
-    if extract_media:
+@profiling.timed('extract_docx_to_md')
+def extract_docx_to_md(input_docx_path, media_dir=None, mathml=False):
+    """
+    Convert DOCX to Markdown with Pandoc with detailed error handling. The
+    Markdown is read from Pandoc's stdout and returned; media is extracted
+    into media_dir when given.
+    """
+    if media_dir:
         os.makedirs(media_dir, exist_ok=True)
-    logger.info(f"Converting DOCX to Markdown: {input_docx_path} -> {output_md_path}")
-    cmd = ['pandoc', '-s', input_docx_path, '-o', output_md_path]
-    if extract_media:
-        cmd.append(f'--extract-media={media_dir}')
-    if mathml:
-        cmd.append('--mathml')
+    logger.info(f"Converting DOCX to Markdown: {input_docx_path}")
+    extra_args = ['--mathml'] if mathml else []
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        # Served from the Pandoc artifact cache when this DOCX was converted before
+        result = pandoc.pandoc_text(input_docx_path, 'markdown', media_dir, extra_args)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args, stderr=result.stderr)
         logger.info(f"Pandoc conversion successful")
-        if result.stdout:
-            logger.info(f"Pandoc output: {result.stdout}")
-        return True
+        return result.stdout
     except subprocess.CalledProcessError as e:
         logger.error(f"Pandoc failed with code {e.returncode}: {e.stderr}")
         raise ConversionError(f"Pandoc conversion failed: {e.stderr}")
@@ -46,6 +45,7 @@ def extract_docx_to_md(input_docx_path, output_md_path, extract_media=True, math
         logger.error(error_msg)
         raise ConversionError(error_msg)
 
+@profiling.timed('exclude_header')
 def exclude_header(content):
     """Remove everything before the first TEST, Directions, or question number"""
     header_end = 0
@@ -79,6 +79,38 @@ def exclude_header(content):
         content_wo_header = content.lstrip()
     return content_wo_header
 
+def extract_docx_visuals(input_docx_path, output_base_dir, save=True):
+    """
+    Tables and images of the DOCX mapped to their questions (the entries of
+    html_extraction/visuals.json, which is only written when save is set).
+    Returns an empty list if the document is missing or extraction fails.
+    """
+    visuals = []
+    try:
+        logger.info(f"Extracting images and question mapping from HTML for {input_docx_path}")
+        images_dir = os.path.join(output_base_dir, 'html_extraction')
+        from html_image_extractor import extract_visuals
+        if not os.path.exists(input_docx_path):
+            logger.warning(f"Document not found: {input_docx_path}")
+        else:
+            with progress.stage('html_extraction'):
+                result = extract_visuals(input_docx_path, images_dir, save)
+            if result is not None:
+                visuals = result
+                logger.info(f"Extracted {len(visuals)} visuals with question mapping")
+            else:
+                logger.warning("HTML extraction returned None")
+    except Exception as e:
+        logger.warning(f"HTML image extraction failed: {e}")
+        visuals = []
+    return visuals
+
+def docx_to_markdown_text(input_docx_path, media_dir=None, mathml=False):
+    """Pandoc Markdown of the DOCX with the header excluded"""
+    with progress.stage('pandoc'):
+        content = extract_docx_to_md(input_docx_path, media_dir, mathml)
+    return exclude_header(content)
+
 def convert_docx_to_markdown(input_docx_path, output_base_dir, 
                            extract_media=True, mathml=False, 
                            save_md=True, extract_images=True):
@@ -103,33 +135,13 @@ def convert_docx_to_markdown(input_docx_path, output_base_dir,
     # Extract images and question mapping from HTML if requested
     extracted_images = []
     if extract_images:
-        try:
-            logger.info(f"Extracting images and question mapping from HTML for {input_docx_path}")
-            images_dir = os.path.join(output_base_dir, 'html_extraction')
-            from html_image_extractor import extract_images_via_html
-            if not os.path.exists(input_docx_path):
-                logger.warning(f"Document not found: {input_docx_path}")
-            else:
-                extracted_images = extract_images_via_html(input_docx_path, images_dir)
-                logger.info(f"Extracted {len(extracted_images)} images (HTML-based) with question mapping")
-                # Ensure all images have 'path' and propagate context_text if present
-                for img in extracted_images:
-                    if 'path' not in img and isinstance(img, str):
-                        img['path'] = img
-                extracted_images = [img for img in extracted_images if os.path.exists(img.get('path', ''))]
-                if len(extracted_images) == 0:
-                    logger.warning("No valid images were extracted or all image files are missing")
-        except Exception as e:
-            logger.warning(f"HTML image extraction failed: {e}")
-            extracted_images = []
+        visuals = extract_docx_visuals(input_docx_path, output_base_dir)
+        # Only entries pointing at an extracted image file are passed on
+        extracted_images = [img for img in visuals if isinstance(img, dict) and os.path.exists(img.get('path', ''))]
+        if len(extracted_images) == 0:
+            logger.warning("No valid images were extracted or all image files are missing")
     
-    extract_docx_to_md(input_docx_path, md_path, extract_media, mathml)
-    try:
-        with open(md_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except Exception as e:
-        raise ConversionError(f"Failed to read converted markdown: {e}")
-    content_wo_header = exclude_header(content)
+    content_wo_header = docx_to_markdown_text(input_docx_path, media_dir, mathml)
     if save_md:
         try:
             with open(md_path, 'w', encoding='utf-8') as f:
@@ -147,63 +159,75 @@ if __name__ == "__main__":
     # test_docx = r"C:\Users\psuma\Downloads\QWHO2502504.docx"  # Path to your test Word document
     # test_docx = r"D:\Projects_External\Intern\WordToPPT\test_files\QWHO2502504.docx"  # Path to your test Word document
     # test_docx = r"D:\Projects_External\Intern\WordToPPT\test_files\passage.docx"  # Path to your test Word document
-    test_docx = sys.argv[1]
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert a DOCX file into question images')
+    parser.add_argument('docx', help='Path to input DOCX file')
+    parser.add_argument('--profile', nargs='?', const='profiles', default=None, metavar='DIR',
+                        help='Write per-stage timing reports (JSON) for this document into DIR (default: profiles)')
+    parser.add_argument('--pstats', action='store_true', help='With --profile, also dump cProfile/pstats files')
+    parser.add_argument('--keep-artifacts', action='store_true',
+                        help='Also write content.md, cleaned.md, cleaned.json and visuals.json to the output directory for debugging')
+    parser.add_argument('--preview', nargs='?', type=int, const=400, default=None, metavar='WIDTH',
+                        help='Render one low-resolution contact sheet per section (questions WIDTH px wide, default 400) for a quick check')
+    parser.add_argument('--sprites', nargs='?', type=int, const=4096, default=None, metavar='SIZE',
+                        help='Pack the questions of each section into sprite sheets of at most SIZE px (default 4096) with a JSON index')
+    args = parser.parse_args()
+    test_docx = args.docx
+    if args.profile:
+        profile_dir = os.path.join(args.profile, os.path.splitext(os.path.basename(test_docx))[0])
+        profiling.enable(profile_dir, 'pipeline', pstats=args.pstats,
+                         meta={'document': os.path.basename(test_docx), 'variant': os.path.basename(os.path.dirname(os.path.abspath(__file__)))})
     
     test_output_dir = "output_test"
     try:
-        md_content, md_path, media_dir, extracted_images = convert_docx_to_markdown(
-            test_docx, test_output_dir,
-            extract_media=True, mathml=True, save_md=True,
-            extract_images=True
-        )
-        print(f"Conversion successful! Markdown (header excluded) saved at: {md_path}")
+        # Stages hand their results on in memory; files are only written for debugging
+        keep_artifacts = artifacts.keep_requested(args.keep_artifacts)
+        visuals = extract_docx_visuals(test_docx, test_output_dir, save=keep_artifacts)
+        md_path = os.path.join(test_output_dir, "content.md")
+        md_content = docx_to_markdown_text(test_docx, mathml=True)
+        if keep_artifacts:
+            artifacts.write_text(md_path, md_content)
+            print(f"Conversion successful! Markdown (header excluded) saved at: {md_path}")
         # Remove tables from Markdown before cleaning
         from md_cleaner import clean_markdown_content, remove_markdown_tables
-        md_content_no_tables = remove_markdown_tables(md_content)
-        cleaned_md_path = os.path.join(test_output_dir, "cleaned.md")
-        cleaned_content = clean_markdown_content(
-            md_content_no_tables,
-            save_json=False,  # Only clean, don't generate JSON here
-            cleaned_md_path=cleaned_md_path
-        )
-        with open(cleaned_md_path, 'w', encoding='utf-8') as f:
-            f.write(cleaned_content)
-        print(f"Cleaned markdown saved at: {cleaned_md_path}")
+        with progress.stage('clean'):
+            md_content_no_tables = remove_markdown_tables(md_content)
+            cleaned_md_path = os.path.join(test_output_dir, "cleaned.md")
+            cleaned_content = clean_markdown_content(
+                md_content_no_tables,
+                save_json=False,  # Only clean, don't generate JSON here
+                cleaned_md_path=cleaned_md_path
+            )
+        if keep_artifacts:
+            artifacts.write_text(cleaned_md_path, cleaned_content)
+            print(f"Cleaned markdown saved at: {cleaned_md_path}")
 
-        # Now generate JSON from cleaned markdown with extracted images
-        import json
-        from md_to_json import parse_cleaned_markdown
-        # Try to load visuals_from_extract_images.json if it exists
-        visuals_json_path = os.path.join(os.path.dirname(cleaned_md_path), 'html_extraction', 'visuals_from_extract_images.json')
-        visuals_data = None
-        if os.path.exists(visuals_json_path):
-            try:
-                with open(visuals_json_path, 'r', encoding='utf-8') as vf:
-                    visuals_data = json.load(vf)
-                print(f"Loaded visuals from {visuals_json_path}")
-            except Exception as e:
-                print(f"Failed to load visuals JSON: {e}")
-        # Pass visuals_data to md_to_json if available, else fallback to extracted_images
-        data = parse_cleaned_markdown(cleaned_md_path, visuals_data if visuals_data is not None else extracted_images)
-        json_path = cleaned_md_path.replace('.md', '.json')
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        print(f"JSON data saved at: {json_path}")
+        # Now generate JSON from the cleaned markdown and the extracted visuals
+        from md_to_json import parse_cleaned_markdown_text
+        with progress.stage('parse'):
+            data = parse_cleaned_markdown_text(cleaned_content, visuals, filename=os.path.basename(cleaned_md_path))
+        if keep_artifacts:
+            json_path = cleaned_md_path.replace('.md', '.json')
+            artifacts.write_json(json_path, data)
+            print(f"JSON data saved at: {json_path}")
 
-        # Now generate question images using json_to_question_images.py
+        # Now generate question images in-process with json_to_question_images.main
         try:
-            import subprocess
-            script_path = os.path.join(os.path.dirname(__file__), 'json_to_question_images.py')
+            import json_to_question_images
             # Pass --docxname as --filename (base name without extension)
             base_filename = os.path.splitext(os.path.basename(test_docx))[0] if 'test_docx' in locals() else 'docxfile'
             # Remove leading number and dash (e.g., 1752257752115-QWHO2502504 -> QWHO2502504)
             import re
             clean_base_filename = re.sub(r'^\d{8,}-', '', base_filename)
-            subprocess.run([
-                'python', script_path,
-                '--json', json_path,
+            render_args = [
+                '--media-docx', os.path.abspath(test_docx),
                 '--docxname', base_filename
-            ], check=True)
+            ]
+            if args.preview:
+                render_args += ['--preview', str(args.preview)]
+            if args.sprites:
+                render_args += ['--sprites', str(args.sprites)]
+            json_to_question_images.main(render_args, data=data)
             print(f"Question images generated in: conversions/{clean_base_filename}")
         except Exception as e:
             print(f"Failed to generate question images: {e}")
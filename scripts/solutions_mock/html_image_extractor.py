@@ -1,16 +1,19 @@
 import os
+import sys
 import subprocess
 import re
 import json
 from bs4 import BeautifulSoup
 
-def convert_docx_to_html(docx_path, html_path, media_dir):
-    cmd = [
-        "pandoc", "-s", docx_path, "-o", html_path,
-        f"--extract-media={media_dir}"
-    ]
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import docx_reader, pandoc, profiling
+
+@profiling.timed('convert_docx_to_html')
+def convert_docx_to_html(docx_path):
+    """Pandoc HTML for the DOCX, read from Pandoc's stdout"""
     # Suppress TeX math conversion warnings from pandoc
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = pandoc.pandoc_text(docx_path, 'html')
     if result.stderr:
         filtered = []
         for line in result.stderr.splitlines():
@@ -21,11 +24,12 @@ def convert_docx_to_html(docx_path, html_path, media_dir):
         if filtered:
             raise RuntimeError('\n'.join(filtered))
     if result.returncode != 0:
-        raise subprocess.CalledProcessError(result.returncode, cmd, output=result.stdout, stderr=result.stderr)
+        raise subprocess.CalledProcessError(result.returncode, result.args, stderr=result.stderr)
+    return result.stdout
 
-def extract_visuals_for_solutions(html_path):
-    with open(html_path, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
+@profiling.timed('extract_visuals_for_solutions')
+def extract_visuals_for_solutions(html):
+    soup = BeautifulSoup(html, "html.parser")
     # List of solution visuals
     visuals = []
     # Map tables/images to nearest preceding question number (solution_number)
@@ -59,18 +63,79 @@ def extract_visuals_for_solutions(html_path):
         })
     return visuals
 
+def _preceding_paragraphs(blocks, idx):
+    """Top-level paragraphs before blocks[idx], nearest first (find_previous_sibling over <p>)"""
+    for j in range(idx - 1, -1, -1):
+        if blocks[j].kind == 'p':
+            yield blocks[j]
+
+@profiling.timed('extract_visuals_from_docx')
+def extract_visuals_from_docx(docx_path):
+    """
+    Same visuals as extract_visuals_for_solutions, read from the DOCX structure
+    (common.docx_reader) instead of a Pandoc HTML conversion.
+    """
+    blocks = docx_reader.read_blocks(docx_path)
+    visuals = []
+    # Tables belong to the nearest preceding solution number
+    for idx, block in enumerate(blocks):
+        if block.kind != 'table':
+            continue
+        qnum = next((q for q in map(docx_reader.question_number, _preceding_paragraphs(blocks, idx)) if q is not None), None)
+        visuals.append({
+            "solution_number": qnum,
+            "Table": [block.html],
+            "Image": []
+        })
+    # Images sit inside paragraphs, which never have a numbered sibling of their own
+    for block in blocks:
+        for image in block.images:
+            visuals.append({
+                "solution_number": None,
+                "Table": [],
+                "Image": [docx_reader.img_html(image)]
+            })
+    return visuals
+
 def extract_images_via_html(docx_path, output_dir):
     os.makedirs(output_dir, exist_ok=True)
-    html_path = os.path.join(output_dir, "content.html")
-    media_dir = os.path.join(output_dir, "media")
-    convert_docx_to_html(docx_path, html_path, media_dir)
-    visuals = extract_visuals_for_solutions(html_path)
+    # No --extract-media: images are read from the DOCX by common.docx_media
+    html = convert_docx_to_html(docx_path)
+    visuals = extract_visuals_for_solutions(html)
     # Save visuals to JSON
     visuals_json_path = os.path.join(output_dir, "visuals.json")
     with open(visuals_json_path, "w", encoding="utf-8") as f:
         json.dump(visuals, f, ensure_ascii=False, indent=2)
     return visuals
 
+
+def extract_visuals_via_docx(docx_path, output_dir, save=True):
+    visuals = extract_visuals_from_docx(docx_path)
+    if save:
+        os.makedirs(output_dir, exist_ok=True)
+        visuals_json_path = os.path.join(output_dir, "visuals.json")
+        with open(visuals_json_path, "w", encoding="utf-8") as f:
+            json.dump(visuals, f, ensure_ascii=False, indent=2)
+    return visuals
+
+def extract_visuals(docx_path, output_dir, save=True):
+    """
+    Visuals for a DOCX, read from its structure (also written to visuals.json
+    when save is set). Falls back to the Pandoc HTML extraction, which always
+    writes visuals.json, when DOC2VIZ_VISUALS_READER=html, when the document
+    needs Pandoc (an equation in a table) or when the reader fails.
+    """
+    if docx_reader.visuals_reader() == 'html':
+        return extract_images_via_html(docx_path, output_dir)
+    try:
+        return extract_visuals_via_docx(docx_path, output_dir, save)
+    except docx_reader.NeedsPandoc as e:
+        print(f"[extract_visuals] {e}, using Pandoc HTML")
+        return extract_images_via_html(docx_path, output_dir)
+    except Exception as e:
+        print(f"[extract_visuals] DOCX reader failed ({e}), using Pandoc HTML")
+        return extract_images_via_html(docx_path, output_dir)
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Extract images and tables from DOCX via HTML for Solutions format")
@@ -1,9 +1,17 @@
 import os
+import sys
 import argparse
 import json
 from runpy import run_path
 from PIL import Image, ImageDraw, ImageFont
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import progress, profiling, render_manifest, canvas, encoders, preview, sprites
+
+# Default of DOC2VIZ_OUTPUT_FORMAT for this variant
+OUTPUT_FORMAT = 'png'
+
 def render_text_to_image(text, width=1600, font_path=None, font_size=32, align='justify', margin=60, line_spacing=1.5, bg_color='white', fg_color='black'):
     from textwrap import wrap
     from PIL import Image, ImageDraw, ImageFont
@@ -38,8 +46,8 @@ def render_text_to_image(text, width=1600, font_path=None, font_size=32, align='
     # Calculate image height
     line_height = int(font_size * line_spacing)
     img_height = margin * 2 + line_height * len(wrapped_lines)
-    img = Image.new('RGB', (width, img_height), color=bg_color)
-    draw = ImageDraw.Draw(img)
+    img = canvas.new((width, img_height), color=bg_color)
+    draw = canvas.draw(img)
     
     y = margin
     max_height = img_height - margin  # Maximum y-coordinate before bottom margin
@@ -92,6 +100,7 @@ def render_text_to_image(text, width=1600, font_path=None, font_size=32, align='
     
     return img
 
+@profiling.timed('make_solution_image')
 def make_solution_image(sol, out_path, font_path):
     # Compose text block
     # Format solution and choice with a line break between them
@@ -193,8 +202,8 @@ def make_solution_image(sol, out_path, font_path):
             table_width = sum(col_widths)
             table_height = sum(row_heights)
 
-            table_img = Image.new('RGB', (table_width, table_height), color='white')
-            draw = ImageDraw.Draw(table_img)
+            table_img = canvas.new((table_width, table_height))
+            draw = canvas.draw(table_img)
 
             # Draw grid and text, skipping spanned cells
             y = 0
@@ -225,22 +234,38 @@ def make_solution_image(sol, out_path, font_path):
                 y += row_heights[row_idx]
 
             # Combine table_img with main solution image
-            new_img = Image.new('RGB', (img.width, img.height + table_img.height + 20), color='white')
+            new_img = canvas.new((img.width, img.height + table_img.height + 20))
             new_img.paste(img, (0, 0))
             new_img.paste(table_img, ((img.width - table_img.width) // 2, img.height + 10))
             img = new_img
 
-    img.save(out_path)
+    encoders.current(OUTPUT_FORMAT).save(img, out_path)
 
-def main():
+def main(argv=None, data=None):
+    """Command-line entry point; wordToMD.py calls it in-process with the parsed data"""
     parser = argparse.ArgumentParser(description='Generate solution images from Solutions JSON')
-    parser.add_argument('--json', type=str, required=True, help='Path to Solutions JSON')
+    parser.add_argument('--json', type=str, required=data is None, help='Path to Solutions JSON')
     parser.add_argument('--outdir', type=str, default=None, help='Output directory (default: conversions/<upload_folder> at project root)')
     parser.add_argument('--font', type=str, default=None, help='Font path')
     parser.add_argument('--filename', type=str, default=None, help='Original Word document filename (for folder naming)')
-    args = parser.parse_args()
-    with open(args.json, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    parser.add_argument('--force', action='store_true', help='Re-render every image even if the render manifest says it is up to date')
+    parser.add_argument('--profile', nargs='?', const='profiles', default=None, metavar='DIR', help='Write a timing report (and pstats with --pstats) into DIR')
+    parser.add_argument('--pstats', action='store_true', help='With --profile, also dump a cProfile/pstats file')
+    parser.add_argument('--preview', nargs='?', type=int, const=preview.DEFAULT_WIDTH, default=None, metavar='WIDTH', help='Quick check: one low-resolution contact sheet per section, questions WIDTH px wide (default 400)')
+    parser.add_argument('--sprites', nargs='?', type=int, const=sprites.DEFAULT_SHEET_SIZE, default=None, metavar='SIZE', help='Pack the questions of each section into sprite sheets of at most SIZE px (default 4096) with a JSON index')
+    args = parser.parse_args(argv)
+    # Profiling is either requested directly or inherited from wordToMD.py --profile
+    if args.profile:
+        profiling.enable(args.profile, 'render', pstats=args.pstats)
+    else:
+        profiling.enable_from_env('render')
+    if args.preview:
+        preview.enable(args.preview)
+    if args.sprites:
+        sprites.enable(args.sprites)
+    if data is None:
+        with open(args.json, 'r', encoding='utf-8') as f:
+            data = json.load(f)
     font_path = args.font or os.path.join(os.path.dirname(__file__), '../dejavu-fonts-ttf-2.37/ttf/DejaVuSans.ttf')
     # Use --filename if provided, else fallback to JSON data
     filename = args.filename or data.get('filename', 'default')
@@ -251,28 +276,52 @@ def main():
     outdir = args.outdir or os.path.join(conversions_dir, upload_folder)
     os.makedirs(outdir, exist_ok=True)
     print(f"Images will be saved in: {os.path.abspath(outdir)}")
+    encoder = encoders.current(OUTPUT_FORMAT)
+    # Images whose inputs have not changed since the last upload of this paper are reused
+    manifest = render_manifest.RenderManifest(outdir, __file__, font_path, settings=dict(encoder.settings(), canvas=canvas.setting()))
+    if args.force:
+        manifest.previous = {}
     # Iterate over all sections in the JSON (skip 'filename' key)
     has_sections = any(isinstance(v, list) and section != 'filename' for section, v in data.items())
-    for section, solutions in data.items():
-        if section == 'filename':
-            continue
-        # If there are sections, create a subfolder for each section
-        if has_sections:
-            section_dir = os.path.join(outdir, section)
-            os.makedirs(section_dir, exist_ok=True)
-            target_dir = section_dir
-        else:
-            target_dir = outdir
-        for sol in solutions:
-            snum = sol.get('solution_number', 'unknown')
-            out_path = os.path.join(target_dir, f'solution_{snum}.png')
-            make_solution_image(sol, out_path, font_path)
-            # print(f"Saved: {out_path}")
+    total_solutions = sum(len(v) for section, v in data.items() if section != 'filename' and isinstance(v, list))
+    rendered = 0
+    with progress.stage('render', total=total_solutions):
+        for section, solutions in data.items():
+            if section == 'filename':
+                continue
+            # If there are sections, create a subfolder for each section
+            if has_sections:
+                section_dir = os.path.join(outdir, section)
+                os.makedirs(section_dir, exist_ok=True)
+                target_dir = section_dir
+            else:
+                target_dir = outdir
+            for sol in solutions:
+                snum = sol.get('solution_number', 'unknown')
+                out_path = os.path.join(target_dir, f'solution_{snum}.png')
+                item_hash = manifest.item_hash(sol)
+                image_path = encoder.path_for(out_path)
+                # Paged output rewrites the whole section document, so every item is drawn
+                if encoder.paged or not manifest.is_current(image_path, item_hash):
+                    make_solution_image(sol, out_path, font_path)
+                manifest.record(image_path, item_hash)
+                rendered += 1
+                progress.report('render', rendered, total_solutions)
+                # print(f"Saved: {out_path}")
+        # Section documents and sprite sheets are recorded too, so a run in another format removes them
+        for document_path in encoder.finish():
+            manifest.record(document_path, None)
+
+    manifest.remove_stale()
+    manifest.save()
+    if manifest.reused:
+        print(f"Reused {manifest.reused} unchanged images")
 
     # Zip the upload_folder and print the path
     import shutil
     zip_base = os.path.join(conversions_dir, upload_folder)
-    zip_path = shutil.make_archive(zip_base, 'zip', outdir)
+    with progress.stage('archive'):
+        zip_path = shutil.make_archive(zip_base, 'zip', outdir)
     print("===ZIP===")
     print(zip_path)
 
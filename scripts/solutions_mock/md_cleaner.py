@@ -1,4 +1,12 @@
+import os
 import re
+import sys
+
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import profiling
+
+@profiling.timed('fix_linebreaks')
 def fix_linebreaks(text):
     lines = text.split('\n')
     fixed_lines = []
@@ -19,6 +27,7 @@ def fix_linebreaks(text):
         fixed_lines.append(buffer.strip())
     return '\n'.join(fixed_lines)
 
+@profiling.timed('remove_markdown_tables')
 def remove_markdown_tables(text):
     pattern = re.compile(
         r'''
@@ -34,6 +43,7 @@ def remove_markdown_tables(text):
 import logging
 from pylatexenc.latex2text import LatexNodes2Text
 
+@profiling.timed('strip_image_attributes')
 def strip_image_attributes(md_content):
     """Remove image size attributes from Markdown"""
     # Remove image size attributes from Markdown
@@ -68,6 +78,7 @@ def latex_to_readable(text):
         logging.warning(f"Failed to convert LaTeX: {text}, Error: {e}")
         return text
 
+@profiling.timed('preprocess_latex_content')
 def preprocess_latex_content(md_content):
     def latex_exclude_numbers(match):
         content = match.group(1)
@@ -82,6 +93,7 @@ def preprocess_latex_content(md_content):
     md_content = re.sub(r'\\text\{cm\}\^3', r'cm^3', md_content)
     return md_content
 
+@profiling.timed('convert_underline_syntax')
 def convert_underline_syntax(md_content):
     md_content = re.sub(r'\*{1,2}\[([^\]]+)\]\{\.underline\}\*{1,2}', 
                         lambda m: f'<u>[{m.group(1)}]</u>', md_content)
@@ -101,6 +113,7 @@ def convert_underline_syntax(md_content):
                         lambda m: f'<u>{m.group(1).strip()}</u>', md_content)
     return md_content
 
+@profiling.timed('clean_markdown_content')
 def clean_markdown_content(md_content, process_latex=True, process_underlines=True, save_json=False, cleaned_md_path=None):
     # --- Robust recursive LaTeX fraction handler using brace matching ---
     def parse_nested_latex_fraction(s):
@@ -1,11 +1,20 @@
 import os
 import re
+import sys
 import json
 
+# Shared helpers live in scripts/common
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common import profiling
+
 def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
     with open(cleaned_md_path, 'r', encoding='utf-8') as f:
         content = f.read()
+    return parse_cleaned_markdown_text(content, extracted_images, os.path.basename(cleaned_md_path))
 
+@profiling.timed('parse_cleaned_markdown')
+def parse_cleaned_markdown_text(content, visuals=None, filename='cleaned.md'):
+    """Parse cleaned Markdown text; visuals are the visuals.json entries (keyed by solution_number)"""
     # Find all section headers (e.g., <strong>TEST -- I</strong> or <strong>Solutions</strong>)
     section_pattern = re.compile(r'<strong>\s*(TEST\s*[-–]+\s*[IVX1-9]+|Solutions)\s*</strong>', re.IGNORECASE)
     section_matches = list(section_pattern.finditer(content))
@@ -29,10 +38,10 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
         # Find all solution blocks robustly: <strong>n.</strong> ... Choice (x) (may have <strong> tags in choice)
         solution_split = re.split(r'(<strong>\d+\.</strong>)', section_content)
         solutions = []
-        # Prepare visuals mapping if extracted_images/visuals are provided
+        # Prepare visuals mapping if visuals are provided
         visuals_map = {}
-        if extracted_images:
-            for v in extracted_images:
+        if visuals:
+            for v in visuals:
                 qnum = v.get('solution_number')
                 if qnum is not None:
                     try:
@@ -84,6 +93,6 @@ def parse_cleaned_markdown(cleaned_md_path, extracted_images=None):
         all_sections[section_label] = solutions
 
     return {
-        'filename': os.path.basename(cleaned_md_path),
+        'filename': filename,
         **all_sections
     }
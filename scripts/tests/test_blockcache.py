@@ -0,0 +1,47 @@
+from PIL import Image
+
+from common import blockcache
+
+
+def _block(width, height=10):
+    return Image.new('L', (width, height), 'white')
+
+
+def test_hits_return_the_cached_entry():
+    cache = blockcache.BlockCache(10000)
+    calls = []
+
+    def render():
+        calls.append(1)
+        return _block(10), 'extra'
+
+    first = cache.get_or_render('a', render)
+    assert cache.get_or_render('a', render) is first
+    assert (len(calls), cache.hits, cache.misses) == (1, 1, 1)
+
+
+def test_least_recently_used_is_evicted_over_budget():
+    # 100 bytes per block, room for two
+    cache = blockcache.BlockCache(250)
+    cache.get_or_render('a', lambda: (_block(10), None))
+    cache.get_or_render('b', lambda: (_block(10), None))
+    cache.get_or_render('a', lambda: (_block(10), None))
+    cache.get_or_render('c', lambda: (_block(10), None))
+    assert len(cache) == 2
+    misses = cache.misses
+    cache.get_or_render('a', lambda: (_block(10), None))
+    assert cache.misses == misses
+    cache.get_or_render('b', lambda: (_block(10), None))
+    assert cache.misses == misses + 1
+
+
+def test_entries_larger_than_the_budget_are_not_kept():
+    cache = blockcache.BlockCache(50)
+    img, _ = cache.get_or_render('big', lambda: (_block(10), None))
+    assert img.size == (10, 10)
+    assert len(cache) == 0
+
+
+def test_budget_from_environment(monkeypatch):
+    monkeypatch.setenv(blockcache.BLOCK_CACHE_MB_ENV, '2')
+    assert blockcache.BlockCache().max_bytes == 2 * 1024 * 1024
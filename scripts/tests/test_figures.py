@@ -0,0 +1,62 @@
+import os
+
+from PIL import Image
+
+from common import docx_media, figures
+
+
+def test_budget_from_environment(monkeypatch):
+    monkeypatch.setenv(figures.FIGURE_CACHE_MB_ENV, '0.5')
+    assert figures.FigureCache().max_bytes == 512 * 1024
+
+
+def _touch(path, color, size=(40, 30), mtime_step=0):
+    Image.new('RGB', size, color).save(str(path))
+    if mtime_step:
+        st = os.stat(str(path))
+        os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + mtime_step * 10 ** 9))
+
+
+def test_source_key_follows_file_mtime(tmp_path, monkeypatch):
+    monkeypatch.setattr(docx_media, '_current', None)
+    path = tmp_path / 'figure.png'
+    _touch(path, 'red')
+    key = figures.source_key(str(path), [str(path)])
+    assert key == figures.source_key(str(path), [str(path)])
+    _touch(path, 'red', mtime_step=5)
+    assert figures.source_key(str(path), [str(path)]) != key
+    assert figures.source_key('gone.png', [str(tmp_path / 'gone.png')]) is None
+
+
+def test_figure_cache_redecodes_a_changed_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(docx_media, '_current', None)
+    path = tmp_path / 'figure.png'
+    _touch(path, 'red')
+    cache = figures.FigureCache(10 * 1024 * 1024)
+    fit = figures.Fit(None, None, None, None)
+
+    first = figures.prepare_figure(str(path), [str(path)], fit, trim=False, cache=cache)
+    assert figures.prepare_figure(str(path), [str(path)], fit, trim=False, cache=cache) is first
+    assert first.getpixel((0, 0)) == (255, 0, 0)
+
+    _touch(path, 'blue', size=(60, 30), mtime_step=5)
+    second = figures.prepare_figure(str(path), [str(path)], fit, trim=False, cache=cache)
+    assert second is not first
+    assert second.size == (60, 30)
+    assert second.getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_figure_cache_keys_on_fit_and_trim(tmp_path, monkeypatch):
+    monkeypatch.setattr(docx_media, '_current', None)
+    path = tmp_path / 'figure.png'
+    img = Image.new('RGB', (200, 100), 'white')
+    img.paste((0, 0, 0), (50, 25, 150, 75))
+    img.save(str(path))
+    cache = figures.FigureCache(10 * 1024 * 1024)
+
+    small = figures.prepare_figure(str(path), [str(path)], figures.Fit(None, 100, None, None), trim=False, cache=cache)
+    large = figures.prepare_figure(str(path), [str(path)], figures.Fit(None, 180, None, None), trim=False, cache=cache)
+    trimmed = figures.prepare_figure(str(path), [str(path)], figures.Fit(None, 180, None, None), trim=True, cache=cache)
+    assert (small.width, large.width) == (100, 180)
+    assert trimmed.size == (100 + 2 * 4, 50 + 2 * 4)
+    assert len(cache) == 3
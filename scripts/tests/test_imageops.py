@@ -0,0 +1,71 @@
+from PIL import Image
+
+from common import imageops
+
+
+def _with_dot(color, size=(40, 30), box=(10, 12, 14, 15), mode='RGB', background='white'):
+    img = Image.new(mode, size, background)
+    img.paste(color, box)
+    return img
+
+
+def test_all_white_image_is_returned_unchanged():
+    img = Image.new('RGB', (50, 20), 'white')
+    assert imageops.content_bbox(img) is None
+    assert imageops.trim(img) is img
+
+
+def test_uniform_non_white_image_counts_as_blank():
+    # The background is taken from the top-left pixel
+    img = Image.new('L', (30, 30), 90)
+    assert imageops.trim(img) is img
+
+
+def test_trim_keeps_padding_around_content():
+    trimmed = imageops.trim(_with_dot((0, 0, 0)), padding=2)
+    assert trimmed.size == (4 + 4, 3 + 4)
+
+
+def test_padding_is_clamped_at_the_edges():
+    img = _with_dot((0, 0, 0), box=(37, 27, 40, 30))
+    assert imageops.trim(img, padding=5).size == (8, 8)
+
+
+def test_difference_at_tolerance_is_background():
+    tolerance = imageops.DEFAULT_TOLERANCE
+    value = 255 - tolerance
+    img = _with_dot((value, value, value))
+    assert imageops.content_bbox(img, tolerance) is None
+    assert imageops.trim(img, tolerance=tolerance) is img
+
+
+def test_difference_above_tolerance_is_content():
+    tolerance = imageops.DEFAULT_TOLERANCE
+    value = 255 - tolerance - 1
+    assert imageops.content_bbox(_with_dot((value, 255, 255)), tolerance) == (10, 12, 14, 15)
+
+
+def test_zero_tolerance_keeps_faint_pixels():
+    assert imageops.content_bbox(_with_dot((254, 255, 255)), tolerance=0) == (10, 12, 14, 15)
+
+
+def test_fully_transparent_pixels_are_background():
+    img = Image.new('RGBA', (20, 20), (255, 255, 255, 255))
+    img.paste((0, 0, 0, 0), (2, 2, 6, 6))
+    assert imageops.content_bbox(img) is None
+    img.paste((0, 0, 0, 255), (8, 9, 10, 11))
+    assert imageops.content_bbox(img) == (8, 9, 10, 11)
+
+
+def test_explicit_background():
+    img = _with_dot((0, 0, 0), background=(200, 200, 200))
+    assert imageops.content_bbox(img, background=(200, 200, 200)) == (10, 12, 14, 15)
+    # Against white, the whole grey page is content
+    assert imageops.content_bbox(img, background=(255, 255, 255)) == (0, 0, 40, 30)
+
+
+def test_is_grayscale_respects_tolerance():
+    tolerance = imageops.DEFAULT_TOLERANCE
+    assert imageops.is_grayscale(_with_dot((100, 100 + tolerance, 100)), tolerance)
+    assert not imageops.is_grayscale(_with_dot((100, 100 + tolerance + 1, 100)), tolerance)
+    assert imageops.is_grayscale(Image.new('L', (4, 4)))
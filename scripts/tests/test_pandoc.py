@@ -0,0 +1,82 @@
+import os
+import subprocess
+
+import pytest
+
+from common import pandoc, pandoc_server
+
+
+@pytest.fixture
+def docx(tmp_path, monkeypatch):
+    monkeypatch.setenv(pandoc.CACHE_DIR_ENV, str(tmp_path / 'cache'))
+    monkeypatch.delenv(pandoc.CACHE_ENV, raising=False)
+    monkeypatch.delenv(pandoc_server.SERVER_URL_ENV, raising=False)
+    monkeypatch.setattr(pandoc, '_version', 'pandoc 3.9')
+    path = tmp_path / 'paper.docx'
+    path.write_bytes(b'docx bytes')
+    return path
+
+
+def _fake_pandoc(monkeypatch, returncode=0):
+    """Stands in for the CLI: extracts one image and links it from the output"""
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        media = [arg.split('=', 1)[1] for arg in cmd if arg.startswith('--extract-media=')]
+        text = 'converted'
+        if media:
+            os.makedirs(os.path.join(media[0], 'media'), exist_ok=True)
+            with open(os.path.join(media[0], 'media', 'image1.png'), 'wb') as f:
+                f.write(b'pixels')
+            text += f' <img src="{media[0]}/media/image1.png">'
+        return subprocess.CompletedProcess(cmd, returncode, text, 'a warning\n')
+
+    monkeypatch.setattr(pandoc.subprocess, 'run', run)
+    return calls
+
+
+def test_cache_key_covers_document_format_media_and_flags(docx, tmp_path, monkeypatch):
+    key = pandoc.cache_key(str(docx), 'html', None, ['--mathml'])
+    assert pandoc.cache_key(str(docx), 'html', None, ['--mathml']) == key
+    assert pandoc.cache_key(str(docx), 'markdown', None, ['--mathml']) != key
+    assert pandoc.cache_key(str(docx), 'html', str(tmp_path / 'media'), ['--mathml']) != key
+    assert pandoc.cache_key(str(docx), 'html', None, []) != key
+    monkeypatch.setattr(pandoc, '_version', 'pandoc 3.10')
+    assert pandoc.cache_key(str(docx), 'html', None, ['--mathml']) != key
+    monkeypatch.setattr(pandoc, '_version', 'pandoc 3.9')
+    other = tmp_path / 'other.docx'
+    other.write_bytes(b'other bytes')
+    assert pandoc.cache_key(str(other), 'html', None, ['--mathml']) != key
+
+
+def test_hit_restores_output_media_and_messages(docx, tmp_path, monkeypatch):
+    calls = _fake_pandoc(monkeypatch)
+    first_media = str(tmp_path / 'upload1')
+    first = pandoc.pandoc_text(str(docx), 'html', media_dir=first_media)
+    assert len(calls) == 1
+
+    # A later upload extracts into a directory of its own
+    second_media = str(tmp_path / 'upload2')
+    second = pandoc.pandoc_text(str(docx), 'html', media_dir=second_media)
+    assert len(calls) == 1
+    assert second.returncode == 0
+    assert second.stdout == first.stdout.replace(first_media, second_media)
+    assert second.stderr == 'a warning\n'
+    with open(os.path.join(second_media, 'media', 'image1.png'), 'rb') as f:
+        assert f.read() == b'pixels'
+
+
+def test_failed_runs_are_not_cached(docx, monkeypatch):
+    calls = _fake_pandoc(monkeypatch, returncode=1)
+    assert pandoc.pandoc_text(str(docx), 'html').returncode == 1
+    assert pandoc.pandoc_text(str(docx), 'html').returncode == 1
+    assert len(calls) == 2
+
+
+def test_cache_can_be_disabled(docx, monkeypatch):
+    monkeypatch.setenv(pandoc.CACHE_ENV, '0')
+    calls = _fake_pandoc(monkeypatch)
+    pandoc.pandoc_text(str(docx), 'html')
+    pandoc.pandoc_text(str(docx), 'html')
+    assert len(calls) == 2
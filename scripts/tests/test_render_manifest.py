@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from common import render_manifest
+
+
+@pytest.fixture
+def job(tmp_path):
+    outdir = tmp_path / 'paper'
+    outdir.mkdir()
+    renderer = tmp_path / 'renderer.py'
+    renderer.write_text('# renderer v1\n')
+    font = tmp_path / 'font.ttf'
+    font.write_bytes(b'font v1')
+    return outdir, renderer, font
+
+
+def _manifest(job, settings=None):
+    outdir, renderer, font = job
+    return render_manifest.RenderManifest(str(outdir), str(renderer), str(font), settings=settings)
+
+
+def _render(job, manifest, name, item):
+    """One pass of a renderer's loop; True if the item had to be drawn"""
+    path = os.path.join(str(job[0]), name)
+    item_hash = manifest.item_hash(item)
+    drawn = not manifest.is_current(path, item_hash)
+    if drawn:
+        with open(path, 'w') as f:
+            f.write('image')
+    manifest.record(path, item_hash)
+    return drawn
+
+
+def _run(job, items, settings=None):
+    manifest = _manifest(job, settings)
+    drawn = [name for name, item in items.items() if _render(job, manifest, name, item)]
+    manifest.remove_stale()
+    manifest.save()
+    return drawn, manifest
+
+
+def _bump(path, text):
+    # A new size and mtime, so the memoized digest is not reused
+    path.write_text(text)
+    st = os.stat(str(path))
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+ITEMS = {'question_1.png': {'Question': 'One'}, 'question_2.png': {'Question': 'Two'}}
+
+
+def test_unchanged_items_are_reused(job):
+    assert _run(job, ITEMS)[0] == list(ITEMS)
+    drawn, manifest = _run(job, ITEMS)
+    assert drawn == []
+    assert manifest.reused == 2
+
+
+def test_only_changed_items_are_drawn(job):
+    _run(job, ITEMS)
+    changed = dict(ITEMS, **{'question_2.png': {'Question': 'Two, fixed'}})
+    assert _run(job, changed)[0] == ['question_2.png']
+
+
+def test_settings_invalidate_every_item(job):
+    _run(job, ITEMS, settings={'format': 'png'})
+    assert _run(job, ITEMS, settings={'format': 'jpeg'})[0] == list(ITEMS)
+
+
+def test_renderer_change_invalidates_every_item(job):
+    _run(job, ITEMS)
+    _bump(job[1], '# renderer v2, edited\n')
+    assert _run(job, ITEMS)[0] == list(ITEMS)
+
+
+def test_font_change_invalidates_every_item(job):
+    _run(job, ITEMS)
+    _bump(job[2], 'font v2, edited')
+    assert _run(job, ITEMS)[0] == list(ITEMS)
+
+
+def test_common_modules_are_part_of_the_salt(job, monkeypatch):
+    _run(job, ITEMS)
+    monkeypatch.setattr(render_manifest, 'common_digest', lambda: 'edited')
+    assert _run(job, ITEMS)[0] == list(ITEMS)
+
+
+def test_missing_output_is_drawn_again(job):
+    _run(job, ITEMS)
+    os.remove(os.path.join(str(job[0]), 'question_1.png'))
+    assert _run(job, ITEMS)[0] == ['question_1.png']
+
+
+def test_removed_items_are_deleted(job):
+    _run(job, ITEMS)
+    _run(job, {'question_1.png': ITEMS['question_1.png']})
+    assert not os.path.exists(os.path.join(str(job[0]), 'question_2.png'))
+    assert os.path.exists(os.path.join(str(job[0]), 'question_1.png'))
+
+
+def test_image_entries_hash_by_content_not_path(job, tmp_path):
+    first = tmp_path / 'upload1' / 'media' / 'image1.png'
+    second = tmp_path / 'upload2' / 'media' / 'image1.png'
+    for path in (first, second):
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b'same pixels')
+    manifest = _manifest(job)
+    assert manifest.item_hash({'Image': [str(first)]}) == manifest.item_hash({'Image': [str(second)]})
+    _bump(second, 'other pixels')
+    assert manifest.item_hash({'Image': [str(first)]}) != manifest.item_hash({'Image': [str(second)]})
+
+
+def test_unreadable_manifest_starts_fresh(job):
+    _run(job, ITEMS)
+    with open(render_manifest.manifest_path_for(str(job[0])), 'w') as f:
+        f.write('{not json')
+    assert _run(job, ITEMS)[0] == list(ITEMS)
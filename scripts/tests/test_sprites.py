@@ -0,0 +1,99 @@
+import json
+import os
+
+from PIL import Image
+
+from common import sprites
+
+
+class _Encoder(object):
+    extension = '.png'
+
+    def __init__(self):
+        self.written = []
+
+    def encode(self, img, path):
+        self.written.append((os.path.basename(path), img.size))
+        img.save(path)
+
+
+def test_skyline_places_bottom_left():
+    packer = sprites.Skyline(100, 100)
+    assert packer.place(40, 30) == (0, 0)
+    assert packer.place(40, 10) == (40, 0)
+    # The lowest spot that fits is next to the short rectangle
+    assert packer.place(20, 10) == (80, 0)
+    assert packer.place(20, 10) == (40, 10)
+    assert packer.height == 30
+
+
+def test_skyline_rejects_oversize_rectangles():
+    packer = sprites.Skyline(100, 50)
+    assert packer.place(101, 10) is None
+    assert packer.place(10, 51) is None
+    # A rejected rectangle leaves the sheet untouched
+    assert packer.segments == [(0, 0, 100)]
+    assert packer.height == 0
+
+
+def test_skyline_reports_full_sheet():
+    packer = sprites.Skyline(100, 50)
+    assert packer.place(100, 40) == (0, 0)
+    assert packer.place(50, 20) is None
+    assert packer.place(50, 10) == (0, 40)
+
+
+def test_skyline_merges_segments_at_the_same_height():
+    packer = sprites.Skyline(90, 100)
+    for _ in range(3):
+        packer.place(30, 10)
+    assert packer.segments == [(0, 10, 90)]
+
+
+def test_oversize_sprite_gets_a_sheet_of_its_own(tmp_path):
+    encoder = _Encoder()
+    section = sprites.SpriteSection(str(tmp_path), encoder, 300)
+    section.add(Image.new('L', (100, 80), 'white'), 'question_1')
+    section.add(Image.new('L', (120, 500), 'white'), 'question_2')
+    section.add(Image.new('L', (100, 80), 'white'), 'question_3')
+    paths = section.close()
+
+    items = section.items
+    assert items['question_1']['sheet'] == 'sprites_1.png'
+    assert items['question_2']['sheet'] == 'sprites_2.png'
+    assert (items['question_2']['width'], items['question_2']['height']) == (120, 500)
+    # The tall question's sheet grows to hold it instead of cropping it, and
+    # later questions fill the room beside it
+    sizes = dict(encoder.written)
+    assert sizes['sprites_2.png'][1] >= 500
+    assert items['question_3']['sheet'] == 'sprites_2.png'
+    assert items['question_3']['x'] >= 120
+
+    with open(os.path.join(str(tmp_path), sprites.INDEX_NAME), encoding='utf-8') as f:
+        index = json.load(f)
+    assert index['sheets'] == ['sprites_1.png', 'sprites_2.png']
+    assert sorted(os.path.basename(p) for p in paths) == sorted(index['sheets'] + [sprites.INDEX_NAME])
+
+
+def test_sprites_do_not_overlap(tmp_path):
+    section = sprites.SpriteSection(str(tmp_path), _Encoder(), 256)
+    for i, height in enumerate([40, 90, 25, 60, 70, 30, 55]):
+        section.add(Image.new('L', (60, height), 'white'), f'question_{i}')
+    section.close()
+    boxes = {}
+    for item in section.items.values():
+        boxes.setdefault(item['sheet'], []).append(
+            (item['x'], item['y'], item['x'] + item['width'], item['y'] + item['height']))
+    for sheet in boxes.values():
+        for i, a in enumerate(sheet):
+            for b in sheet[i + 1:]:
+                assert a[2] <= b[0] or b[2] <= a[0] or a[3] <= b[1] or b[3] <= a[1]
+
+
+def test_sheet_size_setting(monkeypatch):
+    monkeypatch.setenv(sprites.SPRITES_ENV, '0')
+    assert not sprites.enabled()
+    monkeypatch.setenv(sprites.SPRITES_ENV, '1')
+    assert sprites.sheet_size() == sprites.DEFAULT_SHEET_SIZE
+    monkeypatch.setenv(sprites.SPRITES_ENV, '100')
+    assert sprites.sheet_size() == 256
@@ -0,0 +1,92 @@
+from PIL import Image
+
+from common import wkhtml
+
+
+def _page(heights, width=120, marker_width=None, rows=None):
+    """
+    A batch page as wkhtmltoimage paints it: each table block in its own
+    grey, followed by a marker band across marker_width columns
+    """
+    marker_width = marker_width or width
+    img = Image.new('RGB', (width, sum(heights) + wkhtml.MARKER_HEIGHT * len(heights)), 'white')
+    y = 0
+    for i, height in enumerate(heights):
+        img.paste((10 * (i + 1),) * 3, (wkhtml.BLOCK_PADDING, y, width, y + height))
+        y += height
+        img.paste(wkhtml.MARKER_RGB, (0, y, marker_width, y + wkhtml.MARKER_HEIGHT))
+        y += wkhtml.MARKER_HEIGHT
+    if rows is not None:
+        img = img.crop((0, 0, width, rows))
+    return img
+
+
+def _fake_wkhtml(monkeypatch, page):
+    calls = []
+
+    def render_page(html, width, quality=90):
+        calls.append(html)
+        if 'doc2viz-table-' in html:
+            if isinstance(page, Exception):
+                raise page
+            return page
+        return Image.new('RGB', (width, 5), 'white')
+
+    monkeypatch.setattr(wkhtml, 'render_page', render_page)
+    return calls
+
+
+def test_batch_is_sliced_between_marker_bands(monkeypatch):
+    _fake_wkhtml(monkeypatch, _page([20, 35, 10]))
+    slices = wkhtml.render_batch(['<a>', '<b>', '<c>'], 120, '')
+    assert [img.size for img in slices] == [(120, 20), (120, 35), (120, 10)]
+    # Each slice holds its own block and no marker rows
+    assert [img.getpixel((60, 0)) for img in slices] == [(10,) * 3, (20,) * 3, (30,) * 3]
+
+
+def test_table_wider_than_the_page_keeps_its_full_width(monkeypatch):
+    # The marker divs span only the requested width; the image grows past it
+    _fake_wkhtml(monkeypatch, _page([20, 15], width=300, marker_width=120))
+    slices = wkhtml.render_batch(['<a>', '<b>'], 120, '')
+    assert [img.size for img in slices] == [(300, 20), (300, 15)]
+
+
+def test_marker_coloured_table_content_is_not_a_band(monkeypatch):
+    page = _page([30, 10])
+    # A magenta cell inside the table, clear of the block padding
+    page.paste(wkhtml.MARKER_RGB, (wkhtml.BLOCK_PADDING, 5, 120, 10))
+    _fake_wkhtml(monkeypatch, page)
+    slices = wkhtml.render_batch(['<a>', '<b>'], 120, '')
+    assert [img.size for img in slices] == [(120, 30), (120, 10)]
+
+
+def test_tables_the_page_did_not_deliver_are_none(monkeypatch):
+    # Cut off inside the second block, as when WebKit stops painting
+    _fake_wkhtml(monkeypatch, _page([20, 30], rows=30))
+    slices = wkhtml.render_batch(['<a>', '<b>'], 120, '')
+    assert slices[0].size == (120, 20)
+    assert slices[1] is None
+
+    _fake_wkhtml(monkeypatch, RuntimeError('wkhtmltoimage failed'))
+    assert wkhtml.render_batch(['<a>', '<b>'], 120, '') == [None, None]
+
+
+def test_renderer_batches_registered_tables_and_releases_them(monkeypatch):
+    calls = _fake_wkhtml(monkeypatch, _page([20, 35]))
+    renderer = wkhtml.TableRenderer('', 120)
+    renderer.prefetch(['<a>', '<b>'])
+    renderer.prefetch(['<a>'])
+
+    first = renderer.render('<a>')
+    assert len(calls) == 1
+    # Still registered once more, so the batch image stays and callers get a copy
+    assert renderer._images['<a>'] is not first
+    assert renderer.render('<a>').size == (120, 20)
+    assert '<a>' not in renderer._images
+    assert renderer.render('<b>').size == (120, 35)
+    assert renderer._images == {}
+    assert len(calls) == 1
+
+    # Unregistered tables are rendered on a page of their own
+    assert renderer.render('<c>').size == (120, 5)
+    assert len(calls) == 2 and 'doc2viz-table-' not in calls[1]
@@ -26,6 +26,7 @@ echo.
 echo Installing Python dependencies...
 python -m pip install --upgrade pip
 python -m pip install Pillow>=8.0.0
+python -m pip install numpy>=1.20
 python -m pip install beautifulsoup4>=4.9.0
 python -m pip install imgkit>=1.2.0
 python -m pip install mammoth>=1.4.0
@@ -0,0 +1,34 @@
+import { NextRequest, NextResponse } from 'next/server';
+import fs from 'fs/promises';
+import path from 'path';
+import { jobQueue } from '@/lib/job-queue';
+
+export async function GET(_request: NextRequest, { params }: { params: Promise<{ id: string }> }) {
+  const { id } = await params;
+  const job = jobQueue.get(id);
+  if (!job) {
+    return NextResponse.json({ error: 'Job not found' }, { status: 404 });
+  }
+  if (job.status === 'failed') {
+    return NextResponse.json({ error: job.error || 'Processing failed' }, { status: 500 });
+  }
+  if (job.status !== 'succeeded' || !job.zipPath) {
+    return NextResponse.json({ error: 'Job is not finished yet' }, { status: 409 });
+  }
+
+  let zipBuffer: Buffer;
+  try {
+    zipBuffer = await fs.readFile(job.zipPath);
+  } catch {
+    return NextResponse.json({ error: 'Output file is no longer available' }, { status: 410 });
+  }
+
+  const headers = new Headers();
+  headers.set('Content-Type', 'application/zip');
+  headers.set('Content-Disposition', `attachment; filename="${path.basename(job.zipPath)}"`);
+  headers.set('Cache-Control', 'no-cache, no-store, must-revalidate');
+  headers.set('Pragma', 'no-cache');
+  headers.set('Expires', '0');
+
+  return new NextResponse(zipBuffer, { status: 200, headers });
+}
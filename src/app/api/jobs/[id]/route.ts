@@ -0,0 +1,13 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { jobQueue, serializeJob } from '@/lib/job-queue';
+
+export async function GET(_request: NextRequest, { params }: { params: Promise<{ id: string }> }) {
+  const { id } = await params;
+  const job = jobQueue.get(id);
+  if (!job) {
+    return NextResponse.json({ error: 'Job not found' }, { status: 404 });
+  }
+  return NextResponse.json(serializeJob(job), {
+    headers: { 'Cache-Control': 'no-cache, no-store, must-revalidate' },
+  });
+}
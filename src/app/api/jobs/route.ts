@@ -0,0 +1,52 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { jobQueue, serializeJob } from '@/lib/job-queue';
+import { detectPythonExecutable, resolvePipelineScript } from '@/lib/pipeline';
+
+// Queue a conversion and return immediately; poll GET /api/jobs/<id> for progress
+export async function POST(request: NextRequest) {
+  try {
+    const formData = await request.formData();
+    const file = formData.get('file') as File | null;
+    const category = formData.get('category') as string | null;
+    const questionType = formData.get('questionType') as string | null;
+
+    if (!file) {
+      return NextResponse.json({ error: 'No file uploaded' }, { status: 400 });
+    }
+    if (!category) {
+      return NextResponse.json({ error: 'Category is required' }, { status: 400 });
+    }
+    if (!questionType) {
+      return NextResponse.json({ error: 'Question type is required' }, { status: 400 });
+    }
+
+    const { scriptPath, error: scriptSelectionError } = resolvePipelineScript(category, questionType);
+    if (!scriptPath) {
+      return NextResponse.json({ error: scriptSelectionError }, { status: 400 });
+    }
+
+    try {
+      await detectPythonExecutable();
+    } catch (error) {
+      const errorMessage = error instanceof Error ? error.message : 'Python not found';
+      return NextResponse.json({ error: `Python required: ${errorMessage}` }, { status: 500 });
+    }
+
+    const job = await jobQueue.submit({
+      fileBuffer: Buffer.from(await file.arrayBuffer()),
+      fileName: file.name,
+      category,
+      questionType,
+      scriptPath,
+    });
+
+    return NextResponse.json(serializeJob(job), {
+      status: 202,
+      headers: { Location: `/api/jobs/${job.id}` },
+    });
+  } catch (error) {
+    console.error('Job submission error:', error);
+    const message = error instanceof Error ? error.message : 'Failed to queue job';
+    return NextResponse.json({ error: message }, { status: 500 });
+  }
+}
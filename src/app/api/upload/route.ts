@@ -1,42 +1,28 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { spawn } from 'child_process';
 import fs from 'fs/promises';
 import path from 'path';
 import os from 'os';
-
-// Function to detect available Python executable
-async function detectPythonExecutable(): Promise<string> {
-  const candidates = process.platform === 'win32' 
-    ? ['python', 'py', 'python3'] 
-    : ['python3', 'python'];
-
-  for (const candidate of candidates) {
-    try {
-      const result = await new Promise<boolean>((resolve) => {
-        const testProcess = spawn(candidate, ['--version'], { stdio: 'pipe' });
-        testProcess.on('close', (code) => resolve(code === 0));
-        testProcess.on('error', () => resolve(false));
-        // Set a timeout to avoid hanging
-        setTimeout(() => {
-          testProcess.kill();
-          resolve(false);
-        }, 3000);
-      });
-      
-      if (result) {
-        return candidate;
-      }
-    } catch (error) {
-      continue;
-    }
-  }
-  
-  throw new Error('Python executable not found. Please install Python from https://python.org or Microsoft Store');
+import { detectPythonExecutable, extractZipPath, resolvePipelineScript, runPipeline } from '@/lib/pipeline';
+import { jobQueue } from '@/lib/job-queue';
+import { lookupResult, resultCacheKey, storeResult } from '@/lib/result-cache';
+
+function zipResponse(zipBuffer: Buffer, zipName: string, cacheStatus: 'hit' | 'miss') {
+  const headers = new Headers();
+  headers.set('Content-Type', 'application/zip');
+  headers.set('Content-Disposition', `attachment; filename="${zipName}"`);
+  headers.set('Cache-Control', 'no-cache, no-store, must-revalidate');
+  headers.set('Pragma', 'no-cache');
+  headers.set('Expires', '0');
+  headers.set('X-Doc2Viz-Cache', cacheStatus);
+
+  return new NextResponse(zipBuffer, {
+    status: 200,
+    headers,
+  });
 }
 
 export async function POST(request: NextRequest) {
   let tempFilePath: string | null = null;
-  let zipFilePath: string | null = null;
 
   try {
     const formData = await request.formData();
@@ -54,46 +40,43 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({ error: 'Question type is required' }, { status: 400 });
     }
     
-    // 1. Save uploaded file to a temporary location
     const fileBuffer = Buffer.from(await file.arrayBuffer());
-    const tempDir = os.tmpdir();
     // Use original filename without timestamp for cleaner processing
     const cleanFileName = file.name.replace(/[^\w\s.-]/g, '_'); // Replace special chars
-    const uniqueFileName = `${Date.now()}-${cleanFileName}`;
-    tempFilePath = path.join(tempDir, uniqueFileName);
-    await fs.writeFile(tempFilePath, fileBuffer);
 
     // Determine which Python script to run based on category and questionType
-    let pythonScriptPath: string;
-    
     console.log(`Processing: category=${category}, questionType=${questionType}`);
-    
-    if (category === 'Mock') {
-      if (questionType === 'question') {
-        pythonScriptPath = path.resolve('./scripts/mock_questions/wordToMD.py');
-      } else if (questionType === 'solution') {
-        pythonScriptPath = path.resolve('./scripts/solutions_mock/wordToMD.py');
-      } else {
-        return NextResponse.json({ error: 'Invalid question type for Mock' }, { status: 400 });
-      }
-    } else if (category === 'Section') {
-      if (questionType === 'section, mcq') {
-        pythonScriptPath = path.resolve('./scripts/mcq_section/wordToMD.py');
-      } else if (questionType === 'passage') {
-        pythonScriptPath = path.resolve('./scripts/question_passage/wordToMD.py');
-      } else {
-        return NextResponse.json({ error: 'Invalid question type for Section' }, { status: 400 });
-      }
-    } else {
-      return NextResponse.json({ error: 'Invalid category' }, { status: 400 });
+
+    const { scriptPath: pythonScriptPath, error: scriptSelectionError } = resolvePipelineScript(category, questionType);
+    if (!pythonScriptPath) {
+      return NextResponse.json({ error: scriptSelectionError }, { status: 400 });
     }
     
     console.log(`Selected Python script: ${pythonScriptPath}`);
 
+    // Repeat uploads of an unchanged document are answered from the result cache
+    const cacheKey = await resultCacheKey(fileBuffer, category, questionType, pythonScriptPath);
+    const cached = await lookupResult(cacheKey);
+    if (cached) {
+      console.log(`Result cache hit: ${cleanFileName}`);
+      // Same name as on a miss, which the Python side derives from the upload name
+      const zipName = cached.zipName ?? `${path.parse(cleanFileName).name}.zip`;
+      try {
+        return zipResponse(await fs.readFile(cached.zipPath), zipName, 'hit');
+      } catch (error) {
+        // Evicted between the lookup and the read
+        console.error('Failed to read cached result, converting again:', error);
+      }
+    }
+
+    // 1. Save uploaded file to a temporary location
+    const uniqueFileName = `${Date.now()}-${cleanFileName}`;
+    tempFilePath = path.join(os.tmpdir(), uniqueFileName);
+    await fs.writeFile(tempFilePath, fileBuffer);
+
     // Detect the correct Python executable
-    let pythonExecutable: string;
     try {
-      pythonExecutable = await detectPythonExecutable();
+      await detectPythonExecutable();
     } catch (error) {
       const errorMessage = error instanceof Error ? error.message : 'Python not found';
       return NextResponse.json({ 
@@ -101,82 +84,59 @@ export async function POST(request: NextRequest) {
       }, { status: 500 });
     }
 
-    // Prepare arguments for the script
-    // FIX: Only pass the DOCX file path as argument
-    const scriptArgs = [pythonScriptPath, tempFilePath];
+    // The pipeline writes conversions/<name>, which a queued job for the same file may be writing too
+    const inputPath = tempFilePath;
+    const result = await jobQueue.withNameLock(cleanFileName, async () => {
+      const { exitCode, stdout: scriptOutput, stderr: scriptError, timings } = await runPipeline({
+        scriptPath: pythonScriptPath,
+        inputPath,
+      });
+      console.log('[Pipeline timings]:', JSON.stringify({ fileName: cleanFileName, category, questionType, exitCode, timings }));
 
-    const pythonProcess = spawn(pythonExecutable, scriptArgs);
-    
-    let scriptOutput = '';
-    let scriptError = '';
+      if (exitCode !== 0) {
+        console.error('Python script error:', scriptError);
+        throw new Error(`Processing failed: ${scriptError || 'Unknown error'}`);
+      }
 
-    pythonProcess.stdout.on('data', (data) => {
-      const chunk = data.toString();
-      scriptOutput += chunk;
-      console.log('[Python stdout]:', chunk);
-    });
+      const zipFilePath = extractZipPath(scriptOutput);
+      if (!zipFilePath) {
+        console.error('Invalid zip file path from Python script:', zipFilePath);
+        console.error('Full Python output:', scriptOutput);
+        console.error('Full Python error output:', scriptError);
+        return null;
+      }
 
-    pythonProcess.stderr.on('data', (data) => {
-      const chunk = data.toString();
-      scriptError += chunk;
-      console.error('[Python stderr]:', chunk);
-    });
+      try {
+        // Check if the file exists before attempting to read
+        try {
+            await fs.access(zipFilePath);
+        } catch {
+            throw new Error("Processing failed to create output file");
+        }
 
-    const exitCode = await new Promise<number>((resolve, reject) => {
-      pythonProcess.on('close', resolve);
-      pythonProcess.on('error', reject);
+        // The zip is deleted below, so the cache keeps its own copy
+        await storeResult(cacheKey, zipFilePath, { category, questionType });
+
+        // 3. Read the generated zip file; the original zip name is preserved for the download
+        return { zipBuffer: await fs.readFile(zipFilePath), zipName: path.basename(zipFilePath) };
+      } finally {
+        // The zip is shared by every upload of this paper, so it is removed before the name is released
+        try {
+          if (zipFilePath.endsWith('.zip')) {
+            await fs.unlink(zipFilePath);
+          }
+        } catch (e) {
+          console.error("Failed to delete zip file:", zipFilePath, e);
+        }
+      }
     });
 
-    if (exitCode !== 0) {
-      console.error('Python script error:', scriptError);
-      throw new Error(`Processing failed: ${scriptError || 'Unknown error'}`);
-    }
-    
-    // The Python script prints the path of the generated zip file to the last line of stdout
-    // Extract the actual zip file path from the output, using the marker if present
-    let zipFilePath: string | null = null;
-    const outputLines = scriptOutput.trim().split('\n').map(l => l.trim()).filter(Boolean);
-    const markerIdx = outputLines.findIndex(line => line === '===ZIP===');
-    if (markerIdx !== -1 && outputLines.length > markerIdx + 1) {
-      zipFilePath = outputLines[markerIdx + 1];
-    } else {
-      // Fallback: use last line if marker not found
-      zipFilePath = outputLines[outputLines.length - 1];
-    }
-    // Validate that the zip file path looks correct
-    if (!zipFilePath || !zipFilePath.endsWith('.zip')) {
-      console.error('Invalid zip file path from Python script:', zipFilePath);
-      console.error('Full Python output:', scriptOutput);
-      console.error('Full Python error output:', scriptError);
+    if (!result) {
       return NextResponse.json({
         error: "Processing failed to generate output file"
       }, { status: 500 });
     }
-    
-    // Check if the file exists before attempting to read
-    try {
-        await fs.access(zipFilePath);
-    } catch {
-        throw new Error("Processing failed to create output file");
-    }
-
-    // 3. Read the generated zip file and send it as response
-    const zipBuffer = await fs.readFile(zipFilePath);
-    
-    // Extract the original filename from the zip file path to preserve it
-    const originalZipName = path.basename(zipFilePath);
-    
-    const headers = new Headers();
-    headers.set('Content-Type', 'application/zip');
-    headers.set('Content-Disposition', `attachment; filename="${originalZipName}"`);
-    headers.set('Cache-Control', 'no-cache, no-store, must-revalidate');
-    headers.set('Pragma', 'no-cache');
-    headers.set('Expires', '0');
-
-    return new NextResponse(zipBuffer, {
-      status: 200,
-      headers,
-    });
+    return zipResponse(result.zipBuffer, result.zipName, 'miss');
 
   } catch (error) {
     console.error('Upload error:', error);
@@ -193,14 +153,5 @@ export async function POST(request: NextRequest) {
         console.error("Failed to delete temp file:", tempFilePath, e);
       }
     }
-    if (zipFilePath && typeof zipFilePath === 'string') {
-      try {
-        if ((zipFilePath as string).endsWith('.zip')) {
-          await fs.unlink(zipFilePath);
-        }
-      } catch (e) {
-        console.error("Failed to delete zip file:", zipFilePath, e);
-      }
-    }
   }
 }
@@ -28,6 +28,50 @@ import { useToast } from "@/hooks/use-toast";
 type CategoryType = "Mock" | "Section";
 type QuestionType = "question" | "solution" | "section, mcq" | "passage";
 
+interface JobState {
+  id: string;
+  status: "queued" | "running" | "succeeded" | "failed";
+  progress: { stage: string; completed: number | null; total: number | null };
+  error?: string;
+  downloadUrl?: string;
+}
+
+const STAGE_LABELS: Record<string, string> = {
+  queued: "Waiting in queue...",
+  pandoc: "Converting document...",
+  clean: "Cleaning markdown...",
+  parse: "Parsing questions...",
+  render: "Rendering images...",
+  archive: "Packaging images...",
+  done: "Downloading...",
+};
+
+const JOB_POLL_INTERVAL_MS = 1000;
+
+async function readErrorMessage(response: Response, fallback: string): Promise<string> {
+  try {
+    const contentType = response.headers.get('content-type');
+    if (contentType && contentType.includes('application/json')) {
+      const errorData = await response.json();
+      return errorData.error || fallback;
+    }
+    const errorText = await response.text();
+    return errorText || fallback;
+  } catch (parseError) {
+    console.error("Error parsing response:", parseError);
+    return fallback;
+  }
+}
+
+function describeProgress(job: JobState | null): string {
+  if (!job) return "Uploading...";
+  const label = STAGE_LABELS[job.progress.stage] || "Processing...";
+  if (job.progress.stage === "render" && job.progress.total) {
+    return `Rendering images (${job.progress.completed ?? 0}/${job.progress.total})...`;
+  }
+  return label;
+}
+
 export function UploadForm() {
   const fileInputRef = React.useRef<HTMLInputElement>(null);
   const { toast } = useToast();
@@ -37,6 +81,7 @@ export function UploadForm() {
   const [questionType, setQuestionType] = React.useState<QuestionType | null>(null);
   const [file, setFile] = React.useState<File | null>(null);
   const [isLoading, setIsLoading] = React.useState(false);
+  const [job, setJob] = React.useState<JobState | null>(null);
 
   // --- CATEGORY BUTTONS ---
   const categories = [
@@ -93,27 +138,36 @@ export function UploadForm() {
     
     try {
       console.log("Form data being sent:", Object.fromEntries(formData.entries()));
-      const response = await fetch("/api/upload", {
+      // Queue the conversion; the server answers immediately with a job id
+      const submitResponse = await fetch("/api/jobs", {
         method: "POST",
         body: formData,
       });
-      
-      if (!response.ok) {
-        let errorMessage = `Failed to process file (${response.status})`;
-        
-        try {
-          const contentType = response.headers.get('content-type');
-          if (contentType && contentType.includes('application/json')) {
-            const errorData = await response.json();
-            errorMessage = errorData.error || errorMessage;
-          } else {
-            const errorText = await response.text();
-            errorMessage = errorText || errorMessage;
-          }
-        } catch (parseError) {
-          console.error("Error parsing response:", parseError);
+      if (!submitResponse.ok) {
+        const errorMessage = await readErrorMessage(submitResponse, `Failed to process file (${submitResponse.status})`);
+        console.error("Server error response:", errorMessage);
+        throw new Error(errorMessage);
+      }
+      let currentJob: JobState = await submitResponse.json();
+      setJob(currentJob);
+
+      // Poll the status endpoint until the pipeline finishes
+      while (currentJob.status === "queued" || currentJob.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        const statusResponse = await fetch(`/api/jobs/${currentJob.id}`, { cache: "no-store" });
+        if (!statusResponse.ok) {
+          throw new Error(await readErrorMessage(statusResponse, `Failed to fetch job status (${statusResponse.status})`));
         }
-        
+        currentJob = await statusResponse.json();
+        setJob(currentJob);
+      }
+      if (currentJob.status === "failed") {
+        throw new Error(currentJob.error || "Processing failed");
+      }
+
+      const response = await fetch(currentJob.downloadUrl || `/api/jobs/${currentJob.id}/download`);
+      if (!response.ok) {
+        const errorMessage = await readErrorMessage(response, `Failed to download result (${response.status})`);
         console.error("Server error response:", errorMessage);
         throw new Error(errorMessage);
       }
@@ -151,6 +205,7 @@ export function UploadForm() {
       });
     } finally {
       setIsLoading(false);
+      setJob(null);
     }
   };
 
@@ -254,7 +309,7 @@ export function UploadForm() {
             {isLoading ? (
               <>
                 <LoaderCircle className="mr-2 h-5 w-5 animate-spin" />
-                Processing...
+                {describeProgress(job)}
               </>
             ) : (
               <>
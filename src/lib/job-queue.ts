@@ -0,0 +1,320 @@
+import { randomUUID } from 'crypto';
+import fs from 'fs/promises';
+import path from 'path';
+import os from 'os';
+import { extractZipPath, runPipeline, type PipelineEvent } from '@/lib/pipeline';
+import { lookupResult, resultCacheKey, storeResult } from '@/lib/result-cache';
+
+export type JobStatus = 'queued' | 'running' | 'succeeded' | 'failed';
+export type JobStage = 'queued' | 'pandoc' | 'clean' | 'parse' | 'render' | 'archive' | 'done';
+
+export interface JobProgress {
+  stage: JobStage;
+  // Questions rendered so far / total questions, once the render stage reports them
+  completed: number | null;
+  total: number | null;
+}
+
+export interface Job {
+  id: string;
+  status: JobStatus;
+  progress: JobProgress;
+  fileName: string;
+  category: string;
+  questionType: string;
+  createdAt: number;
+  updatedAt: number;
+  error?: string;
+  zipPath?: string;
+  // Milliseconds spent in each pipeline stage, as reported by the Python progress events
+  timings: Record<string, number>;
+  // True when the result came from the result cache without running the pipeline
+  cached: boolean;
+  // Internal bookkeeping, not exposed through the status endpoint
+  inputPath: string;
+  scriptPath: string;
+  workDir: string;
+  cacheKey: string;
+}
+
+export interface JobSubmission {
+  fileBuffer: Buffer;
+  fileName: string;
+  category: string;
+  questionType: string;
+  scriptPath: string;
+}
+
+// Bounded concurrency: a single instance should not run more Pandoc/wkhtmltoimage pipelines than it has cores for
+const MAX_CONCURRENT_JOBS = Math.max(1, parseInt(process.env.DOC2VIZ_MAX_CONCURRENT_JOBS || '2', 10) || 2);
+// Finished jobs (and their zips) are kept this long so the client can download the result
+const JOB_RETENTION_MS = Math.max(60_000, parseInt(process.env.DOC2VIZ_JOB_RETENTION_MS || '3600000', 10) || 3600000);
+
+// Optional JSON-lines file that receives one per-stage latency record per processed document
+const TIMINGS_LOG = process.env.DOC2VIZ_TIMINGS_LOG || '';
+
+// Python stage names (scripts/common/progress.py) mapped onto the coarser job stages
+const STAGE_MAP: Record<string, JobStage> = {
+  html_extraction: 'pandoc',
+  pandoc: 'pandoc',
+  clean: 'clean',
+  parse: 'parse',
+  render: 'render',
+  archive: 'archive',
+};
+
+class JobQueue {
+  private jobs = new Map<string, Job>();
+  private pending: string[] = [];
+  private running = 0;
+  // File names held by synchronous conversions (withNameLock), and callers waiting for a name
+  private heldNames = new Set<string>();
+  private nameWaiters: Array<() => void> = [];
+
+  get(id: string): Job | undefined {
+    return this.jobs.get(id);
+  }
+
+  async submit(submission: JobSubmission): Promise<Job> {
+    const id = randomUUID();
+    // Each job gets its own working directory: the scripts write output_test/ relative to cwd
+    const workDir = await fs.mkdtemp(path.join(os.tmpdir(), 'doc2viz-job-'));
+    const cleanFileName = submission.fileName.replace(/[^\w\s.-]/g, '_'); // Replace special chars
+    const inputPath = path.join(workDir, `${Date.now()}-${cleanFileName}`);
+    const cacheKey = await resultCacheKey(
+      submission.fileBuffer,
+      submission.category,
+      submission.questionType,
+      submission.scriptPath
+    );
+    const cached = await lookupResult(cacheKey);
+
+    const now = Date.now();
+    const job: Job = {
+      id,
+      status: 'queued',
+      progress: { stage: 'queued', completed: null, total: null },
+      fileName: cleanFileName,
+      category: submission.category,
+      questionType: submission.questionType,
+      createdAt: now,
+      updatedAt: now,
+      timings: {},
+      cached: false,
+      inputPath,
+      scriptPath: submission.scriptPath,
+      workDir,
+      cacheKey,
+    };
+    this.jobs.set(id, job);
+
+    if (cached) {
+      // Serve a private copy: job cleanup deletes zipPath, and the cache may evict its own file meanwhile.
+      // The copy keeps the name the pipeline gave the zip, so downloads are named as on a miss.
+      const zipPath = path.join(workDir, cached.zipName ?? `${path.parse(cleanFileName).name}.zip`);
+      try {
+        await fs.copyFile(cached.zipPath, zipPath);
+        this.update(job, { status: 'succeeded', cached: true, zipPath, progress: { stage: 'done', completed: null, total: null } });
+        this.scheduleCleanup(job);
+        return job;
+      } catch (error) {
+        console.error('Failed to copy cached result, converting again:', error);
+      }
+    }
+
+    await fs.writeFile(inputPath, submission.fileBuffer);
+    this.pending.push(id);
+    this.pump();
+    return job;
+  }
+
+  private pump() {
+    while (this.running < MAX_CONCURRENT_JOBS && this.pending.length > 0) {
+      // Two jobs for the same file name would write into the same conversions/<name> folder,
+      // so skip over those until the running one finishes
+      const idx = this.pending.findIndex((id) => !this.isNameBusy(this.jobs.get(id)!));
+      if (idx === -1) {
+        return;
+      }
+      const [id] = this.pending.splice(idx, 1);
+      const job = this.jobs.get(id);
+      if (!job) {
+        continue;
+      }
+      this.running += 1;
+      this.execute(job)
+        .catch((error) => {
+          this.update(job, {
+            status: 'failed',
+            error: error instanceof Error ? error.message : 'Processing failed',
+          });
+        })
+        .finally(() => {
+          this.running -= 1;
+          this.scheduleCleanup(job);
+          this.wakeNameWaiters();
+          this.pump();
+        });
+    }
+  }
+
+  private isNameBusy(job: Job): boolean {
+    return (
+      this.heldNames.has(job.fileName) ||
+      Array.from(this.jobs.values()).some(
+        (other) => other.id !== job.id && other.status === 'running' && other.fileName === job.fileName
+      )
+    );
+  }
+
+  // Run fn while no job or other synchronous conversion uses fileName, so the sync upload route
+  // and queued jobs never write the same conversions/<name> folder at once
+  async withNameLock<T>(fileName: string, fn: () => Promise<T>): Promise<T> {
+    while (
+      this.heldNames.has(fileName) ||
+      Array.from(this.jobs.values()).some((job) => job.status === 'running' && job.fileName === fileName)
+    ) {
+      await new Promise<void>((resolve) => this.nameWaiters.push(resolve));
+    }
+    this.heldNames.add(fileName);
+    try {
+      return await fn();
+    } finally {
+      this.heldNames.delete(fileName);
+      this.wakeNameWaiters();
+      this.pump();
+    }
+  }
+
+  private wakeNameWaiters() {
+    const waiters = this.nameWaiters;
+    this.nameWaiters = [];
+    waiters.forEach((resolve) => resolve());
+  }
+
+  private async execute(job: Job) {
+    this.update(job, { status: 'running', progress: { stage: 'pandoc', completed: null, total: null } });
+
+    const { exitCode, stdout, stderr, timings } = await runPipeline({
+      scriptPath: job.scriptPath,
+      inputPath: job.inputPath,
+      cwd: job.workDir,
+      onEvent: (event) => this.onEvent(job, event),
+    });
+    this.update(job, { timings });
+    await recordTimings(job, exitCode);
+
+    if (exitCode !== 0) {
+      console.error('Python script error:', stderr);
+      throw new Error(`Processing failed: ${stderr || 'Unknown error'}`);
+    }
+
+    const zipPath = extractZipPath(stdout);
+    if (!zipPath) {
+      console.error('Invalid zip file path from Python script. Full Python output:', stdout);
+      throw new Error('Processing failed to generate output file');
+    }
+    try {
+      await fs.access(zipPath);
+    } catch {
+      throw new Error('Processing failed to create output file');
+    }
+    await storeResult(job.cacheKey, zipPath, { category: job.category, questionType: job.questionType });
+    // conversions/<name>.zip is shared by every upload of the paper and rewritten by the next one,
+    // so the job keeps its own copy under workDir
+    const privateZipPath = path.join(job.workDir, path.basename(zipPath));
+    await moveFile(zipPath, privateZipPath);
+    this.update(job, {
+      status: 'succeeded',
+      zipPath: privateZipPath,
+      progress: { ...job.progress, stage: 'done' },
+    });
+  }
+
+  private onEvent(job: Job, event: PipelineEvent) {
+    const stage = event.stage ? STAGE_MAP[event.stage] : undefined;
+    if (!stage) {
+      return;
+    }
+    if (event.event === 'stage_start') {
+      const total = typeof event.total === 'number' ? event.total : null;
+      this.update(job, { progress: { stage, completed: total === null ? null : 0, total } });
+    } else if (event.event === 'progress') {
+      this.update(job, {
+        progress: {
+          stage,
+          completed: typeof event.completed === 'number' ? event.completed : job.progress.completed,
+          total: typeof event.total === 'number' ? event.total : job.progress.total,
+        },
+      });
+    } else if (event.event === 'stage_end' && event.stage) {
+      this.update(job, { timings: { ...job.timings, [event.stage]: event.duration_ms ?? 0 } });
+    }
+  }
+
+  private update(job: Job, changes: Partial<Job>) {
+    Object.assign(job, changes, { updatedAt: Date.now() });
+  }
+
+  private scheduleCleanup(job: Job) {
+    const timer = setTimeout(async () => {
+      this.jobs.delete(job.id);
+      // zipPath lives under workDir; nothing outside it belongs to the job
+      await fs.rm(job.workDir, { recursive: true, force: true }).catch(() => undefined);
+    }, JOB_RETENTION_MS);
+    // Do not keep the process alive just to expire old jobs
+    timer.unref?.();
+  }
+}
+
+async function moveFile(from: string, to: string) {
+  try {
+    await fs.rename(from, to);
+  } catch (error) {
+    // conversions/ and the temp directory may be on different filesystems
+    if ((error as NodeJS.ErrnoException).code !== 'EXDEV') {
+      throw error;
+    }
+    await fs.copyFile(from, to);
+    await fs.unlink(from);
+  }
+}
+
+async function recordTimings(job: Job, exitCode: number) {
+  const record = {
+    jobId: job.id,
+    fileName: job.fileName,
+    category: job.category,
+    questionType: job.questionType,
+    exitCode,
+    questions: job.progress.total,
+    timings: job.timings,
+    finishedAt: new Date().toISOString(),
+  };
+  console.log('[Pipeline timings]:', JSON.stringify(record));
+  if (TIMINGS_LOG) {
+    await fs.appendFile(TIMINGS_LOG, JSON.stringify(record) + '\n').catch((e) => {
+      console.error('Failed to append pipeline timings:', e);
+    });
+  }
+}
+
+// Keep one queue per server process, even when Next.js re-evaluates route modules in development
+const globalForQueue = globalThis as unknown as { doc2vizJobQueue?: JobQueue };
+export const jobQueue = globalForQueue.doc2vizJobQueue ?? (globalForQueue.doc2vizJobQueue = new JobQueue());
+
+// Public view of a job for the status endpoint
+export function serializeJob(job: Job) {
+  return {
+    id: job.id,
+    status: job.status,
+    progress: job.progress,
+    fileName: job.fileName,
+    createdAt: job.createdAt,
+    updatedAt: job.updatedAt,
+    error: job.error,
+    timings: job.timings,
+    cached: job.cached,
+    downloadUrl: job.status === 'succeeded' ? `/api/jobs/${job.id}/download` : undefined,
+  };
+}
@@ -0,0 +1,84 @@
+import { spawn, type ChildProcess } from 'child_process';
+import http from 'http';
+
+// Optional warm `pandoc server` shared by every pipeline run, so conversions skip the Haskell
+// runtime start-up of a fresh pandoc process. DOC2VIZ_PANDOC_SERVER=1 launches one on
+// DOC2VIZ_PANDOC_SERVER_PORT; DOC2VIZ_PANDOC_SERVER_URL points at a server managed elsewhere.
+// The Python side (scripts/common/pandoc_server.py) falls back to the CLI if it fails.
+const EXTERNAL_URL = process.env.DOC2VIZ_PANDOC_SERVER_URL || null;
+const ENABLED = process.env.DOC2VIZ_PANDOC_SERVER === '1';
+const PORT = parseInt(process.env.DOC2VIZ_PANDOC_SERVER_PORT || '3030', 10) || 3030;
+const COMMAND = (process.env.DOC2VIZ_PANDOC_SERVER_CMD || 'pandoc server').split(/\s+/).filter(Boolean);
+// pandoc server aborts conversions after 2 seconds by default, too short for large papers
+const TIMEOUT_S = process.env.DOC2VIZ_PANDOC_SERVER_TIMEOUT || '60';
+const STARTUP_TIMEOUT_MS = 10_000;
+
+let starting: Promise<string | null> | null = null;
+let server: ChildProcess | null = null;
+
+function ping(url: string): Promise<boolean> {
+  return new Promise((resolve) => {
+    const req = http.get(`${url}/version`, { timeout: 1000 }, (res) => {
+      res.resume();
+      resolve(res.statusCode === 200);
+    });
+    req.on('error', () => resolve(false));
+    req.on('timeout', () => {
+      req.destroy();
+      resolve(false);
+    });
+  });
+}
+
+async function start(): Promise<string | null> {
+  const url = `http://127.0.0.1:${PORT}`;
+  // A server left by an earlier dev-server reload may already be listening
+  if (await ping(url)) {
+    return url;
+  }
+  const child = spawn(COMMAND[0], [...COMMAND.slice(1), '--port', String(PORT), '--timeout', TIMEOUT_S], { stdio: 'ignore' });
+  server = child;
+  let ready = false;
+  let failed = false;
+  child.on('error', (error) => {
+    failed = true;
+    console.warn('pandoc server unavailable, pipelines will use the pandoc CLI:', error.message);
+  });
+  child.on('exit', () => {
+    if (server === child) {
+      server = null;
+      // Restart on the next run if a working server died; a server that never came up is not retried
+      if (ready) {
+        starting = null;
+      }
+    }
+  });
+  const deadline = Date.now() + STARTUP_TIMEOUT_MS;
+  while (!failed && Date.now() < deadline) {
+    if (await ping(url)) {
+      ready = true;
+      return url;
+    }
+    await new Promise((resolve) => setTimeout(resolve, 100));
+  }
+  child.kill();
+  return null;
+}
+
+// URL to hand the pipelines as DOC2VIZ_PANDOC_SERVER_URL, or null when they should run the CLI
+export async function pandocServerUrl(): Promise<string | null> {
+  if (EXTERNAL_URL) {
+    return EXTERNAL_URL;
+  }
+  if (!ENABLED) {
+    return null;
+  }
+  if (!starting) {
+    starting = start();
+  }
+  return starting;
+}
+
+process.on('exit', () => {
+  server?.kill();
+});
@@ -0,0 +1,217 @@
+import { spawn } from 'child_process';
+import path from 'path';
+import { pandocServerUrl } from '@/lib/pandoc-server';
+
+// Maps the upload form's category/questionType pair onto the Python entry point
+export function resolvePipelineScript(category: string, questionType: string): { scriptPath?: string; error?: string } {
+  if (category === 'Mock') {
+    if (questionType === 'question') {
+      return { scriptPath: path.resolve('./scripts/mock_questions/wordToMD.py') };
+    } else if (questionType === 'solution') {
+      return { scriptPath: path.resolve('./scripts/solutions_mock/wordToMD.py') };
+    }
+    return { error: 'Invalid question type for Mock' };
+  } else if (category === 'Section') {
+    if (questionType === 'section, mcq') {
+      return { scriptPath: path.resolve('./scripts/mcq_section/wordToMD.py') };
+    } else if (questionType === 'passage') {
+      return { scriptPath: path.resolve('./scripts/question_passage/wordToMD.py') };
+    }
+    return { error: 'Invalid question type for Section' };
+  }
+  return { error: 'Invalid category' };
+}
+
+let cachedPythonExecutable: string | null = null;
+
+// Function to detect available Python executable
+export async function detectPythonExecutable(): Promise<string> {
+  if (cachedPythonExecutable) {
+    return cachedPythonExecutable;
+  }
+
+  const candidates = process.platform === 'win32'
+    ? ['python', 'py', 'python3']
+    : ['python3', 'python'];
+
+  for (const candidate of candidates) {
+    try {
+      const result = await new Promise<boolean>((resolve) => {
+        const testProcess = spawn(candidate, ['--version'], { stdio: 'pipe' });
+        testProcess.on('close', (code) => resolve(code === 0));
+        testProcess.on('error', () => resolve(false));
+        // Set a timeout to avoid hanging
+        setTimeout(() => {
+          testProcess.kill();
+          resolve(false);
+        }, 3000);
+      });
+
+      if (result) {
+        cachedPythonExecutable = candidate;
+        return candidate;
+      }
+    } catch (error) {
+      continue;
+    }
+  }
+
+  throw new Error('Python executable not found. Please install Python from https://python.org or Microsoft Store');
+}
+
+// JSON-lines event written by scripts/common/progress.py
+export interface PipelineEvent {
+  event: 'stage_start' | 'stage_end' | 'progress' | string;
+  stage?: string;
+  ts?: number;
+  status?: string;
+  duration_ms?: number;
+  completed?: number;
+  total?: number;
+  [key: string]: unknown;
+}
+
+// Extra stdio slot the Python side writes progress events to (see DOC2VIZ_PROGRESS_FD)
+const PROGRESS_FD = 3;
+
+function parseEventLine(line: string): PipelineEvent | null {
+  if (!line.startsWith('{"event"')) {
+    return null;
+  }
+  try {
+    return JSON.parse(line) as PipelineEvent;
+  } catch {
+    return null;
+  }
+}
+
+// Splits a chunked stream into complete lines
+function lineReader(onLine: (line: string) => void) {
+  let pending = '';
+  return {
+    push(chunk: string) {
+      const parts = (pending + chunk).split('\n');
+      pending = parts.pop() ?? '';
+      parts.forEach((line) => onLine(line.trim()));
+    },
+    flush() {
+      if (pending) {
+        onLine(pending.trim());
+        pending = '';
+      }
+    },
+  };
+}
+
+export interface PipelineRunOptions {
+  scriptPath: string;
+  inputPath: string;
+  // Working directory for the script; each job gets its own so output_test/ does not collide
+  cwd?: string;
+  onStdoutLine?: (line: string) => void;
+  onEvent?: (event: PipelineEvent) => void;
+}
+
+export interface PipelineRunResult {
+  exitCode: number;
+  stdout: string;
+  stderr: string;
+  // Wall-clock milliseconds per pipeline stage, from stage_end events
+  timings: Record<string, number>;
+}
+
+export async function runPipeline(options: PipelineRunOptions): Promise<PipelineRunResult> {
+  const pythonExecutable = await detectPythonExecutable();
+
+  // Prepare arguments for the script
+  // FIX: Only pass the DOCX file path as argument
+  const scriptArgs = [options.scriptPath, options.inputPath];
+
+  // Windows cannot hand extra descriptors to the child, so events share stderr there
+  const useEventFd = process.platform !== 'win32';
+  // Pandoc conversions go to a warm pandoc server when one is configured
+  const pandocServer = await pandocServerUrl();
+  const pythonProcess = spawn(pythonExecutable, scriptArgs, {
+    cwd: options.cwd,
+    stdio: useEventFd ? ['ignore', 'pipe', 'pipe', 'pipe'] : ['ignore', 'pipe', 'pipe'],
+    env: {
+      ...process.env,
+      DOC2VIZ_PROGRESS_FD: useEventFd ? String(PROGRESS_FD) : 'stderr',
+      ...(pandocServer ? { DOC2VIZ_PANDOC_SERVER_URL: pandocServer } : {}),
+    },
+  });
+
+  let scriptOutput = '';
+  let scriptError = '';
+  const timings: Record<string, number> = {};
+
+  const handleEvent = (event: PipelineEvent) => {
+    if (event.event === 'stage_end' && event.stage && typeof event.duration_ms === 'number') {
+      timings[event.stage] = (timings[event.stage] ?? 0) + event.duration_ms;
+    }
+    options.onEvent?.(event);
+  };
+
+  const stdoutLines = lineReader((line) => options.onStdoutLine?.(line));
+  const stderrLines = lineReader((line) => {
+    const event = useEventFd ? null : parseEventLine(line);
+    if (event) {
+      handleEvent(event);
+      return;
+    }
+    scriptError += line + '\n';
+  });
+  const eventLines = lineReader((line) => {
+    const event = parseEventLine(line);
+    if (event) {
+      handleEvent(event);
+    }
+  });
+
+  pythonProcess.stdout!.on('data', (data) => {
+    const chunk = data.toString();
+    scriptOutput += chunk;
+    console.log('[Python stdout]:', chunk);
+    stdoutLines.push(chunk);
+  });
+
+  pythonProcess.stderr!.on('data', (data) => {
+    const chunk = data.toString();
+    console.error('[Python stderr]:', chunk);
+    stderrLines.push(chunk);
+  });
+
+  if (useEventFd) {
+    const eventStream = pythonProcess.stdio[PROGRESS_FD] as NodeJS.ReadableStream | null;
+    eventStream?.on('data', (data: Buffer) => eventLines.push(data.toString()));
+  }
+
+  const exitCode = await new Promise<number>((resolve, reject) => {
+    pythonProcess.on('close', (code) => resolve(code ?? 1));
+    pythonProcess.on('error', reject);
+  });
+  stdoutLines.flush();
+  stderrLines.flush();
+  eventLines.flush();
+
+  return { exitCode, stdout: scriptOutput, stderr: scriptError.trim(), timings };
+}
+
+// The Python script prints the path of the generated zip file to the last line of stdout
+// Extract the actual zip file path from the output, using the marker if present
+export function extractZipPath(scriptOutput: string): string | null {
+  const outputLines = scriptOutput.trim().split('\n').map(l => l.trim()).filter(Boolean);
+  const markerIdx = outputLines.findIndex(line => line === '===ZIP===');
+  let zipFilePath: string | null;
+  if (markerIdx !== -1 && outputLines.length > markerIdx + 1) {
+    zipFilePath = outputLines[markerIdx + 1];
+  } else {
+    // Fallback: use last line if marker not found
+    zipFilePath = outputLines[outputLines.length - 1] ?? null;
+  }
+  // Validate that the zip file path looks correct
+  if (!zipFilePath || !zipFilePath.endsWith('.zip')) {
+    return null;
+  }
+  return zipFilePath;
+}
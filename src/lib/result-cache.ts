@@ -0,0 +1,197 @@
+import { createHash } from 'crypto';
+import fs from 'fs/promises';
+import path from 'path';
+import os from 'os';
+
+// Content-addressed cache of finished conversions: the same DOCX converted with the same
+// category, question type and pipeline code always yields the same zip, so repeat uploads
+// are answered from disk without starting Python at all.
+const CACHE_ENABLED = process.env.DOC2VIZ_RESULT_CACHE !== '0';
+const CACHE_DIR = process.env.DOC2VIZ_RESULT_CACHE_DIR || path.join(os.tmpdir(), 'doc2viz-result-cache');
+const MAX_BYTES = Math.max(0, parseFloat(process.env.DOC2VIZ_RESULT_CACHE_MB || '1024') || 1024) * 1024 * 1024;
+const MAX_AGE_MS = Math.max(60_000, parseInt(process.env.DOC2VIZ_RESULT_CACHE_MAX_AGE_MS || '604800000', 10) || 604800000);
+
+const ZIP_NAME = 'result.zip';
+// Entries being written live in dot-directories next to the finished ones
+const STAGING_PREFIX = '.staging-';
+const STAGING_MAX_AGE_MS = 60 * 60 * 1000;
+
+interface CacheEntryMeta {
+  key: string;
+  category: string;
+  questionType: string;
+  size: number;
+  createdAt: number;
+  // File name of the zip the pipeline produced, after the Python side normalized the upload name
+  zipName: string;
+}
+
+export interface CachedResult {
+  zipPath: string;
+  // Null for entries stored before the name was recorded
+  zipName: string | null;
+}
+
+// Pipeline version = digest of the Python sources the script runs; recomputed only when a file changes
+const versionMemo = new Map<string, { signature: string; version: string }>();
+
+async function listPythonFiles(dir: string): Promise<string[]> {
+  try {
+    const names = await fs.readdir(dir);
+    return names.filter((name) => name.endsWith('.py')).sort().map((name) => path.join(dir, name));
+  } catch {
+    return [];
+  }
+}
+
+export async function pipelineVersion(scriptPath: string): Promise<string> {
+  const variantDir = path.dirname(scriptPath);
+  const files = [
+    ...(await listPythonFiles(variantDir)),
+    ...(await listPythonFiles(path.join(path.dirname(variantDir), 'common'))),
+  ];
+  const stats = await Promise.all(files.map((file) => fs.stat(file)));
+  const signature = files.map((file, i) => `${file}:${stats[i].size}:${stats[i].mtimeMs}`).join('|');
+  const memo = versionMemo.get(scriptPath);
+  if (memo && memo.signature === signature) {
+    return memo.version;
+  }
+  const hash = createHash('sha256');
+  for (const file of files) {
+    hash.update(path.relative(path.dirname(variantDir), file));
+    hash.update(await fs.readFile(file));
+  }
+  const version = hash.digest('hex').slice(0, 16);
+  versionMemo.set(scriptPath, { signature, version });
+  return version;
+}
+
+// Environment settings that change the rendered images, so results made under other values are not reused
+const RENDER_SETTING_ENVS = [
+  'DOC2VIZ_OUTPUT_FORMAT',
+  'DOC2VIZ_ENCODER_PRESET',
+  'DOC2VIZ_CANVAS_MODE',
+  'DOC2VIZ_SPRITES',
+  'DOC2VIZ_SVG_FIGURES',
+  'DOC2VIZ_VISUALS_READER',
+  'DOC2VIZ_PREVIEW_WIDTH',
+];
+
+export async function resultCacheKey(fileBuffer: Buffer, category: string, questionType: string, scriptPath: string): Promise<string> {
+  const version = await pipelineVersion(scriptPath);
+  const settings = RENDER_SETTING_ENVS.map((name) => `${name}=${process.env[name] || ''}`).join('\0');
+  return createHash('sha256')
+    .update(createHash('sha256').update(fileBuffer).digest('hex'))
+    .update('\0' + category + '\0' + questionType + '\0' + version + '\0' + settings)
+    .digest('hex');
+}
+
+function entryDir(key: string) {
+  return path.join(CACHE_DIR, key);
+}
+
+// Cached zip and its original name for key, or null on a miss. Hits refresh the entry's recency for eviction.
+export async function lookupResult(key: string): Promise<CachedResult | null> {
+  if (!CACHE_ENABLED) {
+    return null;
+  }
+  const zipPath = path.join(entryDir(key), ZIP_NAME);
+  try {
+    const stat = await fs.stat(zipPath);
+    // mtime is bumped on every hit, so the age limit applies to time since last use
+    if (Date.now() - stat.mtimeMs > MAX_AGE_MS) {
+      await fs.rm(entryDir(key), { recursive: true, force: true });
+      return null;
+    }
+    const now = new Date();
+    await fs.utimes(zipPath, now, now);
+    let zipName: string | null = null;
+    try {
+      const meta: Partial<CacheEntryMeta> = JSON.parse(await fs.readFile(path.join(entryDir(key), 'meta.json'), 'utf8'));
+      zipName = typeof meta.zipName === 'string' && meta.zipName ? path.basename(meta.zipName) : null;
+    } catch {
+      // Older entry without metadata; the caller picks a name
+    }
+    return { zipPath, zipName };
+  } catch {
+    return null;
+  }
+}
+
+// Copy a freshly produced zip into the cache, then trim the cache to its size and age limits
+export async function storeResult(key: string, zipPath: string, info: { category: string; questionType: string }) {
+  if (!CACHE_ENABLED) {
+    return;
+  }
+  // The entry is assembled in a sibling staging directory and renamed into place whole, so lookups
+  // and a concurrent evict() only ever see complete entries
+  const stagingDir = path.join(CACHE_DIR, `${STAGING_PREFIX}${key}.${process.pid}.${Date.now()}`);
+  try {
+    await fs.mkdir(stagingDir, { recursive: true });
+    await fs.copyFile(zipPath, path.join(stagingDir, ZIP_NAME));
+    const { size } = await fs.stat(path.join(stagingDir, ZIP_NAME));
+    const meta: CacheEntryMeta = { key, ...info, size, createdAt: Date.now(), zipName: path.basename(zipPath) };
+    await fs.writeFile(path.join(stagingDir, 'meta.json'), JSON.stringify(meta));
+    try {
+      await fs.rename(stagingDir, entryDir(key));
+    } catch {
+      // Another conversion of the same document stored its (identical) result first
+    }
+    await evict();
+  } catch (error) {
+    console.error('Failed to store conversion result in cache:', error);
+  } finally {
+    await fs.rm(stagingDir, { recursive: true, force: true }).catch(() => undefined);
+  }
+}
+
+async function evict() {
+  let keys: string[];
+  try {
+    keys = await fs.readdir(CACHE_DIR);
+  } catch {
+    return;
+  }
+  const entries: { key: string; size: number; usedAt: number }[] = [];
+  for (const key of keys) {
+    if (key.startsWith(STAGING_PREFIX)) {
+      // Another storeResult may still be filling it; only leftovers of a crashed process are removed
+      try {
+        const stat = await fs.stat(entryDir(key));
+        if (Date.now() - stat.mtimeMs > STAGING_MAX_AGE_MS) {
+          await fs.rm(entryDir(key), { recursive: true, force: true });
+        }
+      } catch {
+        // Renamed into place or removed meanwhile
+      }
+      continue;
+    }
+    try {
+      const stat = await fs.stat(path.join(entryDir(key), ZIP_NAME));
+      entries.push({ key, size: stat.size, usedAt: stat.mtimeMs });
+    } catch {
+      // Entries only appear complete, so this is a foreign or damaged directory
+      await fs.rm(entryDir(key), { recursive: true, force: true }).catch(() => undefined);
+    }
+  }
+  const now = Date.now();
+  let total = 0;
+  const live = [];
+  for (const entry of entries) {
+    if (now - entry.usedAt > MAX_AGE_MS) {
+      await fs.rm(entryDir(entry.key), { recursive: true, force: true }).catch(() => undefined);
+    } else {
+      total += entry.size;
+      live.push(entry);
+    }
+  }
+  // Least recently used first
+  live.sort((a, b) => a.usedAt - b.usedAt);
+  for (const entry of live) {
+    if (total <= MAX_BYTES) {
+      break;
+    }
+    await fs.rm(entryDir(entry.key), { recursive: true, force: true }).catch(() => undefined);
+    total -= entry.size;
+  }
+}